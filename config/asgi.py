@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Route the storefront to store.async_views
+os.environ.setdefault('STORE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # Outermost, so its total covers the rest of the stack (see store/instrumentation.py)
+    'store.instrumentation.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -68,7 +70,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to store.instrumentation
+        'BACKEND': 'store.instrumentation.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],  # project-level templates folder
         'APP_DIRS': True,
         'OPTIONS': {
@@ -76,7 +79,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'store.context_processors.recent_orders',
+                'store.context_processors.storefront',
             ],
         },
     },
@@ -179,7 +182,7 @@ DEFAULT_FROM_EMAIL = 'noreply@fashionstore.com'
 # DRF Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.auth_cache.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -187,16 +190,39 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Constant state per client, see store/throttling.py
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'store.throttling.AnonRateThrottle',
+        'store.throttling.UserRateThrottle',
+        'store.throttling.ScopedRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
+        'user': '1000/day',
+        'search': '60/min',
+        'checkout': '10/min',
     }
 }
 
+# 'sliding-window' or 'gcra'; the storage must be shared for limits to hold
+# across workers (see store/throttling.py)
+THROTTLE_ALGORITHM = 'sliding-window'
+THROTTLE_STORAGE = 'store.throttling.CacheStorage'
+THROTTLE_SQLITE_PATH = BASE_DIR / 'throttle.sqlite3'
+
+# Users are resolved per request from a short-lived cache (see users/auth_cache.py);
+# ModelBackend stays so sessions logged in through it keep working
+AUTHENTICATION_BACKENDS = [
+    'users.auth_cache.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# How long other workers may lag an invalidation: AUTH_CACHE_LOCAL_SECONDS when
+# CACHES is shared between them, AUTH_CACHE_SECONDS with the default local-memory cache
+AUTH_CACHE_SECONDS = 60        # shared cache
+AUTH_CACHE_LOCAL_SECONDS = 5   # per process
+AUTH_CACHE_LOCAL_MAX_ENTRIES = 10000
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -240,4 +266,50 @@ CSRF_COOKIE_HTTPONLY = True
 CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SECURE_BROWSER_XSS_FILTER = True
-SECURE_CONTENT_TYPE_NOSNIFF = True
\ No newline at end of file
+SECURE_CONTENT_TYPE_NOSNIFF = True
+# Trending products (see store/trending.py)
+TRENDING_HALF_LIFE_DAYS = 7
+TRENDING_WINDOW_DAYS = 30
+
+# Featured products: seconds each random sample stays fixed across instances (0 = new sample per request)
+FEATURED_ROTATION_SECONDS = 0
+
+# Anonymous full-page cache for storefront pages (see store/page_cache.py)
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 300
+
+# Product search (see store/search.py)
+PRODUCT_SEARCH_BACKEND = 'store.search.InvertedIndexBackend'
+PRODUCT_SEARCH_MAX_RESULTS = 1000
+
+# Price bucket edges of the products API's price facet (see store/facets.py);
+# run manage.py rebuild_facets after changing them
+PRODUCT_PRICE_BUCKETS = [25, 50, 100, 250]
+
+# Cart storage for logged-in users: 'db' (CartItem rows) or 'cache' (write-behind, see store/cart.py)
+CART_STORE = 'db'
+
+# Order IDs (see store/order_ids.py): a distinct 0-1023 per worker process, or
+# unset to lease one from the cache (which only coordinates workers sharing it;
+# otherwise collisions are made unlikely and retried at checkout)
+ORDER_ID_NODE = int(os.environ['ORDER_ID_NODE']) if os.environ.get('ORDER_ID_NODE') else None
+
+# How long a cart line holds its stock, in seconds (see store/reservations.py)
+STOCK_RESERVATION_SECONDS = 900
+
+# Per-user cart summary / recent orders cache (see store/storefront.py)
+STOREFRONT_CACHE_TIMEOUT = 300
+
+# Responsive product images (see store/images.py)
+PRODUCT_IMAGE_WIDTHS = [160, 320, 640, 1024]
+PRODUCT_IMAGE_QUALITY = 80
+
+# Async storefront views (store/async_views.py); config/asgi.py turns them on
+STORE_ASYNC_VIEWS = os.environ.get('STORE_ASYNC_VIEWS') == '1'
+# Let async views run independent queries on separate threads/connections
+STORE_PARALLEL_QUERIES = True
+
+# Request timing (see store/instrumentation.py)
+REQUEST_TIMING_HEADER = True           # send Server-Timing
+REQUEST_TIMING_N_PLUS_ONE = 5          # runs of one SQL shape per request flagged as N+1
+REQUEST_TIMING_PUBLISH_SECONDS = 10    # how often each process shares its histograms
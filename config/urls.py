@@ -12,7 +12,7 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 
-from store.api_views import CategoryViewSet, ProductViewSet, CartViewSet, OrderViewSet
+from store.api_views import CategoryViewSet, ProductViewSet, CartViewSet, OrderViewSet, RequestTimingView
 
 # DRF Router
 router = routers.DefaultRouter()
@@ -44,6 +44,7 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/request-timings/', RequestTimingView.as_view(), name='request_timings'),
     
     # Swagger Documentation
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
@@ -4,7 +4,8 @@ from django.urls import path
 from django.shortcuts import redirect
 from django.contrib import messages
 from decimal import Decimal
-from .models import Category, Product, Order, OrderItem, CartItem
+from .models import Category, Product, Order, OrderItem, CartItem, StockReservation
+from . import orders as order_service
 
 # -----------------------
 # Category Admin
@@ -70,15 +71,49 @@ class OrderItemInline(admin.TabularInline):
         return obj.total_price()
     total_price_display.short_description = 'Total Price'
 
+# -----------------------
+# Order Value Filter
+# -----------------------
+class OrderValueFilter(admin.SimpleListFilter):
+    """Filter on the stored (indexed) order total"""
+    title = 'order value'
+    parameter_name = 'value'
+    RANGES = {
+        'lt50': (None, Decimal('50')),
+        '50-200': (Decimal('50'), Decimal('200')),
+        '200-1000': (Decimal('200'), Decimal('1000')),
+        'gte1000': (Decimal('1000'), None),
+    }
+
+    def lookups(self, request, model_admin):
+        return (
+            ('lt50', 'Under 50'),
+            ('50-200', '50 to 200'),
+            ('200-1000', '200 to 1000'),
+            ('gte1000', '1000 and above'),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.RANGES:
+            return queryset
+        low, high = self.RANGES[self.value()]
+        if low is not None:
+            queryset = queryset.filter(total_amount__gte=low)
+        if high is not None:
+            queryset = queryset.filter(total_amount__lt=high)
+        return queryset
+
 # -----------------------
 # Order Admin
 # -----------------------
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('order_id', 'get_user_email', 'created_at', 'status', 'is_paid', 'total_amount_display')
-    list_filter = ('status', 'is_paid', 'created_at')
+    list_display = ('order_id', 'get_user_email', 'created_at', 'status', 'is_paid', 'total_amount', 'item_count')
+    list_filter = ('status', 'is_paid', 'created_at', OrderValueFilter)
+    list_select_related = ('user',)
     search_fields = ('order_id', 'user__email')
-    readonly_fields = ('order_id', 'user', 'created_at', 'total_amount_display')
+    # Status changes go through the actions, which validate them and restock
+    readonly_fields = ('order_id', 'user', 'created_at', 'status', 'total_amount', 'item_count')
     inlines = [OrderItemInline]
     actions = ['mark_as_pending', 'mark_as_confirmed', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_cancelled']
     
@@ -87,41 +122,32 @@ class OrderAdmin(admin.ModelAdmin):
     get_user_email.short_description = 'User Email'
     get_user_email.admin_order_field = 'user__email'
     
-    def total_amount_display(self, obj):
-        return obj.total_amount()
-    total_amount_display.short_description = 'Total Amount'
+    def _update_status(self, request, queryset, status):
+        changed, skipped = order_service.transition(queryset, status)
+        message = f"{changed} order(s) marked as {status}."
+        if skipped:
+            message += f" {skipped} order(s) skipped: their status doesn't allow it."
+        self.message_user(request, message, messages.WARNING if skipped else messages.SUCCESS)
     
     # Status actions
     def mark_as_pending(self, request, queryset):
-        queryset.update(status='pending')
-        self.message_user(request, "Selected orders marked as pending.")
+        self._update_status(request, queryset, 'pending')
     mark_as_pending.short_description = "Mark selected orders as Pending"
     
     def mark_as_confirmed(self, request, queryset):
-        queryset.update(status='confirmed')
-        self.message_user(request, "Selected orders marked as confirmed.")
+        self._update_status(request, queryset, 'confirmed')
     mark_as_confirmed.short_description = "Mark selected orders as Confirmed"
     
     def mark_as_shipped(self, request, queryset):
-        queryset.update(status='shipped')
-        self.message_user(request, "Selected orders marked as shipped.")
+        self._update_status(request, queryset, 'shipped')
     mark_as_shipped.short_description = "Mark selected orders as Shipped"
     
     def mark_as_delivered(self, request, queryset):
-        queryset.update(status='delivered')
-        self.message_user(request, "Selected orders marked as delivered.")
+        self._update_status(request, queryset, 'delivered')
     mark_as_delivered.short_description = "Mark selected orders as Delivered"
     
     def mark_as_cancelled(self, request, queryset):
-        # Restore stock if order is cancelled
-        for order in queryset:
-            if order.status != 'cancelled':  # Only restore stock if not already cancelled
-                for item in order.items.all():
-                    product = item.product
-                    product.stock += item.quantity
-                    product.save()
-        queryset.update(status='cancelled')
-        self.message_user(request, "Selected orders marked as cancelled and stock restored.")
+        self._update_status(request, queryset, 'cancelled')
     mark_as_cancelled.short_description = "Mark selected orders as Cancelled (restores stock)"
 
 # -----------------------
@@ -142,6 +168,21 @@ class CartItemAdmin(admin.ModelAdmin):
         return obj.total_price()
     total_price_display.short_description = 'Total Price'
 
+# -----------------------
+# Stock Reservation Admin
+# -----------------------
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('get_user_email', 'product', 'quantity', 'expires_at')
+    list_filter = ('expires_at',)
+    search_fields = ('user__email', 'product__name')
+    list_select_related = ('user', 'product')
+    
+    def get_user_email(self, obj):
+        return obj.user.email
+    get_user_email.short_description = 'User Email'
+    get_user_email.admin_order_field = 'user__email'
+
 # -----------------------
 # Order Item Admin
 # -----------------------
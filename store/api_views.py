@@ -1,15 +1,55 @@
+from decimal import Decimal, InvalidOperation
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
-from django.db.models import Q
+from rest_framework.views import APIView
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Category, Product, CartItem, Order, OrderItem
+from django.utils.decorators import method_decorator
+from .models import Category, Product, CartItem, Order
+from . import checkout as checkout_service
+from . import export as order_export
+from . import orders as order_service
+from . import conditional, facets, instrumentation, page_cache, reservations, storefront
+from .conditional import conditional_get, catalog_last_modified, tag_versions
+from .search import get_backend as get_search_backend
+from .pagination import StorePagination
+from users import auth_cache
+from .cart import get_user_cart_store
 from .serializers import (
     CategorySerializer, ProductSerializer, CartItemSerializer,
-    OrderSerializer
+    OrderSerializer, OrderStatusSerializer, CartBatchSerializer
 )
 
+def _representation(request):
+    """What else selects the response body besides the data itself"""
+    return [sorted(request.query_params.lists()), request.accepted_media_type]
+
+
+def category_list_validators(request, *args, **kwargs):
+    return ['categories', *tag_versions(page_cache.CATEGORIES), *_representation(request)], None
+
+
+def product_list_validators(request, *args, **kwargs):
+    # A per-category version when the list is scoped to one category, the
+    # catalog-wide one otherwise; categories are named in every product
+    category_id = None
+    slug = request.query_params.get('category')
+    if slug:
+        category_id = next((c.id for c in storefront.category_menu() if c.slug == slug), None)
+    scope = page_cache.category_tag(category_id) if category_id else page_cache.CATALOG
+    return [
+        'products',
+        *tag_versions(scope, page_cache.CATEGORIES),
+        catalog_last_modified(category_id),
+        *_representation(request),
+    ], None
+
+
+@method_decorator(conditional_get(category_list_validators), name='list')
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -20,10 +60,22 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return [IsAdminUser()]
         return [AllowAny()]
 
+@method_decorator(conditional_get(product_list_validators), name='list')
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True)
+    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
+    pagination_class = StorePagination
+    keyset_orderings = {
+        'newest': ('-created_at', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    
+    @property
+    def throttle_scope(self):
+        # Searching is the expensive way to list products
+        return 'search' if self.request.query_params.get('search') else None
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -33,14 +85,6 @@ class ProductViewSet(viewsets.ModelViewSet):
         if category_slug:
             queryset = queryset.filter(category__slug=category_slug)
         
-        # Search functionality
-        search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | 
-                Q(description__icontains=search)
-            )
-        
         # Price range filter
         min_price = self.request.query_params.get('min_price', None)
         max_price = self.request.query_params.get('max_price', None)
@@ -49,8 +93,56 @@ class ProductViewSet(viewsets.ModelViewSet):
         if max_price:
             queryset = queryset.filter(price__lte=max_price)
         
+        if self.request.query_params.get('in_stock') in ('1', 'true'):
+            queryset = queryset.filter(stock__gt=0)
+        
+        # Search functionality (applied last so it ranks within the filtered set)
+        search = self.request.query_params.get('search', None)
+        if search:
+            queryset = get_search_backend().search(queryset, search)
+        
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets') in ('1', 'true'):
+            response.data['facets'] = self.facet_counts()
+        return response
+    
+    def facet_counts(self):
+        """Category, price bucket and in-stock counts for the filter sidebar (see store/facets.py)"""
+        params = self.request.query_params
+        prices = {}
+        for name in ('min_price', 'max_price'):
+            try:
+                prices[name] = Decimal(params[name]) if params.get(name) else None
+            except InvalidOperation:
+                raise ValidationError({name: 'Enter a number.'})
+        
+        categories = storefront.category_menu()
+        category_id = None
+        if params.get('category'):
+            # An unknown slug matches nothing
+            category_id = next((c.id for c in categories if c.slug == params['category']), 0)
+        
+        search = params.get('search')
+        base = super().get_queryset()
+        if search:
+            base = get_search_backend().search(base, search)
+        cells = facets.cells(base, bool(search), prices['min_price'], prices['max_price'])
+        counts = facets.counts(cells, category_id, params.get('in_stock') in ('1', 'true'))
+        return {
+            'category': [
+                {'id': c.id, 'slug': c.slug, 'name': c.name, 'count': counts['category'].get(c.id, 0)}
+                for c in categories
+            ],
+            'price': [
+                {'min': low, 'max': high, 'count': count}
+                for (low, high), count in zip(facets.buckets(), counts['price'])
+            ],
+            'in_stock': counts['in_stock'],
+        }
+    
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
@@ -59,38 +151,85 @@ class ProductViewSet(viewsets.ModelViewSet):
 class CartViewSet(viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = StorePagination
+    keyset_orderings = {
+        'newest': ('-added_at', '-id'),
+        'oldest': ('added_at', 'id'),
+    }
     
     def get_queryset(self):
-        return CartItem.objects.filter(user=self.request.user)
+        # Rows are the source of truth here, so flush write-behind carts first
+        get_user_cart_store(self.request.user).flush()
+        return CartItem.objects.filter(user=self.request.user).select_related('product')
     
     def create(self, request):
         product_id = request.data.get('product')
-        quantity = request.data.get('quantity', 1)
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Quantity must be a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if quantity < 1:
+            return Response(
+                {'error': 'Quantity must be at least 1'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         product = get_object_or_404(Product, id=product_id, is_active=True)
         
-        if product.stock < quantity:
+        # Stock held in other carts isn't available
+        cart = get_user_cart_store(request.user)
+        available = cart.available([product])[product.id]
+        if available < quantity:
             return Response(
-                {'error': 'Not enough stock available'},
+                {'error': 'Not enough stock available', 'available': available},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check if item already exists in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            user=request.user,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            if cart_item.quantity > product.stock:
-                cart_item.quantity = product.stock
-            cart_item.save()
+        # Add to the existing line, capped at the available stock
+        current = cart.quantity(product.id) or 0
+        if current < available and cart.add(product, min(quantity, available - current)) is None:
+            return Response(
+                {'error': 'Not enough stock available'},
+                status=status.HTTP_409_CONFLICT
+            )
         
-        serializer = self.get_serializer(cart_item)
+        # With a write-behind store the row may not exist (or be current) yet
+        line = CartItem.objects.filter(user=request.user, product=product).first()
+        if line is None:
+            line = CartItem(user=request.user, product=product)
+        line.quantity = cart.quantity(product.id)
+        serializer = self.get_serializer(line)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    def perform_update(self, serializer):
+        quantity = serializer.validated_data.get('quantity')
+        if quantity is not None and reservations.hold(self.request.user.pk, {serializer.instance.product_id: quantity}):
+            raise ValidationError({'quantity': 'Not enough stock available'})
+        super().perform_update(serializer)
+        get_user_cart_store(self.request.user).forget()
+    
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        reservations.release(self.request.user.pk, [instance.product_id])
+        get_user_cart_store(self.request.user).forget()
+    
+    @action(detail=False, methods=['post'], serializer_class=CartBatchSerializer)
+    def batch(self, request):
+        """Apply many add/set/remove operations in one request"""
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results, item_count, total = get_user_cart_store(request.user).apply(
+            serializer.validated_data['operations']
+        )
+        return Response({
+            'results': results,
+            'total_amount': total,
+            'item_count': item_count,
+        })
+    
     @action(detail=False, methods=['get'])
     def total(self, request):
         cart_items = self.get_queryset()
@@ -105,49 +244,100 @@ class CartViewSet(viewsets.ModelViewSet):
 class OrderViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = StorePagination
+    keyset_orderings = {
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+    }
+    
+    @property
+    def throttle_scope(self):
+        return 'checkout' if self.action == 'create' else None
     
     def get_queryset(self):
         user = self.request.user
+        orders = Order.objects.for_display().order_by('-created_at', '-id')
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return orders
+        return orders.filter(user=user)
     
     def create(self, request):
-        # Get user's cart items
-        cart_items = CartItem.objects.filter(user=request.user)
-        
-        if not cart_items.exists():
+        try:
+            order = checkout_service.place_order(request.user)
+        except checkout_service.CheckoutError as e:
             return Response(
-                {'error': 'Cart is empty'}, 
+                {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check stock availability for all items
-        for cart_item in cart_items:
-            if cart_item.quantity > cart_item.product.stock:
-                return Response(
-                    {'error': f'Not enough stock for {cart_item.product.name}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Create order
-        order = Order.objects.create(user=request.user)
-        
-        # Create order items and update stock
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
+        order = Order.objects.for_display().get(pk=order.pk)
+        serializer = self.get_serializer(order)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'], url_path='status')
+    def set_status(self, request, pk=None):
+        """
+        Move the order to ``{"status": ...}``. Customers may only cancel
+        their own orders; staff may make any allowed transition.
+        """
+        order = self.get_object()
+        serializer = OrderStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        target = serializer.validated_data['status']
+        if target != order_service.CANCELLED and not request.user.is_staff:
+            return Response(
+                {'error': 'Only staff can change the order status'},
+                status=status.HTTP_403_FORBIDDEN
             )
-            
-            # Update product stock
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.save()
+        try:
+            order_service.transition_order(order, target)
+        except order_service.TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
         
-        # Clear cart
-        cart_items.delete()
+        order = Order.objects.for_display().get(pk=order.pk)
+        return Response(self.get_serializer(order).data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Stream every matching order (``?kind=orders``) or order line
+        (``?kind=lines``) as CSV or JSON Lines (``?output=csv|jsonl``),
+        filtered by ``?since=``/``?until=`` dates and ``?status=a,b``.
+        """
+        params = request.query_params
+        kind = params.get('kind', order_export.ORDERS)
+        output = params.get('output', order_export.CSV)
+        statuses = [value for value in params.get('status', '').split(',') if value]
+        try:
+            chunks = order_export.stream(
+                kind,
+                output,
+                since=order_export.parse_bound(params.get('since')),
+                until=order_export.parse_bound(params.get('until'), end=True),
+                statuses=statuses,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = self.get_serializer(order)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        response = StreamingHttpResponse(chunks, content_type=order_export.CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="{order_export.filename(kind, output)}"'
+        return response
+
+class RequestTimingView(APIView):
+    """
+    Per-view p50/p95/p99 of total, DB, serializer and template time and query
+    count, likely N+1 query shapes, and the conditional GET and auth cache
+    counters. ``DELETE`` resets the request timings.
+    """
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response({
+            'views': instrumentation.report(),
+            'conditional_get': conditional.metrics(),
+            'auth_cache': auth_cache.metrics(),
+        })
+    
+    def delete(self, request):
+        instrumentation.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import instrumentation, signals  # noqa: F401
+        connection_created.connect(instrumentation.install, dispatch_uid='store.instrumentation')
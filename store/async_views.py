@@ -0,0 +1,174 @@
+"""
+Async versions of the storefront pages and cart endpoints, routed instead of
+``store.views`` when ``STORE_ASYNC_VIEWS`` is on (``config/asgi.py`` turns
+it on for ASGI deployments).
+
+Django's async ORM (``aget``, ``async for``) hands every query to the same
+thread-sensitive worker, so awaiting several of them with ``asyncio.gather``
+still runs them one after another. ``gather_queries`` instead runs each
+independent piece of work on its own pool thread, with its own database
+connection, so e.g. the home page's latest, trending and featured products
+and the storefront summary are fetched at the same time. Those connections
+follow ``CONN_MAX_AGE`` like request connections do; with the default of 0
+every piece opens a fresh one, so set it when serving over ASGI.
+
+Templates still render synchronously (in ``sync_to_async``), after
+``Storefront.preload`` has fetched everything the page chrome needs.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+
+from . import storefront, trending
+from .cart import get_cart_store
+from .conditional import conditional_get
+from .models import Category, Product
+from .page_cache import cache_anonymous_page, tag_page, product_tag, category_tag, CATALOG, CATEGORIES
+from .sampling import sampler
+from .views import fill_trending, product_detail_validators
+
+
+def _parallel():
+    # Off in tests: worker connections can't see a test case's open transaction
+    return getattr(settings, 'STORE_PARALLEL_QUERIES', True)
+
+
+def _on_worker(func):
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+async def gather_queries(*funcs):
+    """Run independent sync callables concurrently; returns their results in order"""
+    if not _parallel():
+        return [await sync_to_async(func)() for func in funcs]
+    return await asyncio.gather(*(
+        sync_to_async(_on_worker, thread_sensitive=False)(func) for func in funcs
+    ))
+
+
+async def _render(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@cache_anonymous_page
+async def home(request):
+    """Home page view"""
+    tag_page(request, CATALOG, CATEGORIES)
+    front = storefront.for_request(request)
+    latest_products, trending_products, featured_products, _ = await gather_queries(
+        lambda: list(Product.objects.filter(is_active=True).select_related('category').order_by('-created_at')[:12]),
+        lambda: trending.top_products(limit=10),
+        lambda: sampler.sample(8),
+        front.preload,
+    )
+    context = {
+        'trending_products': fill_trending(trending_products, latest_products),
+        'latest_products': latest_products,
+        'featured_products': featured_products,
+    }
+    return await _render(request, 'store/home.html', context)
+
+
+@cache_anonymous_page
+async def category_products(request, category_slug):
+    """View to display products by category"""
+    category = await aget_object_or_404(Category, slug=category_slug)
+    tag_page(request, category_tag(category.id), CATEGORIES)
+    products, _ = await gather_queries(
+        lambda: list(Product.objects.filter(category=category, is_active=True).select_related('category')),
+        storefront.for_request(request).preload,
+    )
+    context = {
+        'category': category,
+        'products': products,
+    }
+    return await _render(request, 'store/category_products.html', context)
+
+
+@conditional_get(product_detail_validators)
+@cache_anonymous_page
+async def product_detail(request, slug):
+    """Product detail view"""
+    product, _ = await gather_queries(
+        lambda: get_object_or_404(Product, slug=slug, is_active=True),
+        storefront.for_request(request).preload,
+    )
+    tag_page(request, product_tag(product.id), category_tag(product.category_id))
+    return await _render(request, 'store/product_detail.html', {'product': product})
+
+
+async def add_to_cart(request, product_id):
+    """Add product to cart (session cart for anonymous visitors)"""
+    product = await aget_object_or_404(Product, id=product_id)
+
+    def add():
+        cart = get_cart_store(request)
+        added = cart.add(product)
+        return added, cart.count() if added is not None else None
+
+    added, count = await sync_to_async(add)()
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if added is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Product is out of stock!',
+            })
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Product added to cart!',
+            'cart_count': count
+        })
+    return redirect('store:cart_view')
+
+
+async def cart_view(request):
+    """Display cart items"""
+    # Resolves the user (session + user queries) once, before fanning out
+    cart = await sync_to_async(get_cart_store)(request)
+    cart_items, _ = await gather_queries(cart.lines, storefront.for_request(request).preload)
+    context = {
+        'items': cart_items,
+        'total': sum(item.total_price() for item in cart_items),
+    }
+    return await _render(request, 'store/cart.html', context)
+
+
+async def remove_from_cart(request, product_id):
+    """Remove item from cart"""
+    def remove():
+        cart = get_cart_store(request)
+        if cart.quantity(product_id) is None:
+            raise Http404('Product is not in the cart')
+        cart.remove(product_id)
+
+    await sync_to_async(remove)()
+    return redirect('store:cart_view')
+
+
+async def increment_cart(request, product_id):
+    """Increase item quantity in cart"""
+    product = await aget_object_or_404(Product, id=product_id)
+
+    def increment():
+        return get_cart_store(request).change(product_id, 1, max_quantity=product.stock)
+
+    if await sync_to_async(increment)() is None:
+        raise Http404('Product is not in the cart')
+    return redirect('store:cart_view')
+
+
+async def decrement_cart(request, product_id):
+    """Decrease item quantity in cart (removes the line at zero)"""
+    def decrement():
+        return get_cart_store(request).change(product_id, -1)
+
+    if await sync_to_async(decrement)() is None:
+        raise Http404('Product is not in the cart')
+    return redirect('store:cart_view')
@@ -0,0 +1,369 @@
+"""
+Benchmark suite: a scale dataset and the storefront/API hot paths.
+
+``seed()`` fills the database with a configurable amount of recognisable
+data (``bench-*`` slugs, ``bench-*@example.com`` users, ``BENCH*`` order
+ids). Row generation and ``bulk_create`` run in a pool of forked worker
+processes, each with its own connection and its own slice of every table,
+committing one batch at a time. On SQLite the inserts still serialize on
+the database lock, so there the extra workers mostly parallelize building
+the rows. ``clear()`` removes everything ``seed()`` made.
+
+``run()`` drives the hot paths through the full middleware stack with
+``concurrency`` client threads, each logged in as its own benchmark user,
+and returns throughput, p50/p99 latency and queries per request per
+scenario. ``compare()`` checks such a result against a stored baseline.
+
+Used by ``manage.py seed_benchmark_data`` and ``manage.py bench_suite``;
+point ``--settings`` at a MySQL settings module to benchmark MySQL. On
+SQLite, concurrent write scenarios need ``"transaction_mode": "IMMEDIATE"``
+in the database ``OPTIONS``, or upgrading a read transaction to a write
+fails at once with "database is locked" (counted as errors).
+"""
+import multiprocessing
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.views import APIView
+
+from . import facets, page_cache
+from .cart import get_user_cart_store
+from .models import CartItem, Category, Order, OrderItem, Product
+from .sampling import sampler
+from users.models import User
+
+PREFIX = 'bench'
+ORDER_PREFIX = 'BENCH'
+
+SCALES = {
+    'small': {'categories': 10, 'products': 2000, 'users': 100, 'orders': 1000, 'cart_items': 300},
+    'medium': {'categories': 30, 'products': 50000, 'users': 2000, 'orders': 20000, 'cart_items': 5000},
+    'large': {'categories': 100, 'products': 500000, 'users': 20000, 'orders': 200000, 'cart_items': 50000},
+}
+
+SCENARIOS = ('home', 'category_products', 'api_search', 'add_to_cart', 'place_order', 'api_order_create')
+SEARCH_TERMS = ('jacket', 'black shirt', 'sneaker', 'warm brown coat', 'denim')
+
+ADJECTIVES = 'black white red blue green brown khaki pink yellow grey slim classic warm casual formal'.split()
+NOUNS = 'shirt jacket jeans dress skirt sandal sneaker boot heel kurti trouser top coat slipper'.split()
+STATUSES = ('pending', 'confirmed', 'shipped', 'delivered', 'delivered', 'cancelled')
+STOCK = 10 ** 6
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back, for write benchmarks"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def _slices(total, parts):
+    """Split ``range(total)`` into up to ``parts`` contiguous ``(start, stop)`` slices"""
+    size, extra = divmod(total, parts)
+    slices, start = [], 0
+    for part in range(parts):
+        stop = start + size + (part < extra)
+        if stop > start:
+            slices.append((start, stop))
+        start = stop
+    return slices
+
+
+def _batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def _insert(model, rows, batch_size):
+    # One transaction per batch keeps the SQLite write lock short
+    for batch in _batches(rows, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+
+
+# -----------------------
+# Seeding (each function runs in a worker process)
+# -----------------------
+def _seed_products(start, stop, category_ids, batch_size):
+    rng = random.Random(start)
+    rows = [
+        Product(
+            category_id=category_ids[i % len(category_ids)],
+            name=f'{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+            slug=f'{PREFIX}-p-{i}',
+            description=' '.join(rng.choice(ADJECTIVES + NOUNS) for _ in range(12)),
+            price=Decimal(rng.randrange(500, 20000)) / 100,
+            stock=STOCK,
+        )
+        for i in range(start, stop)
+    ]
+    _insert(Product, rows, batch_size)
+    return len(rows)
+
+
+def _seed_users(start, stop, password, batch_size):
+    rows = [User(email=f'{PREFIX}-{i}@example.com', password=password) for i in range(start, stop)]
+    _insert(User, rows, batch_size)
+    return len(rows)
+
+
+def _seed_orders(start, stop, user_ids, products, batch_size):
+    """``products`` is ``[(id, price)]``"""
+    rng = random.Random(start)
+    orders, lines = [], {}
+    for i in range(start, stop):
+        order_id = f'{ORDER_PREFIX}{i:012d}'
+        picked = rng.sample(products, rng.randint(1, min(5, len(products))))
+        quantities = [rng.randint(1, 3) for _ in picked]
+        lines[order_id] = list(zip(picked, quantities))
+        orders.append(Order(
+            user_id=user_ids[i % len(user_ids)],
+            order_id=order_id,
+            status=rng.choice(STATUSES),
+            is_paid=True,
+            total_amount=sum(price * quantity for (_, price), quantity in lines[order_id]),
+            item_count=len(picked),
+        ))
+    for batch in _batches(orders, batch_size):
+        with transaction.atomic():
+            Order.objects.bulk_create(batch)
+            # MySQL doesn't return primary keys from bulk_create
+            ids = dict(Order.objects.filter(order_id__in=[o.order_id for o in batch]).values_list('order_id', 'pk'))
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=ids[order.order_id], product_id=product_id, price=price, quantity=quantity)
+                for order in batch
+                for (product_id, price), quantity in lines[order.order_id]
+            ])
+    return len(orders)
+
+
+def _seed_cart_items(start, stop, user_ids, product_ids, batch_size):
+    rng = random.Random(start)
+    rows, seen = [], set()
+    for i in range(start, stop):
+        pair = (user_ids[i % len(user_ids)], rng.choice(product_ids))
+        if pair not in seen:
+            seen.add(pair)
+            rows.append(CartItem(user_id=pair[0], product_id=pair[1], quantity=rng.randint(1, 3)))
+    for batch in _batches(rows, batch_size):
+        with transaction.atomic():
+            CartItem.objects.bulk_create(batch, ignore_conflicts=True)
+    return len(rows)
+
+
+def _run_sliced(pool, func, total, workers, *args):
+    futures = [pool.submit(func, start, stop, *args) for start, stop in _slices(total, workers)]
+    return sum(future.result() for future in futures)
+
+
+def seed(categories, products, users, orders, cart_items, workers=None, batch_size=2000, log=print):
+    """Create the benchmark dataset; returns ``{table: rows}``"""
+    workers = workers or multiprocessing.cpu_count()
+    started = time.perf_counter()
+    counts = {}
+
+    Category.objects.bulk_create([
+        Category(name=f'Bench {i}', slug=f'{PREFIX}-c-{i}') for i in range(categories)
+    ])
+    category_ids = list(Category.objects.filter(slug__startswith=f'{PREFIX}-c-').values_list('pk', flat=True))
+    counts['categories'] = categories
+
+    # Forked workers must not share the parent's open connections
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        counts['products'] = _run_sliced(pool, _seed_products, products, workers, category_ids, batch_size)
+        log(f'products: {counts["products"]} ({time.perf_counter() - started:.1f}s)')
+        # Every benchmark user shares one hash; hashing per user would dominate
+        password = make_password(PREFIX)
+        counts['users'] = _run_sliced(pool, _seed_users, users, workers, password, batch_size)
+        log(f'users: {counts["users"]} ({time.perf_counter() - started:.1f}s)')
+
+        user_ids = list(User.objects.filter(email__startswith=f'{PREFIX}-').values_list('pk', flat=True))
+        product_rows = list(Product.objects.filter(slug__startswith=f'{PREFIX}-p-').values_list('pk', 'price'))
+        connections.close_all()
+        counts['orders'] = _run_sliced(pool, _seed_orders, orders, workers, user_ids, product_rows, batch_size)
+        log(f'orders: {counts["orders"]} ({time.perf_counter() - started:.1f}s)')
+        counts['cart_items'] = _run_sliced(
+            pool, _seed_cart_items, cart_items, workers, user_ids, [pk for pk, _ in product_rows], batch_size
+        )
+        log(f'cart items: {counts["cart_items"]} ({time.perf_counter() - started:.1f}s)')
+
+    # bulk_create bypasses the signals that keep these in step
+    call_command('rebuild_search_index', verbosity=0)
+    call_command('rebuild_trending', verbosity=0)
+    facets.refresh()
+    sampler.invalidate()
+    page_cache.purge(page_cache.CATALOG, page_cache.CATEGORIES, *[page_cache.category_tag(pk) for pk in category_ids])
+    counts['seconds'] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def clear():
+    """Delete everything ``seed()`` created (orders and carts go with their users)"""
+    User.objects.filter(email__startswith=f'{PREFIX}-', email__endswith='@example.com').delete()
+    Product.objects.filter(slug__startswith=f'{PREFIX}-p-').delete()
+    Category.objects.filter(slug__startswith=f'{PREFIX}-c-').delete()
+    call_command('rebuild_search_index', verbosity=0)
+    facets.refresh()
+    sampler.invalidate()
+    page_cache.purge(page_cache.CATALOG, page_cache.CATEGORIES)
+
+
+# -----------------------
+# Driving the hot paths
+# -----------------------
+class Fixtures:
+    """What the scenarios pick from, loaded once"""
+
+    def __init__(self, sample=500):
+        self.users = list(User.objects.filter(email__startswith=f'{PREFIX}-').order_by('pk')[:sample])
+        self.category_slugs = list(
+            Category.objects.filter(slug__startswith=f'{PREFIX}-c-').values_list('slug', flat=True)
+        )
+        self.product_ids = list(
+            Product.objects.filter(slug__startswith=f'{PREFIX}-p-', is_active=True)
+            .order_by('?').values_list('pk', flat=True)[:sample]
+        )
+        if not (self.users and self.category_slugs and self.product_ids):
+            raise ValueError('No benchmark data; run manage.py seed_benchmark_data first')
+
+
+def _request(scenario, client, rng, fixtures):
+    """Issue one request of ``scenario``; returns ``(response, ok)``"""
+    if scenario == 'home':
+        response = client.get('/')
+    elif scenario == 'category_products':
+        response = client.get(f'/category/{rng.choice(fixtures.category_slugs)}/')
+    elif scenario == 'api_search':
+        response = client.get('/api/products/', {'search': rng.choice(SEARCH_TERMS)})
+    elif scenario == 'add_to_cart':
+        response = client.get(
+            f'/cart/add/{rng.choice(fixtures.product_ids)}/', headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+    elif scenario == 'place_order':
+        response = client.post('/checkout/place_order/')
+        # Failures redirect back to the cart
+        return response, response.status_code == 302 and '/orders/' in response['Location']
+    elif scenario == 'api_order_create':
+        response = client.post('/api/orders/')
+    else:
+        raise ValueError(f'Unknown scenario: {scenario}')
+    return response, response.status_code < 400
+
+
+def _prepare(scenario, user, rng, fixtures):
+    """Untimed setup before each request (checkouts need something in the cart)"""
+    if scenario in ('place_order', 'api_order_create'):
+        product = Product.objects.get(pk=rng.choice(fixtures.product_ids))
+        get_user_cart_store(user).add(product, rng.randint(1, 3))
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+@contextmanager
+def _unthrottled():
+    """Without the API throttles: bench users soon use up the search and checkout rates"""
+    # Views take DEFAULT_THROTTLE_CLASSES when DRF is imported, so overriding
+    # the setting here would change nothing
+    throttle_classes = APIView.throttle_classes
+    APIView.throttle_classes = []
+    try:
+        yield
+    finally:
+        APIView.throttle_classes = throttle_classes
+
+
+def run_scenario(scenario, fixtures, concurrency=1, requests=200, seed=0):
+    def worker(index, count):
+        rng = random.Random(seed * 1000 + index)
+        user = fixtures.users[index % len(fixtures.users)]
+        # A failed request (e.g. SQLite's "database is locked") counts as an error
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        latencies, queries, errors = [], 0, 0
+        for _ in range(count):
+            _prepare(scenario, user, rng, fixtures)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response, ok = _request(scenario, client, rng, fixtures)
+                latencies.append(time.perf_counter() - started)
+            queries += len(captured.captured_queries)
+            errors += not ok
+        return latencies, queries, errors
+
+    shares = [stop - start for start, stop in _slices(requests, concurrency)]
+    started = time.perf_counter()
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), _unthrottled():
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, range(len(shares)), shares))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for result in results for latency in result[0]]
+    return {
+        'requests': len(latencies),
+        'errors': sum(result[2] for result in results),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        'queries_per_request': round(sum(result[1] for result in results) / max(len(latencies), 1), 2),
+    }
+
+
+def run(scenarios=SCENARIOS, concurrency=(1,), requests=200, warmup=10, log=print):
+    """``{'meta': ..., 'results': {'<scenario>@<concurrency>': stats}}``"""
+    fixtures = Fixtures()
+    results = {}
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise ValueError(f'Unknown scenario: {scenario}')
+        if warmup:
+            run_scenario(scenario, fixtures, 1, warmup, seed=-1)
+        for clients in concurrency:
+            stats = run_scenario(scenario, fixtures, clients, requests)
+            results[f'{scenario}@{clients}'] = stats
+            log(f"{scenario}@{clients}: {stats['throughput_rps']} req/s, p99 {stats['p99_ms']} ms")
+    return {
+        'meta': {
+            'vendor': connection.vendor,
+            'requests': requests,
+            'concurrency': list(concurrency),
+            'products': Product.objects.count(),
+            'orders': Order.objects.count(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=0.15):
+    """
+    Regressions of ``current`` against ``baseline``: throughput down, p99 or
+    queries per request up by more than ``tolerance``. Returns a list of
+    ``(key, metric, baseline value, current value)``.
+    """
+    regressions = []
+    for key, stats in current['results'].items():
+        before = baseline.get('results', {}).get(key)
+        if before is None:
+            continue
+        if stats['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append((key, 'throughput_rps', before['throughput_rps'], stats['throughput_rps']))
+        for metric in ('p99_ms', 'queries_per_request'):
+            if stats[metric] > before[metric] * (1 + tolerance) and stats[metric] - before[metric] > 0.5:
+                regressions.append((key, metric, before[metric], stats[metric]))
+    return regressions
@@ -0,0 +1,510 @@
+"""
+Cart storage.
+
+``get_cart_store(request)`` returns the cart for the current visitor:
+
+* ``DatabaseCartStore`` - reads and writes ``CartItem`` rows directly (the
+  original behaviour, and the default).
+* ``CacheCartStore`` - keeps the whole cart as one ``{product_id: quantity}``
+  entry per user in the cache and writes it back to ``CartItem`` later
+  (write-behind): on checkout, when the API lists rows, or in batches from
+  ``manage.py flush_carts``. Use a persistent cache (Redis, file) for it;
+  entries never expire so an evicting cache would lose unflushed carts.
+* ``SessionCartStore`` - anonymous visitors; merged into the user's cart on
+  login.
+
+Select the user store with ``CART_STORE = 'db' | 'cache'``. User stores send
+``cart_changed`` whenever a cart's contents change, and hold stock for every
+line they grow (``store.reservations``); the session store only checks stock.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.dispatch import Signal
+
+from . import reservations
+from .locks import cache_lock
+from .models import Product, CartItem
+
+# Users with unflushed cached carts: a marker per user, and the ids in one of
+# DIRTY_SHARDS sets for flush_dirty_carts to scan
+DIRTY_MARKER = 'cart:dirty:user:{}'
+DIRTY_KEY = 'cart:dirty:{}'
+DIRTY_SHARDS = 16
+SESSION_KEY = 'cart'
+
+# Batch operations
+BATCH_ADD = 'add'
+BATCH_SET = 'set'
+BATCH_REMOVE = 'remove'
+BATCH_OPS = (BATCH_ADD, BATCH_SET, BATCH_REMOVE)
+
+# Sent with ``user_id`` after a logged-in user's cart changed
+cart_changed = Signal()
+
+
+def _upsert_lines(lines):
+    """Insert or update ``CartItem`` rows on the (user, product) constraint"""
+    unique_fields = ['user', 'product'] if connection.features.supports_update_conflicts_with_target else None
+    CartItem.objects.bulk_create(
+        lines,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['quantity'],
+    )
+
+
+class BaseCartStore:
+    def items(self):
+        """``{product_id: quantity}`` for every line in the cart"""
+        raise NotImplementedError
+
+    def _write(self, product_id, quantity):
+        """Set one line; a quantity of 0 removes it"""
+        raise NotImplementedError
+
+    def quantity(self, product_id):
+        return self.items().get(product_id)
+
+    def _reserve(self, quantities, limits):
+        """
+        Make sure the new line ``quantities`` can be had; returns the refused
+        product ids. ``limits`` is the stock of products the caller knows it
+        for. This store holds nothing and only checks those limits.
+        """
+        return {
+            product_id for product_id, quantity in quantities.items()
+            if product_id in limits and quantity > limits[product_id]
+        }
+
+    def available(self, products):
+        """``{product_id: how many this cart may hold}`` for ``products``"""
+        return {product.pk: product.stock for product in products}
+
+    def count(self):
+        """Number of distinct products, as shown on the cart badge"""
+        return len(self.items())
+
+    def add(self, product, quantity=1):
+        """
+        Add ``quantity`` of ``product`` without exceeding its stock.
+
+        Returns the new line quantity, or ``None`` if it would exceed stock.
+        """
+        current = self.quantity(product.id) or 0
+        if self._reserve({product.id: current + quantity}, {product.id: product.stock}):
+            return None
+        self._write(product.id, current + quantity)
+        return current + quantity
+
+    def change(self, product_id, delta, max_quantity=None):
+        """Adjust an existing line; dropping to zero removes it"""
+        current = self.quantity(product_id)
+        if current is None:
+            return None
+        new = max(current + delta, 0)
+        limits = {} if max_quantity is None else {product_id: max_quantity}
+        if self._reserve({product_id: new}, limits):
+            return current
+        self._write(product_id, new)
+        return new
+
+    def remove(self, product_id):
+        self._reserve({product_id: 0}, {})
+        self._write(product_id, 0)
+
+    def apply(self, operations):
+        """
+        Apply a batch of ``{'product', 'quantity', 'op'}`` operations.
+
+        ``op`` is ``add`` (default), ``set`` or ``remove``. Products are loaded
+        with one ``in_bulk``, availability with one aggregate, and checked in
+        memory; an operation that fails leaves its line alone and the rest
+        still apply. Returns ``(results, count, total)`` where results has one
+        entry per operation.
+        """
+        items = self.items()
+        wanted = {op['product'] for op in operations}
+        products = Product.objects.filter(is_active=True).in_bulk(list(wanted | set(items)))
+        limits = self.available([products[product_id] for product_id in wanted if product_id in products])
+        quantities = dict(items)
+        results = []
+        for op in operations:
+            product_id, quantity, kind = op['product'], op.get('quantity', 1), op.get('op', BATCH_ADD)
+            product = products.get(product_id)
+            current = quantities.get(product_id, 0)
+            if product is None:
+                results.append({'product': product_id, 'op': kind, 'status': 'error', 'error': 'Product not found'})
+                continue
+            if kind == BATCH_REMOVE:
+                new = 0
+            elif kind == BATCH_SET:
+                new = quantity
+            else:
+                new = current + quantity
+            if new > current and new > limits[product_id]:
+                results.append({
+                    'product': product_id, 'op': kind, 'status': 'error',
+                    'error': 'Not enough stock available', 'quantity': current, 'available': limits[product_id],
+                })
+                continue
+            quantities[product_id] = new
+            results.append({'product': product_id, 'op': kind, 'status': 'ok', 'quantity': new})
+
+        changes = {
+            product_id: quantity
+            for product_id, quantity in quantities.items()
+            if quantity != items.get(product_id, 0)
+        }
+        # Someone may have taken the stock since the check above
+        for product_id in self._reserve(changes, limits):
+            del changes[product_id]
+            quantities[product_id] = items.get(product_id, 0)
+            for result in results:
+                if result['product'] == product_id and result['status'] == 'ok':
+                    result.update(status='error', error='Not enough stock available', quantity=items.get(product_id, 0))
+        if changes:
+            self._write_many(changes)
+        remaining = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        total = sum(
+            (products[product_id].price * quantity for product_id, quantity in remaining.items() if product_id in products),
+            Decimal('0.00'),
+        )
+        return results, len(remaining), total
+
+    def _write_many(self, changes):
+        """Set several lines at once, ``{product_id: quantity}``"""
+        for product_id, quantity in changes.items():
+            self._write(product_id, quantity)
+
+    def summary(self):
+        """``(distinct products, total price)`` of the cart"""
+        items = self.items()
+        if not items:
+            return 0, Decimal('0.00')
+        prices = Product.objects.filter(id__in=list(items)).values_list('id', 'price')
+        return len(items), sum((price * items[product_id] for product_id, price in prices), Decimal('0.00'))
+
+    def lines(self):
+        """Unsaved ``CartItem`` objects (with products loaded) for templates"""
+        items = self.items()
+        products = Product.objects.select_related('category').in_bulk(list(items))
+        return [
+            CartItem(product=products[product_id], quantity=quantity)
+            for product_id, quantity in items.items()
+            if product_id in products
+        ]
+
+    def flush(self):
+        """Persist pending changes to ``CartItem``"""
+
+    def forget(self):
+        """Drop any cached copy, e.g. after ``CartItem`` rows changed directly"""
+
+
+class UserCartStore(BaseCartStore):
+    """A logged-in user's cart: growing a line holds the stock for it"""
+
+    user_id = None
+
+    def _reserve(self, quantities, limits):
+        return reservations.hold(self.user_id, quantities)
+
+    def available(self, products):
+        return reservations.available(products, user_id=self.user_id)
+
+
+class DatabaseCartStore(UserCartStore):
+    def __init__(self, user):
+        self.user = user
+        self.user_id = user.pk
+
+    def items(self):
+        return dict(CartItem.objects.filter(user=self.user).values_list('product_id', 'quantity'))
+
+    def quantity(self, product_id):
+        return CartItem.objects.filter(user=self.user, product_id=product_id).values_list(
+            'quantity', flat=True
+        ).first()
+
+    def count(self):
+        return CartItem.objects.filter(user=self.user).count()
+
+    def _write(self, product_id, quantity):
+        if quantity <= 0:
+            CartItem.objects.filter(user=self.user, product_id=product_id).delete()
+        else:
+            CartItem.objects.update_or_create(
+                user=self.user, product_id=product_id, defaults={'quantity': quantity}
+            )
+        cart_changed.send(sender=type(self), user_id=self.user.pk)
+
+    def apply(self, operations):
+        # Lock the user's lines so concurrent batches serialize
+        with transaction.atomic():
+            list(CartItem.objects.select_for_update().filter(user=self.user).values_list('id'))
+            return super().apply(operations)
+
+    def _write_many(self, changes):
+        rows = {
+            line.product_id: line
+            for line in CartItem.objects.filter(user=self.user, product_id__in=list(changes))
+        }
+        created, updated, removed = [], [], []
+        for product_id, quantity in changes.items():
+            line = rows.get(product_id)
+            if quantity <= 0:
+                if line is not None:
+                    removed.append(line.id)
+            elif line is None:
+                created.append(CartItem(user=self.user, product_id=product_id, quantity=quantity))
+            else:
+                line.quantity = quantity
+                updated.append(line)
+        if removed:
+            CartItem.objects.filter(id__in=removed).delete()
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity'])
+        if created:
+            CartItem.objects.bulk_create(created)
+        cart_changed.send(sender=type(self), user_id=self.user.pk)
+
+    def summary(self):
+        totals = CartItem.objects.filter(user=self.user).aggregate(
+            count=Count('id'),
+            total=Sum(F('quantity') * F('product__price')),
+        )
+        return totals['count'], totals['total'] or Decimal('0.00')
+
+    def lines(self):
+        return list(CartItem.objects.filter(user=self.user).select_related('product__category'))
+
+    def forget(self):
+        cart_changed.send(sender=type(self), user_id=self.user.pk)
+
+
+class CacheCartStore(UserCartStore):
+    def __init__(self, user):
+        self.user_id = user.pk
+        self.key = f'cart:user:{self.user_id}'
+
+    def _load(self):
+        entry = cache.get(self.key)
+        if entry is None:
+            items = dict(CartItem.objects.filter(user_id=self.user_id).values_list('product_id', 'quantity'))
+            entry = {'items': items, 'dirty': False}
+            cache.add(self.key, entry, None)
+        return entry
+
+    def items(self):
+        return dict(self._load()['items'])
+
+    def add(self, product, quantity=1):
+        # Read-check-write under the cart lock so concurrent clicks add up
+        with cache_lock(self.key):
+            entry = self._load()
+            current = entry['items'].get(product.id, 0)
+            if self._reserve({product.id: current + quantity}, {}):
+                return None
+            entry['items'][product.id] = current + quantity
+            self._save(entry)
+            return current + quantity
+
+    def change(self, product_id, delta, max_quantity=None):
+        with cache_lock(self.key):
+            entry = self._load()
+            current = entry['items'].get(product_id)
+            if current is None:
+                return None
+            new = current + delta
+            if self._reserve({product_id: max(new, 0)}, {}):
+                return current
+            if new <= 0:
+                del entry['items'][product_id]
+            else:
+                entry['items'][product_id] = new
+            self._save(entry)
+            return max(new, 0)
+
+    def _write(self, product_id, quantity):
+        with cache_lock(self.key):
+            self._write_many({product_id: quantity})
+
+    def remove(self, product_id):
+        self._reserve({product_id: 0}, {})
+        self._write(product_id, 0)
+
+    def apply(self, operations):
+        # One read-modify-write of the cart entry for the whole batch
+        with cache_lock(self.key):
+            return super().apply(operations)
+
+    def _write_many(self, changes):
+        # Callers hold the cart lock
+        entry = self._load()
+        for product_id, quantity in changes.items():
+            if quantity <= 0:
+                entry['items'].pop(product_id, None)
+            else:
+                entry['items'][product_id] = quantity
+        self._save(entry)
+
+    def _save(self, entry):
+        entry['dirty'] = True
+        cache.set(self.key, entry, None)
+        cart_changed.send(sender=type(self), user_id=self.user_id)
+        # Only the first change since the last flush touches a shared set
+        marker = DIRTY_MARKER.format(self.user_id)
+        if cache.add(marker, 1, None):
+            try:
+                _update_dirty_shard(_dirty_shard(self.user_id), add={self.user_id})
+            except BaseException:
+                cache.delete(marker)
+                raise
+
+    def flush(self):
+        entry = cache.get(self.key)
+        if entry is not None and entry['dirty']:
+            flush_dirty_carts(user_ids=[self.user_id])
+
+    def forget(self):
+        cache.delete(self.key)
+        cart_changed.send(sender=type(self), user_id=self.user_id)
+
+
+class SessionCartStore(BaseCartStore):
+    """Anonymous cart kept in the session as ``{"product_id": quantity}``"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def items(self):
+        return {int(product_id): quantity for product_id, quantity in self.session.get(SESSION_KEY, {}).items()}
+
+    def _write(self, product_id, quantity):
+        cart = self.session.get(SESSION_KEY, {})
+        if quantity <= 0:
+            cart.pop(str(product_id), None)
+        else:
+            cart[str(product_id)] = quantity
+        self.session[SESSION_KEY] = cart
+
+    def clear(self):
+        self.session.pop(SESSION_KEY, None)
+
+
+def _dirty_shard(user_id):
+    return DIRTY_KEY.format(user_id % DIRTY_SHARDS)
+
+
+def _update_dirty_shard(key, add=frozenset(), remove=frozenset()):
+    with cache_lock(key):
+        dirty = cache.get(key) or set()
+        cache.set(key, (dirty | add) - remove, None)
+
+
+def dirty_user_ids():
+    """Users whose cached cart has changes not yet in ``CartItem``"""
+    shards = cache.get_many([DIRTY_KEY.format(shard) for shard in range(DIRTY_SHARDS)])
+    return sorted(set().union(*shards.values()))
+
+
+def flush_dirty_carts(user_ids=None, batch_size=500):
+    """
+    Write cached carts back to ``CartItem``: one read, one delete and one
+    upsert per batch of users. Returns the number of carts flushed.
+    """
+    if user_ids is None:
+        user_ids = dirty_user_ids()
+    flushed = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        locks = [cache_lock(f'cart:user:{user_id}') for user_id in batch]
+        for lock in locks:
+            lock.__enter__()
+        try:
+            entries = cache.get_many([f'cart:user:{user_id}' for user_id in batch])
+            wanted = {}
+            for user_id in batch:
+                entry = entries.get(f'cart:user:{user_id}')
+                if entry is not None and entry['dirty']:
+                    wanted[user_id] = entry['items']
+            if wanted:
+                _write_back(wanted)
+                cache.set_many({
+                    f'cart:user:{user_id}': {'items': items, 'dirty': False}
+                    for user_id, items in wanted.items()
+                }, None)
+                flushed += len(wanted)
+
+            # Still holding the cart locks, so nobody re-dirtied these carts
+            cache.delete_many([DIRTY_MARKER.format(user_id) for user_id in batch])
+            shards = {}
+            for user_id in batch:
+                shards.setdefault(_dirty_shard(user_id), set()).add(user_id)
+            for key, flushed_ids in shards.items():
+                _update_dirty_shard(key, remove=flushed_ids)
+        finally:
+            for lock in locks:
+                lock.__exit__()
+    return flushed
+
+
+def _write_back(wanted):
+    """Make ``CartItem`` match ``{user_id: {product_id: quantity}}``"""
+    with transaction.atomic():
+        existing = CartItem.objects.filter(user_id__in=list(wanted)).values_list(
+            'id', 'user_id', 'product_id', 'quantity'
+        )
+        stale_ids, current = [], {}
+        for row_id, user_id, product_id, quantity in existing:
+            if product_id in wanted[user_id]:
+                current[(user_id, product_id)] = quantity
+            else:
+                stale_ids.append(row_id)
+        if stale_ids:
+            CartItem.objects.filter(id__in=stale_ids).delete()
+        changed = [
+            CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
+            for user_id, items in wanted.items()
+            for product_id, quantity in items.items()
+            if current.get((user_id, product_id)) != quantity
+        ]
+        if changed:
+            _upsert_lines(changed)
+
+
+def get_user_cart_store(user):
+    if getattr(settings, 'CART_STORE', 'db') == 'cache':
+        return CacheCartStore(user)
+    return DatabaseCartStore(user)
+
+
+def get_cart_store(request):
+    """The cart of the current visitor, logged in or not"""
+    if request.user.is_authenticated:
+        return get_user_cart_store(request.user)
+    return SessionCartStore(request.session)
+
+
+def merge_session_cart(request, user):
+    """Move an anonymous session cart into ``user``'s cart (capped at what is available)"""
+    session_cart = SessionCartStore(request.session)
+    items = session_cart.items()
+    if not items:
+        return
+    store = get_user_cart_store(user)
+    products = Product.objects.filter(is_active=True).in_bulk(list(items))
+    limits = store.available(list(products.values()))
+    for product_id, quantity in items.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        current = store.quantity(product_id) or 0
+        room = max(limits[product_id] - current, 0)
+        if room:
+            store.add(product, min(quantity, room))
+    session_cart.clear()
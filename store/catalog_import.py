@@ -0,0 +1,259 @@
+"""
+Bulk catalog import from CSV (the ``products.csv`` layout).
+
+The file is streamed in batches. Per batch, existing products are fetched
+with one ``slug__in`` query, compared in memory, and written with a single
+``bulk_create`` for new slugs and a single ``bulk_update`` for changed ones,
+inside one transaction. Categories are resolved once up front (by id or
+slug), and image paths are checked against ``MEDIA_ROOT`` on a thread pool.
+
+Bulk writes bypass the model signals, so the import purges the page cache,
+resets the featured-product sampler, re-indexes search, refreshes the facet
+counts and builds image derivatives (``store.images``) itself.
+"""
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import facets, images as image_derivatives, page_cache, search
+from .models import Category, Product
+from .sampling import sampler
+
+FIELDS = ('category_id', 'name', 'description', 'price', 'image', 'stock', 'is_active')
+# Rows kept per kind of problem; the rest are only counted
+SAMPLE_LIMIT = 100
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+CENT = Decimal('0.01')
+_price_field = Product._meta.get_field('price')
+# Smallest price that no longer fits the column
+MAX_PRICE = Decimal(10) ** (_price_field.max_digits - _price_field.decimal_places)
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = []           # first (line number, message) pairs
+        self.missing_image_count = 0
+        self.missing_images = []   # first (line number, path) pairs
+        self.diff = []             # human readable changes
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _parse_bool(value):
+    value = (value or '').strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError(f'is_active: not a boolean: {value!r}')
+
+
+def parse_row(row, categories):
+    """One CSV row as ``(slug, {field: value})``; raises ``RowError``"""
+    slug = (row.get('slug') or '').strip()
+    if not slug:
+        raise RowError('slug is required')
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise RowError('name is required')
+
+    category_key = (row.get('category') or '').strip()
+    category_id = categories.get(category_key)
+    if category_id is None:
+        raise RowError(f'unknown category: {category_key!r}')
+    try:
+        price = Decimal(row.get('price') or '')
+    except InvalidOperation:
+        raise RowError(f"price: not a number: {row.get('price')!r}")
+    if not price.is_finite():
+        raise RowError(f"price: not a number: {row.get('price')!r}")
+    if price < 0:
+        raise RowError('price must not be negative')
+    # Rounding may carry 99999999.995 over the limit
+    if price < MAX_PRICE:
+        price = price.quantize(CENT)
+    if price >= MAX_PRICE:
+        raise RowError(f'price must be below {MAX_PRICE}')
+    try:
+        stock = int(row.get('stock') or 0)
+    except ValueError:
+        raise RowError(f"stock: not an integer: {row.get('stock')!r}")
+    if stock < 0:
+        raise RowError('stock must not be negative')
+
+    return slug, {
+        'category_id': category_id,
+        'name': name,
+        'description': row.get('description') or '',
+        'price': price,
+        'image': (row.get('image') or '').strip(),
+        'stock': stock,
+        'is_active': _parse_bool(row.get('is_active', 'true')),
+    }
+
+
+def category_lookup():
+    """``{id or slug (as text): category id}`` from a single query"""
+    lookup = {}
+    for pk, slug in Category.objects.values_list('pk', 'slug'):
+        lookup[str(pk)] = pk
+        lookup[slug] = pk
+    return lookup
+
+
+class ImageChecker:
+    """Checks image paths under ``MEDIA_ROOT`` in parallel, each path once"""
+
+    def __init__(self, workers=8):
+        self.root = os.fspath(settings.MEDIA_ROOT)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.seen = {}
+
+    def _exists(self, path):
+        full = os.path.normpath(os.path.join(self.root, path))
+        # Never look outside MEDIA_ROOT
+        return full.startswith(self.root + os.sep) and os.path.isfile(full)
+
+    def missing(self, paths):
+        new = [path for path in set(paths) if path and path not in self.seen]
+        self.seen.update(zip(new, self.pool.map(self._exists, new)))
+        return {path for path in paths if path and not self.seen[path]}
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def _describe(current, values):
+    changes = []
+    for field in FIELDS:
+        old = getattr(current, field)
+        if field == 'image':
+            old = old.name if old else ''
+        elif old is None:
+            old = ''
+        if old != values[field]:
+            changes.append(f'{field}: {old!r} -> {values[field]!r}')
+    return changes
+
+
+def _apply_batch(batch, report, dry_run, diff_limit, touched):
+    """``batch`` is ``[(line number, slug, values)]`` without duplicate slugs"""
+    existing = Product.objects.only('pk', 'slug', 'image_derivatives', *FIELDS).in_bulk(
+        [slug for _, slug, _ in batch], field_name='slug'
+    )
+    now = timezone.now()
+    created, updated, changed_fields = [], [], set()
+    for line, slug, values in batch:
+        current = existing.get(slug)
+        if current is None:
+            created.append(Product(slug=slug, **values))
+            if len(report.diff) < diff_limit:
+                report.diff.append(f'+ {slug}')
+            continue
+        changes = _describe(current, values)
+        if not changes:
+            report.unchanged += 1
+            continue
+        touched.add(current.category_id)
+        for field in FIELDS:
+            setattr(current, field, values[field])
+        current.updated_at = now
+        changed_fields.update(change.split(':', 1)[0] for change in changes)
+        updated.append(current)
+        if len(report.diff) < diff_limit:
+            report.diff.append(f'~ {slug}: ' + '; '.join(changes))
+
+    report.created += len(created)
+    report.updated += len(updated)
+    touched.update(product.category_id for product in created + updated)
+    if dry_run:
+        return []
+    with transaction.atomic():
+        if created:
+            Product.objects.bulk_create(created)
+        if updated:
+            Product.objects.bulk_update(updated, sorted(changed_fields) + ['updated_at'])
+    # MySQL doesn't return primary keys from bulk_create; look them up
+    if created and created[0].pk is None:
+        created = list(Product.objects.filter(slug__in=[p.slug for p in created]))
+    return created + updated
+
+
+def import_products(file, batch_size=2000, dry_run=False, diff_limit=50, image_workers=8, reindex=True,
+                    derive_images=True):
+    """
+    Upsert products by slug from an open CSV ``file``; returns an ``ImportReport``.
+
+    Invalid rows are reported and skipped. Within one batch a repeated slug
+    keeps its last row.
+    """
+    report = ImportReport()
+    categories = category_lookup()
+    images = ImageChecker(workers=image_workers)
+    # One pool for the whole import; it only starts workers once an image is submitted
+    derivative_pool = ProcessPoolExecutor(max_workers=image_workers) if derive_images and not dry_run else None
+    backend = search.get_backend()
+    touched = set()
+
+    def flush(pending):
+        missing = images.missing([values['image'] for _, _, values in pending.values()])
+        for line, _, values in pending.values():
+            if values['image'] in missing:
+                report.missing_image_count += 1
+                if len(report.missing_images) < SAMPLE_LIMIT:
+                    report.missing_images.append((line, values['image']))
+        written = _apply_batch(list(pending.values()), report, dry_run, diff_limit, touched)
+        if written and reindex:
+            backend.index_products(written)
+        if written and derive_images:
+            image_derivatives.build_many(written, pool=derivative_pool)
+
+    try:
+        pending = {}
+        # Line 1 is the header
+        for line, row in enumerate(csv.DictReader(file), start=2):
+            report.rows += 1
+            try:
+                slug, values = parse_row(row, categories)
+            except RowError as e:
+                report.error_count += 1
+                if len(report.errors) < SAMPLE_LIMIT:
+                    report.errors.append((line, str(e)))
+                continue
+            pending[slug] = (line, slug, values)
+            if len(pending) >= batch_size:
+                flush(pending)
+                pending = {}
+        if pending:
+            flush(pending)
+    finally:
+        images.close()
+        if derivative_pool is not None:
+            derivative_pool.shutdown()
+
+    if not dry_run and (report.created or report.updated):
+        sampler.invalidate()
+        page_cache.purge(page_cache.CATALOG, *[page_cache.category_tag(pk) for pk in touched])
+        facets.refresh(touched)
+    report.elapsed = time.monotonic() - report.started
+    return report
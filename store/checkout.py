@@ -0,0 +1,133 @@
+"""
+Checkout service shared by the storefront and the API.
+
+The whole cart is turned into an order inside one transaction. Lines the
+user still holds a live reservation for (``store.reservations``) were already
+checked when they went into the cart, so they become order lines as they
+are; only lines whose hold lapsed are reserved again first (which locks
+those products, in primary-key order). Stock is then decremented with
+conditional ``F()`` updates that match no row when there isn't enough left,
+the order lines are written with a single ``bulk_create`` and the holds are
+released.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import facets, order_ids, page_cache, reservations, trending
+from .cart import get_user_cart_store
+from .models import Product, CartItem, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    """Raised when the cart cannot be turned into an order"""
+
+
+class EmptyCartError(CheckoutError):
+    def __init__(self):
+        super().__init__('Cart is empty')
+
+
+class InsufficientStockError(CheckoutError):
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f'Not enough stock for {product.name}')
+
+
+ORDER_ID_ATTEMPTS = 3
+
+
+def generate_order_id():
+    return order_ids.generate()
+
+
+def _create_order(**fields):
+    """
+    ``Order.objects.create()`` with a generated ID, drawing a new one if
+    another process issued the same (see ``store.order_ids``).
+    """
+    for attempt in range(ORDER_ID_ATTEMPTS):
+        order_id = generate_order_id()
+        try:
+            with transaction.atomic():
+                return Order.objects.create(order_id=order_id, **fields)
+        except IntegrityError:
+            if attempt == ORDER_ID_ATTEMPTS - 1 or not Order.objects.filter(order_id=order_id).exists():
+                raise
+
+
+def place_order(user, **order_fields):
+    """
+    Create an order from ``user``'s cart and clear the cart.
+
+    Raises ``EmptyCartError`` or ``InsufficientStockError``; in both cases
+    nothing is written.
+    """
+    # Write-behind carts must be in CartItem before we read it
+    cart_store = get_user_cart_store(user)
+    cart_store.flush()
+
+    with transaction.atomic():
+        cart = list(CartItem.objects.filter(user=user).values_list('id', 'product_id', 'quantity'))
+        if not cart:
+            raise EmptyCartError()
+
+        quantities = defaultdict(int)
+        for _, product_id, quantity in cart:
+            quantities[product_id] += quantity
+        product_ids = sorted(quantities)
+
+        products = Product.objects.in_bulk(product_ids)
+        held = reservations.held_by(user.pk, product_ids)
+        lapsed = {
+            product_id: quantity
+            for product_id, quantity in quantities.items()
+            if held.get(product_id, 0) < quantity
+        }
+        refused = reservations.hold(user.pk, lapsed)
+        if refused:
+            raise InsufficientStockError(products[min(refused)])
+
+        # Still guarded, in case stock was edited under a hold
+        for product_id in product_ids:
+            updated = Product.objects.filter(
+                id=product_id, stock__gte=quantities[product_id]
+            ).update(stock=F('stock') - quantities[product_id], updated_at=timezone.now())
+            if not updated:
+                raise InsufficientStockError(products[product_id])
+
+        lines = [
+            OrderItem(
+                product_id=product_id,
+                quantity=quantities[product_id],
+                price=products[product_id].price,
+            )
+            for product_id in product_ids
+        ]
+        create = Order.objects.create if 'order_id' in order_fields else _create_order
+        order = create(
+            user=user,
+            total_amount=sum(line.total_price() for line in lines),
+            item_count=len(lines),
+            **order_fields
+        )
+        for line in lines:
+            line.order = order
+        OrderItem.objects.bulk_create(lines)
+
+        CartItem.objects.filter(id__in=[cart_id for cart_id, _, _ in cart]).delete()
+        reservations.release(user.pk, product_ids)
+
+        trending.record_sales(quantities.items(), when=order.created_at)
+
+        # bulk_create and update() bypass the model signals
+        category_ids = {products[product_id].category_id for product_id in product_ids}
+        tags = [page_cache.product_tag(product_id) for product_id in product_ids]
+        tags += [page_cache.category_tag(category_id) for category_id in category_ids]
+        transaction.on_commit(lambda: page_cache.purge(page_cache.CATALOG, *tags))
+        transaction.on_commit(lambda: facets.refresh_sold_out(product_ids))
+        transaction.on_commit(cart_store.forget)
+
+    return order
@@ -0,0 +1,201 @@
+"""
+HTTP conditional GET for the catalog API and product pages.
+
+Validators are built from things that are cheap to read and change whenever
+the response could: the page-cache tag versions (bumped on every product and
+category save/delete, see ``store.signals``), ``MAX(updated_at)`` read off its
+index, and whatever selects the representation (query parameters, media
+type, the viewer's storefront version). A matching ``If-None-Match`` is
+answered with ``304 Not Modified`` before the real query runs.
+
+``Last-Modified`` is only sent on anonymous product pages, where the
+product's ``updated_at`` covers everything but the category menu (clients
+that also send ``If-None-Match`` are judged by the ETag alone). A deleted
+product never moves ``MAX(updated_at)``, so list responses carry an ETag
+only.
+
+Every full response remembers what it cost (body bytes and DB time) under
+its ETag, so each 304 adds the bytes and DB time it avoided to the counters
+returned by ``metrics()`` (``manage.py conditional_get_stats``).
+"""
+import hashlib
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import page_cache
+from .models import Product
+
+METRICS_PREFIX = 'conditional:metrics:'
+COST_PREFIX = 'conditional:cost:'
+COST_TIMEOUT = 86400
+COUNTERS = ('full', 'not_modified', 'bytes_saved', 'db_us_saved')
+
+
+class DatabaseTimer:
+    """Sums the wall time spent in database queries while installed"""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+@contextmanager
+def timed_queries():
+    timer = DatabaseTimer()
+    # Open the connection first, so ``instrumentation.install`` doesn't run
+    # while our wrapper is pushed
+    connection.ensure_connection()
+    with connection.execute_wrapper(timer):
+        yield timer
+
+
+def make_etag(*parts):
+    raw = '|'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def catalog_last_modified(category_id=None):
+    """Newest ``Product.updated_at`` (inactive products included), off its index"""
+    products = Product.objects.all()
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    return products.aggregate(latest=Max('updated_at'))['latest']
+
+
+def tag_versions(*tags):
+    versions = page_cache.tag_versions(tags)
+    return [versions[tag] for tag in sorted(versions)]
+
+
+def _bump(name, amount=1):
+    key = METRICS_PREFIX + name
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def record_full(etag, response, db_seconds):
+    """Remember what producing the response behind ``etag`` cost"""
+    _bump('full')
+    cache.set(COST_PREFIX + etag, (len(response.content), db_seconds), COST_TIMEOUT)
+
+
+def record_not_modified(etag, validator_db_seconds):
+    _bump('not_modified')
+    cost = cache.get(COST_PREFIX + etag)
+    if cost is not None:
+        size, db_seconds = cost
+        _bump('bytes_saved', size)
+        _bump('db_us_saved', max(int((db_seconds - validator_db_seconds) * 1e6), 0))
+
+
+def metrics():
+    values = cache.get_many([METRICS_PREFIX + name for name in COUNTERS])
+    return {name: values.get(METRICS_PREFIX + name, 0) for name in COUNTERS}
+
+
+def reset_metrics():
+    cache.delete_many([METRICS_PREFIX + name for name in COUNTERS])
+
+
+def _set_validators(response, etag, last_modified):
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def _after_render(response, etag, db_seconds):
+    if response.status_code == 200 and not response.streaming:
+        record_full(etag, response, db_seconds)
+
+
+def _check(validators, request, args, kwargs):
+    """
+    Run the validators; returns ``(etag, last_modified, early response,
+    validator DB seconds)``. ``etag`` is ``None`` when the view should just run.
+    """
+    with timed_queries() as validator_timer:
+        parts, last_modified = validators(request, *args, **kwargs)
+    if parts is None:
+        return None, None, None, 0.0
+    etag = make_etag(*parts)
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        if not_modified.status_code == 304:
+            record_not_modified(etag, validator_timer.seconds)
+    return etag, last_modified, not_modified, validator_timer.seconds
+
+
+def _finish(response, etag, last_modified, db_seconds):
+    if response.status_code != 200:
+        return response
+    _set_validators(response, etag, last_modified)
+    if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+        # DRF / template responses only have a body once rendered
+        response.add_post_render_callback(lambda r: _after_render(r, etag, db_seconds))
+    else:
+        _after_render(response, etag, db_seconds)
+    return response
+
+
+def conditional_get(validators):
+    """
+    Decorate a view with conditional GET handling (wrap viewset methods
+    with ``method_decorator``). Works on sync and async views; ``validators``
+    is always sync.
+
+    ``validators(request, *args, **kwargs)`` returns ``(etag_parts,
+    last_modified)``; ``etag_parts`` of ``None`` skips conditional handling
+    and simply calls the view (e.g. for a 404).
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            async def _wrapped(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view_func(request, *args, **kwargs)
+                etag, last_modified, early, db_seconds = await sync_to_async(_check)(
+                    validators, request, args, kwargs
+                )
+                if early is not None:
+                    return early
+                response = await view_func(request, *args, **kwargs)
+                if etag is None:
+                    return response
+                # The view's own queries run on worker threads and aren't
+                # timed, so only the validators count towards the saving
+                return await sync_to_async(_finish)(response, etag, last_modified, db_seconds)
+        else:
+            def _wrapped(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view_func(request, *args, **kwargs)
+                etag, last_modified, early, db_seconds = _check(validators, request, args, kwargs)
+                if early is not None:
+                    return early
+                if etag is None:
+                    return view_func(request, *args, **kwargs)
+                with timed_queries() as view_timer:
+                    response = view_func(request, *args, **kwargs)
+                return _finish(response, etag, last_modified, db_seconds + view_timer.seconds)
+        return wraps(view_func)(_wrapped)
+    return decorator
@@ -1,12 +1,21 @@
-from .models import Order
+from django.utils.functional import SimpleLazyObject
 
-def recent_orders(request):
+from . import storefront as storefront_context
+
+
+def storefront(request):
     """
-    Context processor to make recent orders available in all templates
+    Cart summary, recent orders and the category menu for every template.
+
+    Values are lazy and memoized on the request, so a page only pays for
+    what it renders and logged-in users are normally served from the cache.
     """
-    context = {}
-    if request.user.is_authenticated:
-        context['recent_orders'] = Order.objects.filter(user=request.user).order_by('-created_at')[:5]
-    else:
-        context['recent_orders'] = []
-    return context
\ No newline at end of file
+    page = storefront_context.for_request(request)
+    return {
+        'storefront': page,
+        'cart_count': SimpleLazyObject(lambda: page.cart_count),
+        'cart_total': SimpleLazyObject(lambda: page.cart_total),
+        'recent_orders': SimpleLazyObject(lambda: page.recent_orders),
+        'categories': SimpleLazyObject(lambda: page.categories),
+    }
+
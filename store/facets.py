@@ -0,0 +1,182 @@
+"""
+Facet counts for the products API: per category, per price bucket and
+in stock.
+
+Every count is a sum over cells of active products grouped by
+``(category, price bucket, in stock, in the requested price range)``. Each
+facet ignores its own filter and applies the others, so the sidebar keeps
+showing the alternatives to the current choice. The cells come from one of
+two places:
+
+* ``ProductFacetCount``, a precomputed table of ``(category, price bucket,
+  in stock) -> count``. It serves every request without a search whose
+  price range (if any) lines up with ``PRODUCT_PRICE_BUCKETS``. That covers
+  the unfiltered listing and any single filter, in one small query.
+* Otherwise (a search, or a price range that splits a bucket), one grouped
+  aggregate over the matching products.
+
+Product saves and deletes refresh the rows of the categories involved after
+commit (``schedule_refresh``). So do the bulk writers that bypass signals:
+catalog import, checkout when it sells a product out, cancellations that
+restock one, and the benchmark seeder. ``manage.py rebuild_facets``
+rebuilds the whole table, e.g. after changing the buckets.
+"""
+import threading
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, IntegerField, Q, Value, When
+
+from .models import Product, ProductFacetCount
+
+_pending = threading.local()
+
+
+def boundaries():
+    """Ascending bucket edges; bucket ``i`` is ``[edge[i-1], edge[i])``, the last is open-ended"""
+    return [Decimal(str(edge)) for edge in getattr(settings, 'PRODUCT_PRICE_BUCKETS', [25, 50, 100, 250])]
+
+
+def buckets():
+    edges = [None, *boundaries(), None]
+    return [(low, high) for low, high in zip(edges, edges[1:])]
+
+
+def bucket_of(price):
+    return bisect_right(boundaries(), price)
+
+
+def bucket_expression():
+    return Case(
+        *[When(price__lt=edge, then=Value(i)) for i, edge in enumerate(boundaries())],
+        default=Value(len(boundaries())),
+        output_field=IntegerField(),
+    )
+
+
+def _in_stock():
+    return Case(When(stock__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField())
+
+
+# -----------------------
+# Precomputed table
+# -----------------------
+def refresh(category_ids=None):
+    """Recount the table rows of ``category_ids`` (all categories when ``None``)"""
+    products = Product.objects.filter(is_active=True)
+    rows = ProductFacetCount.objects.all()
+    if category_ids is not None:
+        category_ids = list(category_ids)
+        products = products.filter(category_id__in=category_ids)
+        rows = rows.filter(category_id__in=category_ids)
+    counts = products.annotate(bucket=bucket_expression(), in_stock=_in_stock()).values(
+        'category_id', 'bucket', 'in_stock'
+    ).annotate(count=Count('pk')).order_by()
+    with transaction.atomic():
+        rows.delete()
+        ProductFacetCount.objects.bulk_create([
+            ProductFacetCount(
+                category_id=row['category_id'], price_bucket=row['bucket'],
+                in_stock=row['in_stock'], count=row['count'],
+            )
+            for row in counts
+        ])
+
+
+def _flush():
+    category_ids = getattr(_pending, 'category_ids', None)
+    if category_ids:
+        _pending.category_ids = set()
+        refresh(category_ids)
+
+
+def schedule_refresh(category_ids):
+    """
+    Refresh ``category_ids`` once the current transaction commits. Requests
+    made in the same transaction are refreshed together by the first
+    callback; the later ones find nothing left to do.
+    """
+    if not hasattr(_pending, 'category_ids'):
+        _pending.category_ids = set()
+    _pending.category_ids.update(category_id for category_id in category_ids if category_id)
+    transaction.on_commit(_flush)
+
+
+def refresh_sold_out(product_ids):
+    """After stock went down: refresh the categories of products that hit zero"""
+    category_ids = set(
+        Product.objects.filter(pk__in=list(product_ids), stock=0).values_list('category_id', flat=True)
+    )
+    if category_ids:
+        refresh(category_ids)
+
+
+# -----------------------
+# Counting
+# -----------------------
+def _aligned(min_price, max_price):
+    """Whether every bucket lies wholly inside or wholly outside the price range"""
+    cent = Decimal('0.01')
+    for low, high in buckets():
+        lowest = low if low is not None else Decimal('0')
+        highest = high - cent if high is not None else None
+        inside = (min_price is None or lowest >= min_price) and (
+            max_price is None or (highest is not None and highest <= max_price)
+        )
+        outside = (min_price is not None and highest is not None and highest < min_price) or (
+            max_price is not None and lowest > max_price
+        )
+        if not inside and not outside:
+            return False
+    return True
+
+
+def _bucket_in_range(bucket, min_price, max_price):
+    low, high = buckets()[bucket]
+    low = low if low is not None else Decimal('0')
+    return (min_price is None or low >= min_price) and (max_price is None or low <= max_price)
+
+
+def cells(queryset, searched, min_price=None, max_price=None):
+    """
+    ``[(category_id, bucket, in_stock, in_range, count)]`` for ``queryset``
+    (active products, narrowed by search but not by the facet filters).
+    """
+    if not searched and _aligned(min_price, max_price):
+        return [
+            (category_id, bucket, in_stock, _bucket_in_range(bucket, min_price, max_price), count)
+            for category_id, bucket, in_stock, count in ProductFacetCount.objects.values_list(
+                'category_id', 'price_bucket', 'in_stock', 'count'
+            )
+        ]
+    price_range = Q()
+    if min_price is not None:
+        price_range &= Q(price__gte=min_price)
+    if max_price is not None:
+        price_range &= Q(price__lte=max_price)
+    rows = queryset.order_by().annotate(
+        bucket=bucket_expression(),
+        in_stock=_in_stock(),
+        in_range=Case(When(price_range, then=Value(True)), default=Value(False), output_field=BooleanField()),
+    ).values('category_id', 'bucket', 'in_stock', 'in_range').annotate(count=Count('pk')).order_by()
+    return [
+        (row['category_id'], row['bucket'], row['in_stock'], row['in_range'], row['count'])
+        for row in rows
+    ]
+
+
+def counts(cells, category_id=None, in_stock=False):
+    """Each facet's counts with every other filter applied"""
+    by_category, by_bucket, stocked = {}, [0] * len(buckets()), 0
+    for cell_category, bucket, cell_in_stock, in_range, count in cells:
+        category_ok = category_id is None or cell_category == category_id
+        stock_ok = not in_stock or cell_in_stock
+        if in_range and stock_ok:
+            by_category[cell_category] = by_category.get(cell_category, 0) + count
+        if category_ok and stock_ok:
+            by_bucket[bucket] += count
+        if category_ok and in_range and cell_in_stock:
+            stocked += count
+    return {'category': by_category, 'price': by_bucket, 'in_stock': stocked}
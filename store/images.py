@@ -0,0 +1,182 @@
+"""
+Responsive derivatives of ``Product.image``.
+
+For every original, resized JPEG and WebP copies are written next to it as
+``products/derived/<stem>-<content hash>-<width>w.<ext>``. The name changes
+whenever the picture does, so the files can be served with a far-future
+``Cache-Control: immutable``. What was generated is recorded on
+``Product.image_derivatives``::
+
+    {"source": "products/shirt.jpg", "width": 1600,
+     "sizes": [{"width": 320, "jpeg": "...", "webp": "..."}, ...]}
+
+so rendering a ``srcset`` never touches the disk. Derivatives are built when
+a product is saved with a new image, by the catalog import, and in bulk by
+``manage.py build_image_derivatives`` on one process pool per run. An image
+that could not be processed is recorded as ``{"source": ..., "sizes": [],
+"failed": true}``; the next ``build_image_derivatives`` run tries it again.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import page_cache
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = 'products/derived'
+DEFAULT_WIDTHS = (160, 320, 640, 1024)
+
+
+def widths():
+    return tuple(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', DEFAULT_WIDTHS))
+
+
+def quality():
+    return getattr(settings, 'PRODUCT_IMAGE_QUALITY', 80)
+
+
+def render_derivatives(media_root, name, target_widths, jpeg_quality):
+    """
+    Write the derivatives of ``name`` (relative to ``media_root``) and return
+    the ``image_derivatives`` value. Plain paths only, no Django, so it can
+    run in a worker process.
+    """
+    from PIL import Image, ImageOps
+
+    path = os.path.join(media_root, name)
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(name))[0]
+    out_dir = os.path.join(media_root, DERIVED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with Image.open(path) as original:
+        original = ImageOps.exif_transpose(original).convert('RGB')
+        # Never upscale; the largest derivative is at most the original width
+        sizes_wanted = sorted({w for w in target_widths if w < original.width} | {min(max(target_widths), original.width)})
+        sizes = []
+        for width in sizes_wanted:
+            entry = {'width': width}
+            resized = None
+            for ext, fmt, options in (
+                ('jpg', 'JPEG', {'quality': jpeg_quality, 'optimize': True, 'progressive': True}),
+                ('webp', 'WEBP', {'quality': jpeg_quality, 'method': 4}),
+            ):
+                relative = f'{DERIVED_DIR}/{stem}-{digest}-{width}w.{ext}'
+                target = os.path.join(media_root, relative)
+                if not os.path.exists(target):
+                    if resized is None:
+                        height = round(original.height * width / original.width)
+                        resized = original.resize((width, height), Image.LANCZOS)
+                    # Write then rename, so a reader never sees half a file
+                    resized.save(target + '.tmp', fmt, **options)
+                    os.replace(target + '.tmp', target)
+                entry['jpeg' if ext == 'jpg' else 'webp'] = relative
+            sizes.append(entry)
+    return {'source': name, 'width': original.width, 'sizes': sizes}
+
+
+def needs_derivatives(product, retry_failed=False):
+    name = product.image.name if product.image else ''
+    current = product.image_derivatives or {}
+    if current.get('source', '') != name:
+        return True
+    return retry_failed and bool(current.get('failed'))
+
+
+def _failed(name):
+    return {'source': name, 'sizes': [], 'failed': True}
+
+
+def _media_root():
+    return os.fspath(settings.MEDIA_ROOT)
+
+
+def _store(results):
+    """Save ``{product_id: derivatives}`` and drop pages that embed the old URLs"""
+    if not results:
+        return
+    now = timezone.now()
+    products = list(Product.objects.filter(pk__in=list(results)).only('pk', 'category_id'))
+    for product in products:
+        product.image_derivatives = results[product.pk]
+        product.updated_at = now
+    Product.objects.bulk_update(products, ['image_derivatives', 'updated_at'])
+    page_cache.purge(
+        page_cache.CATALOG,
+        *{page_cache.category_tag(product.category_id) for product in products},
+    )
+
+
+def build_for(product):
+    """Generate (or clear) the derivatives of one product, in this process"""
+    name = product.image.name if product.image else ''
+    derivatives = {}
+    if name:
+        try:
+            derivatives = render_derivatives(_media_root(), name, widths(), quality())
+        except (OSError, ValueError) as e:
+            logger.warning('Could not build derivatives of %s: %s', name, e)
+            derivatives = _failed(name)
+    product.image_derivatives = derivatives
+    _store({product.pk: derivatives})
+
+
+def build_many(products, workers=None, force=False, pool=None):
+    """
+    Generate derivatives for ``products`` (including ones that failed
+    before) on ``pool``, or on a process pool of its own; returns
+    ``(built, failed)`` counts.
+    """
+    jobs = {
+        product.pk: product.image.name
+        for product in products
+        if product.image and (force or needs_derivatives(product, retry_failed=True))
+    }
+    if not jobs:
+        return 0, 0
+    built, failed, results = 0, 0, {}
+    with nullcontext(pool) if pool is not None else ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pk: pool.submit(render_derivatives, _media_root(), name, widths(), quality())
+            for pk, name in jobs.items()
+        }
+        for pk, future in futures.items():
+            try:
+                results[pk] = future.result()
+                built += 1
+            except (OSError, ValueError) as e:
+                logger.warning('Could not build derivatives of %s: %s', jobs[pk], e)
+                results[pk] = _failed(jobs[pk])
+                failed += 1
+    _store(results)
+    return built, failed
+
+
+def srcset(product, kind='jpeg'):
+    """``srcset`` value for ``kind`` (``jpeg`` or ``webp``), empty when none were built"""
+    sizes = (product.image_derivatives or {}).get('sizes') or []
+    return ', '.join(
+        f"{default_storage.url(size[kind])} {size['width']}w"
+        for size in sizes
+        if kind in size
+    )
+
+
+def fallback_url(product, width=640):
+    """The smallest JPEG derivative at least ``width`` wide, else the original"""
+    sizes = (product.image_derivatives or {}).get('sizes') or []
+    for size in sizes:
+        if size['width'] >= width and 'jpeg' in size:
+            return default_storage.url(size['jpeg'])
+    if sizes and 'jpeg' in sizes[-1]:
+        return default_storage.url(sizes[-1]['jpeg'])
+    return product.image.url if product.image else ''
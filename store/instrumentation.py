@@ -0,0 +1,413 @@
+"""
+Per-request timing: where does request time go, per resolved view?
+
+``RequestTimingMiddleware`` opens a ``RequestProfile`` for every request
+that resolves to a view (``store:home``, ``product-list``, ...). While it is
+open, the profile collects:
+
+* DB query count and time, from an execute wrapper put on every connection
+  as it is created (see ``install``). The profile lives in a context
+  variable, which ``sync_to_async`` carries into worker threads, so queries
+  made by async views and ``async_views.gather_queries`` count as well;
+* serializer time (``serializers.TimedModelSerializer``) and template render
+  time (``TimedDjangoTemplates``), via ``span()``;
+* how often each SQL shape ran. A shape is the statement with its
+  placeholders, ``IN (...)`` lists collapsed; one that runs
+  ``REQUEST_TIMING_N_PLUS_ONE`` times or more in one request is a likely
+  N+1 and is remembered for the view.
+
+A streaming response (the order export, say) is only profiled until the
+view returns it: the queries and time spent producing ``streaming_content``
+come later, while the server iterates it, and are not counted.
+
+The response gets a ``Server-Timing`` header and the numbers go into
+in-process HDR-style histograms (log-linear buckets: a fixed number of
+linear sub-buckets per power of two, so recording is O(1), memory is
+bounded, and any percentile is within ~3% of the true value).
+
+Each process publishes its histograms to the cache every
+``REQUEST_TIMING_PUBLISH_SECONDS``; ``report()`` merges what every process
+published (so it needs a shared cache to see other workers) and is served
+by ``/api/request-timings/`` (staff only) and ``manage.py request_timings``.
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.template.backends.django import DjangoTemplates
+
+METRICS = ('total', 'db', 'serializer', 'template', 'queries')
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+PROCESSES_KEY = 'instrumentation:processes'
+EPOCH_KEY = 'instrumentation:epoch'
+PROCESS_PREFIX = 'instrumentation:process:'
+
+_current = contextvars.ContextVar('request_profile', default=None)
+_span_depth = contextvars.ContextVar('request_profile_span_depth', default=0)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _threshold():
+    return getattr(settings, 'REQUEST_TIMING_N_PLUS_ONE', 5)
+
+
+def _publish_seconds():
+    return getattr(settings, 'REQUEST_TIMING_PUBLISH_SECONDS', 10)
+
+
+# -----------------------
+# Histogram
+# -----------------------
+class Histogram:
+    """
+    Log-linear histogram of non-negative integers (e.g. microseconds).
+
+    Values below ``SUB_BUCKETS`` are exact; above that each power of two is
+    split into ``SUB_BUCKETS`` equal buckets.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+        self.total = sum(self.counts.values())
+
+    @staticmethod
+    def bucket(value):
+        if value < SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def lowest(index):
+        """Smallest value that falls into bucket ``index``"""
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return (SUB_BUCKETS + index % SUB_BUCKETS) << shift
+
+    @classmethod
+    def middle(cls, index):
+        return (cls.lowest(index) + cls.lowest(index + 1) - 1) / 2
+
+    def record(self, value):
+        self.counts[self.bucket(max(int(value), 0))] += 1
+        self.total += 1
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+
+    def percentile(self, fraction):
+        if not self.total:
+            return 0
+        rank = max(1, round(self.total * fraction))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.middle(index)
+        return self.middle(max(self.counts))
+
+    def max(self):
+        return self.middle(max(self.counts)) if self.counts else 0
+
+    def to_dict(self):
+        return dict(self.counts)
+
+
+# -----------------------
+# Per-request profile
+# -----------------------
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.template = 0.0
+        self.shapes = Counter()
+        # Async views may query from several threads at once
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + seconds)
+
+    def add_query(self, sql, seconds):
+        shape = sql_shape(sql)
+        with self._lock:
+            self.queries += 1
+            self.db += seconds
+            self.shapes[shape] += 1
+
+    def repeated_shapes(self):
+        threshold = _threshold()
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'ser;dur={self.serializer * 1000:.1f}',
+            f'tpl;dur={self.template * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def sql_shape(sql):
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('IN (...)', sql)).strip()
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(kind):
+    """Add the time spent inside to ``kind`` of the current profile; nested spans count once"""
+    profile = _current.get()
+    depth = _span_depth.get()
+    if profile is None or depth:
+        yield
+        return
+    token = _span_depth.set(depth + 1)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(kind, time.perf_counter() - started)
+        _span_depth.reset(token)
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def install(sender, connection, **kwargs):
+    """``connection_created`` receiver: time every query of a profiled request"""
+    if _record_query not in connection.execute_wrappers:
+        # Outermost: the connection may open inside a ``connection.execute_wrapper()``
+        # block, whose exit pops the last wrapper and must find its own
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, adding render time to the request profile"""
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with span('template'):
+            return self._template.render(context, request)
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+        self._epoch = None
+        self._published = 0.0
+
+    def _clear(self):
+        self.histograms = {}   # view -> {metric: Histogram}
+        self.n_plus_one = {}   # view -> {shape: most runs seen in one request}
+
+    def observe(self, view, profile, total):
+        values = {
+            'total': total * 1e6,
+            'db': profile.db * 1e6,
+            'serializer': profile.serializer * 1e6,
+            'template': profile.template * 1e6,
+            'queries': profile.queries,
+        }
+        repeated = profile.repeated_shapes()
+        with self._lock:
+            histograms = self.histograms.setdefault(view, {metric: Histogram() for metric in METRICS})
+            for metric, value in values.items():
+                histograms[metric].record(value)
+            if repeated:
+                seen = self.n_plus_one.setdefault(view, {})
+                for shape, count in repeated.items():
+                    seen[shape] = max(seen.get(shape, 0), count)
+
+    def publish_due(self):
+        return time.monotonic() - self._published >= _publish_seconds()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': {
+                    view: {metric: histogram.to_dict() for metric, histogram in metrics.items()}
+                    for view, metrics in self.histograms.items()
+                },
+                'n_plus_one': {view: dict(shapes) for view, shapes in self.n_plus_one.items()},
+            }
+
+    def publish(self):
+        """Share this process' numbers through the cache (and honour a reset)"""
+        self._published = time.monotonic()
+        epoch = cache.get(EPOCH_KEY)
+        if epoch != self._epoch:
+            if self._epoch is not None:
+                with self._lock:
+                    self._clear()
+            self._epoch = epoch
+        key = f'{PROCESS_PREFIX}{os.getpid()}'
+        timeout = _publish_seconds() * 30
+        cache.set(key, self.snapshot(), timeout)
+        processes = cache.get(PROCESSES_KEY) or []
+        if key not in processes:
+            # A lost update only hides a process until its next publish
+            cache.set(PROCESSES_KEY, [k for k in processes if k != key][-63:] + [key], None)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+
+registry = Registry()
+
+
+def _collect():
+    registry.publish()
+    snapshots = cache.get_many(cache.get(PROCESSES_KEY) or [])
+    histograms, n_plus_one = {}, {}
+    for snapshot in snapshots.values():
+        for view, metrics in snapshot['histograms'].items():
+            merged = histograms.setdefault(view, {metric: Histogram() for metric in METRICS})
+            for metric, counts in metrics.items():
+                merged[metric].merge(Histogram(counts))
+        for view, shapes in snapshot['n_plus_one'].items():
+            seen = n_plus_one.setdefault(view, {})
+            for shape, count in shapes.items():
+                seen[shape] = max(seen.get(shape, 0), count)
+    return histograms, n_plus_one
+
+
+def report():
+    """
+    ``{view: {'requests', 'total_ms', 'db_ms', 'serializer_ms', 'template_ms',
+    'queries', 'n_plus_one'}}`` over every process that published; each timing
+    is ``{'p50', 'p95', 'p99', 'max'}``.
+    """
+    histograms, n_plus_one = _collect()
+    result = {}
+    for view in sorted(histograms):
+        metrics = histograms[view]
+        entry = {'requests': metrics['total'].total}
+        for metric in METRICS:
+            histogram = metrics[metric]
+            scale = 1 if metric == 'queries' else 1000
+            name = metric if metric == 'queries' else f'{metric}_ms'
+            entry[name] = {
+                label: round(value / scale, 2)
+                for label, value in (
+                    ('p50', histogram.percentile(0.50)),
+                    ('p95', histogram.percentile(0.95)),
+                    ('p99', histogram.percentile(0.99)),
+                    ('max', histogram.max()),
+                )
+            }
+        entry['n_plus_one'] = [
+            {'sql': shape, 'count': count}
+            for shape, count in sorted(n_plus_one.get(view, {}).items(), key=lambda item: -item[1])
+        ]
+        result[view] = entry
+    return result
+
+
+def reset():
+    """Forget everything, in every process (others clear on their next publish)"""
+    try:
+        cache.incr(EPOCH_KEY)
+    except ValueError:
+        cache.set(EPOCH_KEY, time.time_ns() // 1000, None)
+    cache.delete_many(cache.get(PROCESSES_KEY) or [])
+    cache.delete(PROCESSES_KEY)
+    registry.reset()
+    registry._epoch = cache.get(EPOCH_KEY)
+
+
+# -----------------------
+# Middleware
+# -----------------------
+class RequestTimingMiddleware:
+    """Profile each request that resolves to a view; see the module docstring"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'REQUEST_TIMING_HEADER', True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, profile)
+        if registry.publish_due():
+            registry.publish()
+        return response
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, profile)
+        if registry.publish_due():
+            # The cache backend may do blocking I/O
+            await sync_to_async(registry.publish)()
+        return response
+
+    def _finish(self, request, response, profile):
+        total = time.perf_counter() - profile.started
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+        if self.header:
+            response['Server-Timing'] = profile.server_timing(total)
+        registry.observe(match.view_name, profile, total)
+        return response
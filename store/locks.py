@@ -0,0 +1,44 @@
+"""
+Cross-process locks on the default cache, for short critical sections
+such as a cart's read-modify-write or a throttle's state update.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+
+
+class LockBusy(Exception):
+    """The lock could not be acquired in time"""
+
+
+class cache_lock:
+    """
+    Short-lived mutex built on ``cache.add``, which is atomic on every backend.
+
+    The lock expires after ``timeout`` seconds even if still held; a holder
+    that overran it then leaves alone the lock someone else took since.
+    """
+
+    def __init__(self, key, timeout=5, wait=1.0):
+        self.key = f'{key}:lock'
+        self.timeout = timeout
+        self.wait = wait
+        self.token = None
+
+    def __enter__(self):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait
+        while not cache.add(self.key, token, self.timeout):
+            if time.monotonic() > deadline:
+                raise LockBusy(self.key)
+            time.sleep(0.005)
+        self.token = token
+        return self
+
+    def __exit__(self, *exc):
+        # Not atomic with the delete, but narrows the overrun case to a few
+        # microseconds instead of the rest of the other holder's turn
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+        self.token = None
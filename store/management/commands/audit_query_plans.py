@@ -0,0 +1,118 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store import trending
+from store.api_views import ProductViewSet, CartViewSet, OrderViewSet
+from store.models import Product, CartItem, Order
+from store.views import category_products_queryset
+from users.models import User
+
+# Small lookup tables a full scan is fine for
+SCAN_ALLOWED = {'store_category'}
+
+
+def api_queryset(viewset_class, params=None, user=None):
+    """Build the queryset a list request to ``viewset_class`` would run"""
+    request = Request(APIRequestFactory().get('/', params or {}))
+    request.user = user
+    view = viewset_class(request=request, format_kwarg=None, action='list')
+    return view.get_queryset()
+
+
+def hot_querysets():
+    """The canonical hot-path queries of store.views / store.api_views"""
+    user = User(pk=1)
+    active = Product.objects.filter(is_active=True)
+    return {
+        'home: latest products': active.order_by('-created_at')[:12],
+        'home: trending products': trending.top_products_queryset(10),
+        'category page': category_products_queryset(1),
+        'product detail': active.filter(slug='sample-product'),
+        'cart': CartItem.objects.filter(user=user),
+        'cart: add item': CartItem.objects.filter(user=user, product_id=1),
+        'order history': Order.objects.filter(user=user).order_by('-created_at'),
+        'recent orders': Order.objects.filter(user=user).order_by('-created_at')[:5],
+        'api: products newest': api_queryset(ProductViewSet).order_by('-created_at', '-id')[:20],
+        'api: products by category': api_queryset(ProductViewSet, {'category': 'men'}).order_by('-created_at', '-id')[:20],
+        'api: products by price': api_queryset(
+            ProductViewSet, {'min_price': '10', 'max_price': '50'}
+        ).order_by('price', 'id')[:20],
+        'api: cart': api_queryset(CartViewSet, user=user),
+        'api: orders': api_queryset(OrderViewSet, user=user)[:20],
+        'admin: orders by value': Order.objects.order_by('-total_amount')[:100],
+    }
+
+
+def sqlite_problems(plan, min_rows):
+    problems = []
+    for line in plan.splitlines():
+        line = line.strip().lstrip('|-` ').strip()
+        if line.startswith('SCAN ') and 'USING' not in line:
+            table = line.split()[1]
+            if table not in SCAN_ALLOWED:
+                problems.append(f'full scan of {table}')
+        if 'USE TEMP B-TREE FOR ORDER BY' in line:
+            problems.append('filesort (temp b-tree for ORDER BY)')
+    return problems
+
+
+def mysql_problems(plan, min_rows):
+    problems = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            table = node.get('table_name')
+            if table and node.get('access_type') == 'ALL' and table not in SCAN_ALLOWED:
+                rows = int(node.get('rows_examined_per_scan', 0) or 0)
+                if rows >= min_rows:
+                    problems.append(f'full scan of {table} (~{rows} rows)')
+            if node.get('using_filesort'):
+                problems.append('filesort')
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(plan))
+    return problems
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot-path queries and fail if any of them full-scans or filesorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='MySQL: ignore full scans the optimizer estimates below this many rows',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'mysql':
+            explain_options, check = {'format': 'JSON'}, mysql_problems
+        elif connection.vendor == 'sqlite':
+            explain_options, check = {}, sqlite_problems
+        else:
+            raise CommandError(f'Unsupported database vendor: {connection.vendor}')
+
+        failures = 0
+        for name, queryset in hot_querysets().items():
+            plan = queryset.explain(**explain_options)
+            problems = check(plan, options['min_rows'])
+            if problems:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'FAIL  {name}: {"; ".join(problems)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'ok    {name}'))
+            if options['verbose_plans'] or problems:
+                self.stdout.write(f'      {str(queryset.query)[:300]}')
+                for line in plan.splitlines():
+                    self.stdout.write(f'      {line}')
+
+        if failures:
+            raise CommandError(f'{failures} hot queries regressed to a scan or filesort.')
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from store.models import Category, Product
+from users.models import User
+
+BENCH_EMAIL = 'bench-asgi@example.com'
+# mode: (served through, STORE_ASYNC_VIEWS)
+MODES = {
+    'wsgi': ('wsgi', '0'),
+    'asgi': ('asgi', '1'),
+    'asgi-sync': ('asgi', '0'),
+}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _summary(concurrency, latencies, errors, elapsed):
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(latencies, 0.50) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+    }
+
+
+def _run_wsgi(paths, requests, concurrency, user):
+    def worker(count):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        latencies, errors = [], 0
+        for i in range(count):
+            started = time.perf_counter()
+            response = client.get(paths[i % len(paths)])
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+        return latencies, errors
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - started
+    return _summary(concurrency, [l for ls, _ in results for l in ls], sum(e for _, e in results), elapsed)
+
+
+async def _run_asgi(paths, requests, concurrency, user):
+    async def worker(count):
+        client = AsyncClient()
+        if user is not None:
+            await client.aforce_login(user)
+        latencies, errors = [], 0
+        for i in range(count):
+            started = time.perf_counter()
+            response = await client.get(paths[i % len(paths)])
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+        return latencies, errors
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(worker(share) for share in shares))
+    elapsed = time.perf_counter() - started
+    return _summary(concurrency, [l for ls, _ in results for l in ls], sum(e for _, e in results), elapsed)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare storefront latency and throughput served over WSGI (sync views, '
+        'threads) and ASGI (async views, one event loop), in-process'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default='wsgi,asgi', help=f"Comma-separated: {', '.join(MODES)}")
+        parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated client counts')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per concurrency level')
+        parser.add_argument('--paths', help='Comma-separated paths (default: home, a category, a product, cart)')
+        parser.add_argument('--anonymous', action='store_true',
+                            help='Send anonymous requests (mostly page-cache hits) instead of logged-in ones')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+        # Internal: run one mode in this process
+        parser.add_argument('--worker', choices=sorted(MODES), help='(internal)')
+
+    def handle(self, *args, **options):
+        concurrency = [int(value) for value in options['concurrency'].split(',')]
+        if options['worker']:
+            return self._worker(options['worker'], options['paths'].split(','), options['requests'],
+                                concurrency, options['anonymous'])
+
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown mode: {', '.join(sorted(unknown))}")
+        paths = options['paths'] or ','.join(self._default_paths())
+        user, created = User.objects.get_or_create(email=BENCH_EMAIL)
+        try:
+            results = {mode: self._spawn(mode, paths, options) for mode in modes}
+        finally:
+            if created:
+                user.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':>10} {'clients':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for mode, rows in results.items():
+            for row in rows:
+                self.stdout.write(
+                    f"{mode:>10} {row['concurrency']:>8} {row['rps']:>9.1f} {row['p50_ms']:>8.2f} "
+                    f"{row['p99_ms']:>8.2f} {row['errors']:>7}"
+                )
+
+    def _default_paths(self):
+        category = Category.objects.order_by('pk').values_list('slug', flat=True).first()
+        product = Product.objects.filter(is_active=True).order_by('pk').values_list('slug', flat=True).first()
+        if category is None or product is None:
+            raise CommandError('Needs at least one category and one active product')
+        return ['/', f'/category/{category}/', f'/product/{product}/', '/cart/']
+
+    def _spawn(self, mode, paths, options):
+        """Each mode runs in a fresh process, so the URLconf picks its views"""
+        env = dict(os.environ, STORE_ASYNC_VIEWS=MODES[mode][1])
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_asgi',
+            '--worker', mode, '--paths', paths,
+            '--requests', str(options['requests']), '--concurrency', options['concurrency'],
+        ]
+        if options['anonymous']:
+            command.append('--anonymous')
+        output = subprocess.run(command, env=env, capture_output=True, text=True)
+        if output.returncode:
+            raise CommandError(f'{mode} run failed:\n{output.stderr}')
+        return json.loads(output.stdout.strip().splitlines()[-1])
+
+    def _worker(self, mode, paths, requests, concurrency, anonymous):
+        user = None if anonymous else User.objects.get(email=BENCH_EMAIL)
+        served_by = MODES[mode][0]
+        rows = []
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for clients in concurrency:
+                if served_by == 'wsgi':
+                    rows.append(_run_wsgi(paths, requests, clients, user))
+                else:
+                    rows.append(asyncio.run(_run_asgi(paths, requests, clients, user)))
+        self.stdout.write(json.dumps(rows))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from store import checkout
+from store.benchmark import rolled_back
+from store.models import Category, Product, CartItem
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Benchmark checkout throughput against cart size (all writes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,5,20,50', help='Comma-separated cart sizes')
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        iterations = options['iterations']
+
+        self.stdout.write(f"{'lines':>6} {'orders/s':>10} {'ms/order':>10} {'queries':>8}")
+        for size in sizes:
+            with rolled_back():
+                self._run(size, iterations)
+
+    def _run(self, size, iterations):
+        category = Category.objects.create(name='bench-checkout', slug='bench-checkout')
+        slugs = [f'bench-{i}' for i in range(size)]
+        Product.objects.bulk_create([
+            Product(category=category, name=f'Bench {i}', slug=slug, price=10, stock=iterations * 10)
+            for i, slug in enumerate(slugs)
+        ])
+        # MySQL doesn't return primary keys from bulk_create
+        products = list(Product.objects.filter(slug__in=slugs).order_by('pk'))
+        user = User.objects.create_user('bench-checkout@example.com', 'bench')
+
+        elapsed = 0.0
+        queries = 0
+        for _ in range(iterations):
+            CartItem.objects.bulk_create([
+                CartItem(user=user, product=product, quantity=1) for product in products
+            ])
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                checkout.place_order(user)
+                elapsed += time.perf_counter() - start
+            queries += len(ctx.captured_queries)
+
+        self.stdout.write(
+            f'{size:>6} {iterations / elapsed:>10.1f} {elapsed / iterations * 1000:>10.2f} '
+            f'{queries / iterations:>8.1f}'
+        )
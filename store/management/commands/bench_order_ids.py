@@ -0,0 +1,60 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import order_ids
+from store.benchmark import rolled_back
+from store.models import Order
+from users.models import User
+
+SCHEMES = {
+    # What checkout used before store/order_ids.py
+    'random': lambda: ''.join(random.choices(string.ascii_uppercase + string.digits, k=10)),
+    'time-ordered': order_ids.generate,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark order insert throughput with random and time-ordered order IDs '
+        '(all writes are rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Orders inserted per scheme')
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Orders per INSERT (1 is what checkout does)')
+        parser.add_argument('--schemes', default=','.join(SCHEMES), help=f"Comma-separated: {', '.join(SCHEMES)}")
+
+    def handle(self, *args, **options):
+        rows, batch_size = options['rows'], options['batch_size']
+        # The last tenth shows what inserts cost once the index has grown
+        self.stdout.write(
+            f"{'scheme':>13} {'ids/s':>11} {'rows/s':>9} {'last 10% rows/s':>16}"
+        )
+        for scheme in options['schemes'].split(','):
+            make_id = SCHEMES[scheme]
+            started = time.perf_counter()
+            for _ in range(rows):
+                make_id()
+            generated = time.perf_counter() - started
+            with rolled_back():
+                overall, tail = self._insert(make_id, rows, batch_size)
+            self.stdout.write(f'{scheme:>13} {rows / generated:>11.0f} {overall:>9.0f} {tail:>16.0f}')
+
+    def _insert(self, make_id, rows, batch_size):
+        user = User.objects.create_user('bench-order-ids@example.com', 'bench')
+        tail_from = rows - rows // 10
+        started = time.perf_counter()
+        tail_started = None
+        for done in range(0, rows, batch_size):
+            if tail_started is None and done >= tail_from:
+                tail_started = time.perf_counter()
+            Order.objects.bulk_create([
+                Order(user=user, order_id=make_id()) for _ in range(min(batch_size, rows - done))
+            ])
+        finished = time.perf_counter()
+        tail_started = tail_started or started
+        return rows / (finished - started), (rows - tail_from) / (finished - tail_started)
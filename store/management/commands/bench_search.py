@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import search
+from store.benchmark import ADJECTIVES, NOUNS, rolled_back
+from store.models import Category, Product
+
+# Synthetic long-tail vocabulary (fabrics, collections, SKUs) so term
+# frequencies look like a real catalog rather than 30 words everywhere
+LONG_TAIL = [f'{prefix}{i}' for prefix in ('linen', 'denim', 'fall', 'sku') for i in range(2500)]
+QUERIES = ['jacket', 'black shirt', 'sneakers', 'warm brown jacket', 'denim417', 'linen88 dress', 'sku2024']
+
+BACKENDS = {
+    'icontains': search.IContainsBackend,
+    'inverted': search.InvertedIndexBackend,
+    'database': search.DatabaseFullTextBackend,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare search latency of the search backends at several catalog sizes (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma-separated catalog sizes')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f"{'products':>9} {'backend':>10} {'p50 ms':>9} {'max ms':>9} {'index s':>9}")
+        for size in sizes:
+            with rolled_back():
+                self._run(size, options['repeat'], options['batch_size'])
+
+    def _seed(self, size, batch_size):
+        rng = random.Random(size)
+        category = Category.objects.create(name='bench-search', slug='bench-search')
+        batch = []
+        for i in range(size):
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'
+            description = ' '.join(
+                [rng.choice(ADJECTIVES + NOUNS) for _ in range(8)] + rng.sample(LONG_TAIL, 4)
+            )
+            batch.append(Product(
+                category=category, name=name, slug=f'bench-search-{i}', description=description, price=10, stock=1
+            ))
+            if len(batch) == batch_size:
+                # bulk_create skips the signals, indexes are rebuilt below
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+
+    def _run(self, size, repeat, batch_size):
+        self._seed(size, batch_size)
+        queryset = Product.objects.filter(is_active=True)
+        for name, backend_class in BACKENDS.items():
+            backend = backend_class()
+            start = time.perf_counter()
+            backend.rebuild(batch_size=batch_size)
+            index_time = time.perf_counter() - start
+            search.cache.delete(search.STATS_KEY)
+
+            timings = []
+            for _ in range(repeat):
+                for query in QUERIES:
+                    start = time.perf_counter()
+                    # Count plus first page, as the paginated API serves it
+                    results = backend.search(queryset, query)
+                    results.count()
+                    list(results[:20])
+                    timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f'{size:>9} {name:>10} {statistics.median(timings):>9.2f} {max(timings):>9.2f} {index_time:>9.2f}'
+            )
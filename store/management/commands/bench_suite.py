@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the storefront and API hot paths against the benchmark dataset and report '
+        'throughput, p50/p99 latency and queries per request as JSON (writes orders and carts)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(benchmark.SCENARIOS),
+                            help=f"Comma-separated: {', '.join(benchmark.SCENARIOS)}")
+        parser.add_argument('--concurrency', default='1,8', help='Comma-separated client thread counts')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--output', help='Write the JSON result to this file')
+        parser.add_argument('--baseline', help='Compare against a JSON result written earlier')
+        parser.add_argument('--tolerance', type=float, default=0.15,
+                            help='Relative change that counts as a regression (default 0.15)')
+
+    def handle(self, *args, **options):
+        try:
+            result = benchmark.run(
+                scenarios=options['scenarios'].split(','),
+                concurrency=[int(value) for value in options['concurrency'].split(',')],
+                requests=options['requests'],
+                warmup=options['warmup'],
+                log=self.stderr.write,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        text = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = benchmark.compare(result, baseline, options['tolerance'])
+            for key, metric, before, after in regressions:
+                self.stderr.write(self.style.ERROR(f'{key} {metric}: {before} -> {after}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stderr.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
@@ -0,0 +1,41 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from store import images
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Build resized / WebP derivatives for product images that lack them or failed before'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild every image')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only(
+            'pk', 'image', 'image_derivatives'
+        ).order_by('pk')
+
+        built = failed = 0
+        last_pk = 0
+        # One pool for the whole run: starting workers per batch costs more
+        # than small batches of images
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(products.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                batch_built, batch_failed = images.build_many(batch, force=options['force'], pool=pool)
+                built += batch_built
+                failed += batch_failed
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Built derivatives for {built} images ({failed} failed) in {elapsed:.1f}s.'
+        ))
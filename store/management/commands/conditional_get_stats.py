@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from store import conditional
+
+
+class Command(BaseCommand):
+    help = 'Show how many conditional GETs were answered with 304 and what that saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters afterwards')
+
+    def handle(self, *args, **options):
+        stats = conditional.metrics()
+        answered = stats['full'] + stats['not_modified']
+        ratio = stats['not_modified'] / answered if answered else 0.0
+        self.stdout.write(f"Full responses: {stats['full']}")
+        self.stdout.write(f"304 Not Modified: {stats['not_modified']} ({ratio:.1%})")
+        self.stdout.write(f"Bandwidth saved: {stats['bytes_saved'] / 1024:.1f} KiB")
+        self.stdout.write(f"DB time saved: {stats['db_us_saved'] / 1000:.1f} ms")
+        if options['reset']:
+            conditional.reset_metrics()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
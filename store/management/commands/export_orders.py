@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import export
+
+
+class Command(BaseCommand):
+    help = 'Stream orders or order lines to CSV / JSON Lines in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=export.KINDS, default=export.ORDERS)
+        parser.add_argument('--format', dest='output', choices=export.FORMATS, default=export.CSV)
+        parser.add_argument('--since', help='First day (YYYY-MM-DD) or ISO datetime, inclusive')
+        parser.add_argument('--until', help='Last day (YYYY-MM-DD), inclusive, or ISO datetime, exclusive')
+        parser.add_argument('--status', action='append', default=[], help='Repeat for several statuses')
+        parser.add_argument('--output', dest='path', help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            chunks = export.stream(
+                options['kind'],
+                options['output'],
+                since=export.parse_bound(options['since']),
+                until=export.parse_bound(options['until'], end=True),
+                statuses=options['status'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['path']:
+            with open(options['path'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['path']}"))
+        else:
+            sys.stdout.writelines(chunks)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.cart import flush_dirty_carts
+
+
+class Command(BaseCommand):
+    help = 'Write cache-backed carts back to CartItem in batches (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        flushed = flush_dirty_carts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} carts.'))
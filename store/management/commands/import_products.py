@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_import import import_products
+
+
+class Command(BaseCommand):
+    help = 'Upsert products by slug from a CSV file (category,name,slug,description,price,image,stock,is_active)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='Show what would change without writing')
+        parser.add_argument('--diff-limit', type=int, default=50, help='Changes to list (dry run)')
+        parser.add_argument('--image-workers', type=int, default=8)
+        parser.add_argument(
+            '--no-reindex', action='store_true',
+            help='Skip search indexing (run rebuild_search_index afterwards)',
+        )
+        parser.add_argument(
+            '--no-images', action='store_true',
+            help='Skip image derivatives (run build_image_derivatives afterwards)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            file = open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(str(e))
+        with file:
+            report = import_products(
+                file,
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                diff_limit=options['diff_limit'] if options['dry_run'] else 0,
+                image_workers=options['image_workers'],
+                reindex=not options['no_reindex'],
+                derive_images=not options['no_images'],
+            )
+
+        for change in report.diff:
+            self.stdout.write(f'  {change}')
+        for line, message in report.errors[:20]:
+            self.stdout.write(self.style.ERROR(f'  line {line}: {message}'))
+        for line, path in report.missing_images[:20]:
+            self.stdout.write(self.style.WARNING(f'  line {line}: image not found: {path}'))
+
+        prefix = 'Dry run: would have ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}created {report.created}, updated {report.updated}, '
+            f'unchanged {report.unchanged}; {report.error_count} invalid rows, '
+            f'{report.missing_image_count} missing images. '
+            f'{report.rows} rows in {report.elapsed:.1f}s ({report.rows_per_second:,.0f} rows/s)'
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from store import facets
+from store.models import ProductFacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recount the precomputed product facet table from the catalog'
+
+    def handle(self, *args, **options):
+        facets.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {ProductFacetCount.objects.count()} facet cells.'))
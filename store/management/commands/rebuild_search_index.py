@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index of the configured (or given) backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', help='Dotted path of a search backend class')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['backend']:
+            backend = import_string(options['backend'])()
+        else:
+            backend = search.get_backend()
+        count = backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} products with {type(backend).__name__}.'
+        ))
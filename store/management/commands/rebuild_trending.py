@@ -0,0 +1,65 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from store import trending
+from store.models import OrderItem, ProductSalesStats, ProductSalesDay
+
+
+class Command(BaseCommand):
+    help = 'Rebuild trending sales counters and day buckets from OrderItem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--prune-only', action='store_true',
+            help='Only drop day buckets that fell out of the rolling window',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['prune_only']:
+            deleted = trending.prune_buckets()
+            self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} expired day buckets.'))
+            return
+
+        since = timezone.localdate() - timedelta(days=trending.window_days() - 1)
+
+        # One grouped pass over order lines: units per product per day
+        rows = OrderItem.objects.exclude(order__status='cancelled').annotate(
+            day=TruncDate('order__created_at'),
+        ).values('product_id', 'day').annotate(
+            quantity=Sum('quantity'),
+            last_sold_at=Max('order__created_at'),
+        ).order_by()
+
+        stats = {}
+        buckets = []
+        tz = timezone.get_current_timezone()
+        for row in rows.iterator(chunk_size=batch_size):
+            product_id, day, quantity = row['product_id'], row['day'], row['quantity']
+            entry = stats.get(product_id)
+            if entry is None:
+                entry = stats[product_id] = ProductSalesStats(product_id=product_id)
+            # Day granularity is plenty for a multi-day half-life
+            midday = timezone.make_aware(datetime.combine(day, time(12)), tz)
+            entry.total_sold += quantity
+            entry.trending_score += quantity * trending.decay_weight(midday)
+            if entry.last_sold_at is None or row['last_sold_at'] > entry.last_sold_at:
+                entry.last_sold_at = row['last_sold_at']
+            if day >= since:
+                buckets.append(ProductSalesDay(product_id=product_id, day=day, quantity=quantity))
+
+        with transaction.atomic():
+            ProductSalesStats.objects.all().delete()
+            ProductSalesDay.objects.all().delete()
+            ProductSalesStats.objects.bulk_create(stats.values(), batch_size=batch_size)
+            ProductSalesDay.objects.bulk_create(buckets, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt trending stats for {len(stats)} products ({len(buckets)} day buckets).'
+        ))
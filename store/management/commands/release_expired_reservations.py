@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.reservations import sweep
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations in batches (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = sweep(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations.'))
@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from store import conditional, instrumentation
+
+
+class Command(BaseCommand):
+    help = (
+        'Show p50/p95/p99 request timings per view and likely N+1 queries, as '
+        'published by every process to the shared cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', help='Only views whose name contains this')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--reset', action='store_true', help='Forget the timings afterwards')
+
+    def handle(self, *args, **options):
+        views = {
+            name: entry for name, entry in instrumentation.report().items()
+            if not options['view'] or options['view'] in name
+        }
+        if options['json']:
+            self.stdout.write(json.dumps({'views': views, 'conditional_get': conditional.metrics()}, indent=2))
+        elif not views:
+            self.stdout.write('No requests recorded (a local-memory cache only sees this process).')
+        else:
+            self._table(views)
+        if options['reset']:
+            instrumentation.reset()
+            self.stdout.write(self.style.SUCCESS('Timings reset.'))
+
+    def _table(self, views):
+        self.stdout.write(
+            f"{'view':<32} {'reqs':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'db p95':>8} {'ser p95':>8} {'tpl p95':>8} {'q p95':>6}"
+        )
+        for name, entry in views.items():
+            total = entry['total_ms']
+            self.stdout.write(
+                f"{name:<32} {entry['requests']:>6} {total['p50']:>8.1f} {total['p95']:>8.1f} {total['p99']:>8.1f} "
+                f"{entry['db_ms']['p95']:>8.1f} {entry['serializer_ms']['p95']:>8.1f} "
+                f"{entry['template_ms']['p95']:>8.1f} {entry['queries']['p95']:>6.0f}"
+            )
+        flagged = [(name, entry['n_plus_one']) for name, entry in views.items() if entry['n_plus_one']]
+        if flagged:
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING('Likely N+1 queries (runs in one request):'))
+            for name, shapes in flagged:
+                for shape in shapes:
+                    self.stdout.write(f"  {name}: {shape['count']}x {shape['sql'][:160]}")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Create (or with --clear remove) the benchmark dataset used by bench_suite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(benchmark.SCALES), default='small')
+        for table in ('categories', 'products', 'users', 'orders', 'cart-items'):
+            parser.add_argument(f'--{table}', type=int, help=f'Override the number of {table.replace("-", " ")}')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true', help='Remove existing benchmark data first')
+        parser.add_argument('--clear-only', action='store_true', help='Only remove the benchmark data')
+
+    def handle(self, *args, **options):
+        if options['clear'] or options['clear_only']:
+            benchmark.clear()
+            self.stdout.write('Removed the benchmark data.')
+            if options['clear_only']:
+                return
+        sizes = dict(benchmark.SCALES[options['scale']])
+        for table in sizes:
+            if options[table] is not None:
+                sizes[table] = options[table]
+        counts = benchmark.seed(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+            **sizes,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{value} {name.replace("_", " ")}' for name, value in counts.items() if name != 'seconds')
+            + f" in {counts['seconds']}s"
+        ))
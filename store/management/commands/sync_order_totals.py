@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Backfill or verify the denormalized Order.total_amount / item_count columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report orders whose stored totals disagree with their lines',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            stale = Order.objects.with_stale_totals()
+            count = stale.count()
+            for order_id in stale.values_list('order_id', flat=True)[:20]:
+                self.stdout.write(f'  stale: {order_id}')
+            if count:
+                raise CommandError(f'{count} orders have stale totals.')
+            self.stdout.write(self.style.SUCCESS('All order totals are consistent.'))
+            return
+
+        # Walk the primary key in ranges so each UPDATE stays short
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = 0
+        while True:
+            pks = list(
+                Order.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            updated += Order.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).refresh_totals()
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed totals for {updated} orders.'))
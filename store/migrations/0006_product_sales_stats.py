@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_alter_orderitem_price_alter_orderitem_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_stats', serialize=False, to='store.product')),
+                ('total_sold', models.IntegerField(default=0)),
+                ('trending_score', models.FloatField(db_index=True, default=0)),
+                ('last_sold_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductSalesDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_days', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'product'], name='sales_day_day_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'day'), name='unique_product_sales_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:35
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    lines = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+    Order.objects.update(
+        total_amount=Coalesce(
+            models.Subquery(
+                lines.annotate(total=models.Sum(models.F('quantity') * models.F('price'))).values('total'),
+                output_field=money,
+            ),
+            Decimal('0.00'),
+            output_field=money,
+        ),
+        item_count=Coalesce(
+            models.Subquery(lines.annotate(count=models.Count('id')).values('count')),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_product_sales_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
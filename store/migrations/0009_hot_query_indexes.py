@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def dedupe_before_constraints(apps, schema_editor):
+    """Make existing rows satisfy the new unique constraints"""
+    Product = apps.get_model('store', 'Product')
+    CartItem = apps.get_model('store', 'CartItem')
+
+    # Later duplicates of a slug get the product id appended
+    duplicated = (
+        Product.objects.values('slug').annotate(n=models.Count('id')).filter(n__gt=1).values_list('slug', flat=True)
+    )
+    for slug in list(duplicated):
+        for product in Product.objects.filter(slug=slug).order_by('id')[1:]:
+            product.slug = f'{slug[:200]}-{product.id}'
+            product.save(update_fields=['slug'])
+
+    # Duplicate cart lines are merged into the oldest one
+    duplicated = (
+        CartItem.objects.values('user_id', 'product_id').annotate(n=models.Count('id')).filter(n__gt=1)
+    )
+    for row in list(duplicated):
+        items = list(CartItem.objects.filter(user_id=row['user_id'], product_id=row['product_id']).order_by('id'))
+        keep = items[0]
+        keep.quantity = sum(item.quantity for item in items)
+        keep.save(update_fields=['quantity'])
+        CartItem.objects.filter(id__in=[item.id for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_before_constraints, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(max_length=220, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'created_at', 'is_active'], name='product_cat_created_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'is_active'], name='product_created_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'is_active'], name='product_price_active_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_item_per_user'),
+        ),
+    ]
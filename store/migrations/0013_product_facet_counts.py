@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:29
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    ProductFacetCount = apps.get_model('store', 'ProductFacetCount')
+    edges = [Decimal(str(edge)) for edge in getattr(settings, 'PRODUCT_PRICE_BUCKETS', [25, 50, 100, 250])]
+    bucket = models.Case(
+        *[models.When(price__lt=edge, then=models.Value(i)) for i, edge in enumerate(edges)],
+        default=models.Value(len(edges)),
+        output_field=models.IntegerField(),
+    )
+    in_stock = models.Case(
+        models.When(stock__gt=0, then=models.Value(True)),
+        default=models.Value(False),
+        output_field=models.BooleanField(),
+    )
+    rows = Product.objects.filter(is_active=True).annotate(bucket=bucket, in_stock=in_stock).values(
+        'category_id', 'bucket', 'in_stock'
+    ).annotate(count=models.Count('pk')).order_by()
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(
+            category_id=row['category_id'], price_bucket=row['bucket'],
+            in_stock=row['in_stock'], count=row['count'],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('in_stock', models.BooleanField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='store.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'price_bucket', 'in_stock'), name='unique_facet_cell')],
+            },
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
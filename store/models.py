@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.db.models.functions import Coalesce
 from decimal import Decimal
 
 # -----------------------
@@ -17,15 +18,34 @@ class Category(models.Model):
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     name = models.CharField(max_length=200)
-    slug = models.SlugField(max_length=220)
+    slug = models.SlugField(max_length=220, unique=True)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized / WebP copies of image, see store/images.py
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # is_active goes last: Django renders is_active=True as a bare boolean
+        # expression ("WHERE is_active"), which neither SQLite nor MySQL can
+        # use as an equality prefix, so a leading is_active column would still
+        # sort. Ordered-column-first indexes serve the ORDER BY ... LIMIT
+        # directly and filter inactive rows from the index itself.
+        indexes = [
+            # home "latest", category pages and the products API
+            models.Index(fields=['category', 'created_at', 'is_active'], name='product_cat_created_active_idx'),
+            models.Index(fields=['created_at', 'is_active'], name='product_created_active_idx'),
+            # price filters and price ordering
+            models.Index(fields=['price', 'is_active'], name='product_price_active_idx'),
+            # MAX(updated_at) for the conditional GET validators
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            models.Index(fields=['category', 'updated_at'], name='product_cat_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -38,6 +58,11 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_item_per_user'),
+        ]
+
     def __str__(self):
         return f"{self.product.name} ({self.quantity})"
 
@@ -49,6 +74,42 @@ class CartItem(models.Model):
 # -----------------------
 # Orders & Order Items
 # -----------------------
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """Prefetch lines with their product and category in two extra queries"""
+        return self.prefetch_related(
+            models.Prefetch('items', queryset=OrderItem.objects.select_related('product__category'))
+        )
+
+    def for_display(self):
+        """Everything order history pages and serializers touch, without N+1 queries"""
+        return self.select_related('user').with_items()
+
+    def _line_totals(self):
+        lines = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+        total = lines.annotate(
+            total=models.Sum(models.F('quantity') * models.F('price'))
+        ).values('total')
+        count = lines.annotate(count=models.Count('id')).values('count')
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        return (
+            Coalesce(models.Subquery(total, output_field=money), Decimal('0.00'), output_field=money),
+            Coalesce(models.Subquery(count, output_field=models.IntegerField()), 0),
+        )
+
+    def refresh_totals(self):
+        """Recompute the stored totals from the order lines in one UPDATE"""
+        total, count = self._line_totals()
+        return self.update(total_amount=total, item_count=count)
+
+    def with_stale_totals(self):
+        """Orders whose stored totals disagree with their lines"""
+        total, count = self._line_totals()
+        return self.annotate(line_total=total, line_count=count).exclude(
+            total_amount=models.F('line_total'), item_count=models.F('line_count')
+        )
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -63,20 +124,28 @@ class Order(models.Model):
     is_paid = models.BooleanField(default=False)
     order_id = models.CharField(max_length=20, unique=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Denormalized from the order lines, see OrderQuerySet.refresh_totals()
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), db_index=True)
+    item_count = models.PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # order history, recent orders and the orders API
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
 
     def __str__(self):
         # Use email instead of username since custom User model might not have username
         user_identifier = self.user.email if hasattr(self.user, 'email') else f"User {self.user.id}"
         return f"Order #{self.order_id} by {user_identifier}"
 
-    def total_amount(self):
-        """Calculate total amount for the order"""
-        total = Decimal('0.00')
-        for item in self.items.all():
-            item_total = item.total_price()
-            if item_total is not None:
-                total += item_total
-        return total
+    def refresh_totals(self):
+        """Recompute total_amount and item_count after the lines changed"""
+        Order.objects.filter(pk=self.pk).refresh_totals()
+        self.refresh_from_db(fields=['total_amount', 'item_count'])
 
 
 class OrderItem(models.Model):
@@ -97,4 +166,101 @@ class OrderItem(models.Model):
         # If price is not set, use the product's current price
         if self.price is None or self.price == 0:
             self.price = self.product.price
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+# -----------------------
+# Sales Statistics
+# -----------------------
+class ProductSalesStats(models.Model):
+    """Incrementally maintained sales counters that back the trending section"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales_stats')
+    total_sold = models.IntegerField(default=0)
+    # Forward-decayed score, see store.trending for the weighting scheme
+    trending_score = models.FloatField(default=0, db_index=True)
+    last_sold_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.total_sold} sold"
+
+
+class ProductSalesDay(models.Model):
+    """Units sold per product per calendar day (rolling window buckets)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_days')
+    day = models.DateField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_sales_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'product'], name='sales_day_day_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} on {self.day}: {self.quantity}"
+
+
+# -----------------------
+# Search Index
+# -----------------------
+class SearchDocument(models.Model):
+    """Per-product length statistics for the built-in inverted index"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)
+
+
+class SearchPosting(models.Model):
+    """One (term, product) entry of the inverted index, see store.search"""
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'product'], name='unique_search_posting'),
+        ]
+
+
+# -----------------------
+# Stock Reservations
+# -----------------------
+class StockReservation(models.Model):
+    """Stock held for a user's cart line until ``expires_at``, see store.reservations"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_reservation_per_user'),
+        ]
+        indexes = [
+            # Live holds per product, summed straight off the index
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='reservation_live_idx'),
+            # The sweeper
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for {self.user_id} until {self.expires_at}"
+
+
+# -----------------------
+# Facet Counts
+# -----------------------
+class ProductFacetCount(models.Model):
+    """Active products per (category, price bucket, in stock), see store.facets"""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_counts')
+    price_bucket = models.PositiveSmallIntegerField()
+    in_stock = models.BooleanField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'price_bucket', 'in_stock'], name='unique_facet_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id}/{self.price_bucket}/{'in' if self.in_stock else 'out of'} stock: {self.count}"
@@ -0,0 +1,131 @@
+"""
+Order numbers that are unique without asking the database.
+
+An ID is 15 Crockford base32 characters (digits and upper-case letters
+without I, L, O and U), packing::
+
+    48-bit Unix time in ms | 10-bit node | 15-bit sequence
+
+so IDs sort by creation time: new orders go to the right-hand edge of the
+``order_id`` unique index instead of random pages all over it, and nothing
+has to be looked up to avoid a collision.
+
+Every worker process needs its own node number. Set ``ORDER_ID_NODE``
+(0-1023) per process if the process manager can hand them out; otherwise
+each process leases one from the shared cache (``cache.add``) the first
+time it needs an ID and renews it while it keeps issuing them.
+
+A lease only coordinates processes that share the cache; with the default
+per-process local-memory cache two workers can lease the same node. So a
+leased node's sequence starts each millisecond at a random point in its
+lower half rather than at 0: two processes on one node then only collide
+when they issue the same random number in the same millisecond, and
+``checkout.place_order`` draws a new ID in that case.
+
+Within a process the sequence counts up inside one millisecond. If the clock
+goes backwards, or a millisecond runs out of sequence numbers, IDs carry on
+from the last timestamp issued, so they stay increasing per node.
+"""
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+LENGTH = 15
+NODE_BITS = 10
+SEQUENCE_BITS = 15
+NODES = 1 << NODE_BITS
+LEASE_KEY = 'order-id:node:{}'
+
+
+class _Generator:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.node = None
+        self.token = uuid.uuid4().hex
+        self.renew_at = 0.0
+        self.last_ms = 0
+        self.sequence = 0
+
+    def _lease_seconds(self):
+        return getattr(settings, 'ORDER_ID_NODE_LEASE_SECONDS', 3600)
+
+    def _lease(self):
+        lease = self._lease_seconds()
+        start = random.randrange(NODES)
+        for offset in range(NODES):
+            node = (start + offset) % NODES
+            if cache.add(LEASE_KEY.format(node), self.token, lease):
+                return node
+        raise RuntimeError('No order ID node is free; set ORDER_ID_NODE per process')
+
+    def _node(self, now):
+        """``(node, whether it may be shared with another process)``"""
+        configured = getattr(settings, 'ORDER_ID_NODE', None)
+        if configured is not None:
+            return configured, False
+        if self.node is None:
+            self.node = self._lease()
+            self.renew_at = now + self._lease_seconds() / 2
+        elif now >= self.renew_at:
+            key = LEASE_KEY.format(self.node)
+            # Somebody else has it if ours lapsed meanwhile
+            if cache.get(key) != self.token and not cache.add(key, self.token, self._lease_seconds()):
+                self.node = self._lease()
+                self.last_ms = self.sequence = 0
+            else:
+                cache.set(key, self.token, self._lease_seconds())
+            self.renew_at = now + self._lease_seconds() / 2
+        return self.node, True
+
+    def next(self):
+        with self.lock:
+            now = time.time()
+            node, shared = self._node(now)
+            ms = int(now * 1000)
+            if ms > self.last_ms:
+                self.last_ms = ms
+                self.sequence = random.randrange(1 << (SEQUENCE_BITS - 1)) if shared else 0
+            else:
+                self.sequence += 1
+                if self.sequence >> SEQUENCE_BITS:
+                    self.last_ms, self.sequence = self.last_ms + 1, 0
+            return encode(self.last_ms, node, self.sequence)
+
+
+def encode(ms, node, sequence):
+    value = (ms << (NODE_BITS + SEQUENCE_BITS)) | (node << SEQUENCE_BITS) | sequence
+    chars = []
+    for _ in range(LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def decode(order_id):
+    """``(created, node, sequence)`` of an ID made by ``generate()``"""
+    value = 0
+    for char in order_id:
+        value = value * 32 + ALPHABET.index(char)
+    sequence = value & ((1 << SEQUENCE_BITS) - 1)
+    node = (value >> SEQUENCE_BITS) & (NODES - 1)
+    ms = value >> (NODE_BITS + SEQUENCE_BITS)
+    return datetime.fromtimestamp(ms / 1000, tz=dt_timezone.utc), node, sequence
+
+
+_generator = _Generator()
+# A forked worker must not carry on with its parent's node and sequence
+os.register_at_fork(after_in_child=_generator.reset)
+
+
+def generate():
+    return _generator.next()
@@ -0,0 +1,136 @@
+"""
+Order status transitions, shared by the admin actions and the orders API.
+
+``TRANSITIONS`` lists where each status may move next. A transition is
+applied to a whole set of orders at once inside one transaction: the orders
+that may take the new status are locked, flipped with one conditional
+``UPDATE ... WHERE status IN (allowed sources)`` and, for cancellations, their
+lines are summed per product in one grouped query and put back on the shelf
+with one ``F()`` update per product. Because a cancelled order can never
+leave ``cancelled``, cancelling twice (or from two admin tabs at once)
+restores stock only once.
+
+``update()`` bypasses the model signals, so the page cache, trending
+counters and storefront summaries are taken care of here.
+"""
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import facets, page_cache, storefront, trending
+from .models import Order, OrderItem, Product
+
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+SHIPPED = 'shipped'
+DELIVERED = 'delivered'
+CANCELLED = 'cancelled'
+
+TRANSITIONS = {
+    PENDING: {CONFIRMED, CANCELLED},
+    CONFIRMED: {PENDING, SHIPPED, CANCELLED},
+    SHIPPED: {DELIVERED},
+    DELIVERED: set(),
+    CANCELLED: set(),
+}
+
+
+class TransitionError(Exception):
+    """Raised when an order cannot move to the requested status"""
+
+
+def sources(target):
+    """Statuses an order may be in to move to ``target``"""
+    if target not in TRANSITIONS:
+        raise TransitionError(f'Unknown status: {target}')
+    return sorted(status for status, targets in TRANSITIONS.items() if target in targets)
+
+
+def can_transition(current, target):
+    return target in TRANSITIONS.get(current, ())
+
+
+def restock_cancelled(order_ids):
+    """Put the lines of ``order_ids`` back into stock; returns the products touched"""
+    restored = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('product_id')
+        .annotate(quantity=Sum('quantity'))
+        .order_by('product_id')
+    )
+    now = timezone.now()
+    product_ids = []
+    for row in restored:
+        Product.objects.filter(pk=row['product_id']).update(
+            stock=F('stock') + row['quantity'], updated_at=now
+        )
+        product_ids.append(row['product_id'])
+    trending.revert_sales(
+        OrderItem.objects.filter(order_id__in=order_ids).values_list(
+            'product_id', 'quantity', 'order__created_at'
+        )
+    )
+    return product_ids
+
+
+def transition(orders, target):
+    """
+    Move every order in ``orders`` (a queryset) that may take ``target`` to it.
+
+    Returns ``(changed, skipped)``: orders already in ``target`` or whose
+    status doesn't allow the move are left untouched and counted as skipped.
+    Raises ``TransitionError`` for an unknown status.
+    """
+    allowed = sources(target)
+    with transaction.atomic():
+        # Lock in primary-key order so concurrent transitions can't deadlock
+        locked = list(
+            Order.objects.select_for_update()
+            .filter(pk__in=orders.values('pk'), status__in=allowed)
+            .order_by('pk')
+            .values_list('pk', 'user_id')
+        )
+        order_ids = [pk for pk, _ in locked]
+        total = orders.count()
+        if not order_ids:
+            return 0, total
+        changed = Order.objects.filter(pk__in=order_ids, status__in=allowed).update(status=target)
+
+        tags, category_ids = [], set()
+        if target == CANCELLED:
+            product_ids = restock_cancelled(order_ids)
+            category_ids = set(
+                Product.objects.filter(pk__in=product_ids).values_list('category_id', flat=True)
+            )
+            tags = [page_cache.CATALOG]
+            tags += [page_cache.product_tag(product_id) for product_id in product_ids]
+            tags += [page_cache.category_tag(category_id) for category_id in category_ids]
+
+        user_ids = {user_id for _, user_id in locked}
+
+        def after_commit():
+            if tags:
+                page_cache.purge(*tags)
+            if category_ids:
+                # Restocking may bring products back in stock
+                facets.refresh(category_ids)
+            for user_id in user_ids:
+                storefront.invalidate_user(user_id)
+
+        transaction.on_commit(after_commit)
+    return changed, total - changed
+
+
+def transition_order(order, target):
+    """
+    Move a single ``order`` to ``target``; raises ``TransitionError`` if its
+    current status doesn't allow it. ``order`` is refreshed afterwards.
+    """
+    if not can_transition(order.status, target):
+        raise TransitionError(f'Cannot change a {order.status} order to {target}')
+    changed, _ = transition(Order.objects.filter(pk=order.pk), target)
+    order.refresh_from_db(fields=['status'])
+    if not changed:
+        # Someone else moved it first
+        raise TransitionError(f'Cannot change a {order.status} order to {target}')
+    return order
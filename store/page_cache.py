@@ -0,0 +1,155 @@
+"""
+Full-page cache for anonymous storefront pages.
+
+Pages are stored under their host, path and query string together with the
+tags they were rendered from (``product:<id>``, ``category:<id>``, ...). Each tag
+has a version counter in the cache; purging a tag bumps its version, which
+invalidates every page that carries it without having to know their keys.
+This only relies on get/set/add/incr, so it works with the local-memory and
+file-based backends as well as Redis or Memcached.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+PAGE_PREFIX = 'pagecache:page:'
+TAG_PREFIX = 'pagecache:tag:'
+
+# Shared tags
+CATALOG = 'catalog'          # product listings (home sections)
+CATEGORIES = 'categories'    # category menu
+
+
+def product_tag(product_id):
+    return f'product:{product_id}'
+
+
+def category_tag(category_id):
+    return f'category:{category_id}'
+
+
+def _cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+
+
+def _page_key(request):
+    raw = f'{request.get_host()}{request.get_full_path()}'
+    return PAGE_PREFIX + hashlib.md5(raw.encode()).hexdigest()
+
+
+def _initial_version():
+    # Seed new counters from the clock: a counter that was evicted and is
+    # created again must not repeat a version some stored page or ETag saw
+    return time.time_ns() // 1000
+
+
+def tag_versions(tags):
+    """Current version of every tag, creating missing counters"""
+    cache = _cache()
+    keys = {TAG_PREFIX + tag: tag for tag in tags}
+    found = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_version(), None)
+        found.update(cache.get_many(list(missing)))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def purge(*tags):
+    """Invalidate every cached page that carries any of ``tags``"""
+    cache = _cache()
+    for tag in tags:
+        key = TAG_PREFIX + tag
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Never seen: nothing cached under it yet
+            cache.add(key, _initial_version(), None)
+
+
+def tag_page(request, *tags):
+    """Record the tags the current page is rendered from"""
+    if not hasattr(request, '_page_cache_tags'):
+        request._page_cache_tags = set()
+    request._page_cache_tags.update(tags)
+
+
+def _is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # Only touch the session (and the DB) when the client actually has one
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return not request.user.is_authenticated
+    return True
+
+
+def _is_cacheable_response(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+    )
+
+
+def _lookup(request):
+    """``(key, cached response)``; ``key`` is ``None`` when the page can't be cached"""
+    if not _is_cacheable_request(request):
+        return None, None
+    cache = _cache()
+    key = _page_key(request)
+    entry = cache.get(key)
+    if entry is not None and tag_versions(entry['tags']) == entry['tags']:
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for header, value in entry['headers'].items():
+            response[header] = value
+        response['X-Page-Cache'] = 'HIT'
+        patch_vary_headers(response, ('Cookie',))
+        return key, response
+    return key, None
+
+
+def _store(request, key, response):
+    if key is None:
+        return response
+    if _is_cacheable_response(response):
+        tags = getattr(request, '_page_cache_tags', set())
+        _cache().set(key, {
+            'content': response.content,
+            'status': response.status_code,
+            'headers': {'Content-Type': response['Content-Type']},
+            'tags': tag_versions(tags),
+        }, _timeout())
+        response['X-Page-Cache'] = 'MISS'
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_anonymous_page(view_func):
+    """Serve anonymous GETs from the page cache until a tag is purged"""
+    if iscoroutinefunction(view_func):
+        async def _wrapped(request, *args, **kwargs):
+            # The lookup may load the session and user, which is sync-only
+            key, cached = await sync_to_async(_lookup)(request)
+            if cached is not None:
+                return cached
+            response = await view_func(request, *args, **kwargs)
+            return await sync_to_async(_store)(request, key, response)
+    else:
+        def _wrapped(request, *args, **kwargs):
+            key, cached = _lookup(request)
+            if cached is not None:
+                return cached
+            return _store(request, key, view_func(request, *args, **kwargs))
+    return wraps(view_func)(_wrapped)
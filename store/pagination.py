@@ -0,0 +1,191 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Instead of ``COUNT(*)`` plus a growing ``OFFSET``, a page is fetched with
+``WHERE (key, id) > (last key, last id) ORDER BY key, id LIMIT n``, so page
+1000 costs the same as page one. Cursors are opaque base64 tokens carrying
+the ordering name, the sort values of the boundary row and the direction.
+
+``StorePagination`` lets each viewset pick its default mode
+(``pagination_mode = 'cursor' | 'page'``) and each request override it with
+``?pagination=cursor|page``; passing ``?cursor=`` always means keyset.
+"""
+import base64
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+RELEVANCE = 'relevance'
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def ordering_for(request, view, queryset):
+    """
+    Resolve the ``(name, fields)`` ordering for a list request.
+
+    An explicit ``?ordering=`` wins; otherwise an order already put on the
+    queryset (e.g. search relevance) is kept; otherwise the view's default.
+    """
+    orderings = getattr(view, 'keyset_orderings', {'newest': ('-created_at', '-id')})
+    name = request.query_params.get('ordering')
+    if name:
+        if name not in orderings:
+            raise ValidationError({'ordering': f"Choose one of: {', '.join(orderings)}."})
+        return name, tuple(orderings[name])
+    if queryset.query.order_by:
+        fields = tuple(str(field) for field in queryset.query.order_by)
+        if 'id' not in fields and '-id' not in fields and 'pk' not in fields:
+            fields += ('id',)
+        return RELEVANCE, fields
+    name = getattr(view, 'keyset_default_ordering', next(iter(orderings)))
+    return name, tuple(orderings[name])
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE or 20
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, position, reverse):
+        payload = {'o': self.ordering_name, 'p': [_encode_value(value) for value in position], 'r': reverse}
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            position, reverse = payload['p'], bool(payload['r'])
+            if payload['o'] != self.ordering_name or len(position) != len(self.fields):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, json.JSONDecodeError):
+            raise NotFound('Invalid cursor')
+        return position, reverse
+
+    def _after(self, position, fields):
+        """Rows strictly after ``position`` in ``fields`` order, as one Q"""
+        condition = Q()
+        for i in reversed(range(len(fields))):
+            field = fields[i]
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': position[i]})
+            if i < len(fields) - 1:
+                step |= Q(**{name: position[i]}) & condition
+            condition = step
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        self.ordering_name, self.fields = ordering_for(request, view, queryset)
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        fields = self.fields
+        if reverse:
+            fields = tuple(field[1:] if field.startswith('-') else f'-{field}' for field in fields)
+        queryset = queryset.order_by(*fields)
+        if position is not None:
+            queryset = queryset.filter(self._after(position, fields))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # Going forward there is a previous page whenever we came from a cursor,
+        # going backward there is always a next page
+        self.has_next = has_more if not reverse else True
+        self.has_previous = position is not None if not reverse else has_more
+        self.page = rows
+        return rows
+
+    def _position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.fields]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class StorePagination(BasePagination):
+    """Page-number or keyset pagination, chosen per viewset and per request"""
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.page_number = PageNumberPagination()
+        self.keyset = KeysetPagination()
+        self.active = self.page_number
+
+    def use_keyset(self, request, view):
+        if request.query_params.get(self.keyset.cursor_query_param):
+            return True
+        mode = request.query_params.get(self.mode_query_param) or getattr(view, 'pagination_mode', 'page')
+        return mode == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request, view):
+            self.active = self.keyset
+        else:
+            self.active = self.page_number
+            if request.query_params.get('ordering'):
+                _, fields = ordering_for(request, view, queryset)
+                queryset = queryset.order_by(*fields)
+        return self.active.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number.get_paginated_response_schema(schema)
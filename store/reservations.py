@@ -0,0 +1,111 @@
+"""
+Time-bounded stock reservations for logged-in users' carts.
+
+Putting a product in the cart holds that quantity for
+``STOCK_RESERVATION_SECONDS``. Available-to-sell is ``Product.stock`` minus
+the live (unexpired) holds of everybody else, summed per product off the
+``(product, expires_at, quantity)`` index, so contention for a hot product
+is settled when it is added to the cart rather than at checkout.
+
+``hold()`` locks the affected product rows (in primary-key order, like
+checkout) while it checks and writes, so two carts can never hold more than
+the stock between them. Checkout then turns live holds into order lines
+without checking availability again, and only lines whose hold expired go
+through ``hold()`` first. Expired rows are simply ignored; ``sweep()``
+(``manage.py release_expired_reservations``) deletes them in batches.
+
+Anonymous session carts hold nothing until they are merged on login.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+
+def ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_SECONDS', 900))
+
+
+def reserved(product_ids, exclude_user_id=None, now=None):
+    """``{product_id: quantity}`` held by live reservations (of other users)"""
+    holds = StockReservation.objects.filter(product_id__in=list(product_ids), expires_at__gt=now or timezone.now())
+    if exclude_user_id is not None:
+        holds = holds.exclude(user_id=exclude_user_id)
+    return dict(holds.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+
+
+def available(products, user_id=None):
+    """Available-to-sell of ``products`` for ``user_id`` (their own holds count as available)"""
+    held = reserved([product.pk for product in products], exclude_user_id=user_id)
+    return {product.pk: max(product.stock - held.get(product.pk, 0), 0) for product in products}
+
+
+def held_by(user_id, product_ids, now=None):
+    """``{product_id: quantity}`` of ``user_id``'s live reservations"""
+    return dict(StockReservation.objects.filter(
+        user_id=user_id, product_id__in=list(product_ids), expires_at__gt=now or timezone.now()
+    ).values_list('product_id', 'quantity'))
+
+
+def hold(user_id, quantities):
+    """
+    Set ``user_id``'s reservations to ``{product_id: quantity}`` (0 releases)
+    and restart their expiry. Returns the product ids that were refused
+    because not enough stock is left; those keep their previous hold.
+    """
+    if not quantities:
+        return set()
+    now = timezone.now()
+    with transaction.atomic():
+        stock = dict(
+            Product.objects.select_for_update()
+            .filter(pk__in=list(quantities)).order_by('pk').values_list('pk', 'stock')
+        )
+        others = reserved(quantities, exclude_user_id=user_id, now=now)
+        mine = held_by(user_id, quantities, now=now)
+        refused, released, granted = set(), [], []
+        for product_id, quantity in sorted(quantities.items()):
+            if quantity <= 0:
+                released.append(product_id)
+            elif product_id not in stock:
+                refused.add(product_id)
+            # Shrinking a live hold is always fine, even if stock dropped meanwhile
+            elif quantity <= mine.get(product_id, 0) or quantity <= stock[product_id] - others.get(product_id, 0):
+                granted.append(StockReservation(
+                    user_id=user_id, product_id=product_id, quantity=quantity, expires_at=now + ttl()
+                ))
+            else:
+                refused.add(product_id)
+        if released:
+            release(user_id, released)
+        if granted:
+            unique_fields = ['user', 'product'] if connection.features.supports_update_conflicts_with_target else None
+            StockReservation.objects.bulk_create(
+                granted,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['quantity', 'expires_at'],
+            )
+    return refused
+
+
+def release(user_id, product_ids=None):
+    holds = StockReservation.objects.filter(user_id=user_id)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=list(product_ids))
+    holds.delete()
+
+
+def sweep(batch_size=1000, now=None):
+    """Delete expired reservations in primary-key batches; returns how many"""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(StockReservation.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += StockReservation.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,89 @@
+"""
+Cheap random sampling of active products.
+
+Each process keeps a sorted, compact ``array`` of active product ids. A version
+number in the shared cache is bumped whenever a product changes, and the array
+is reloaded lazily the next time a sample is drawn after that.
+"""
+import random
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+
+VERSION_KEY = 'store:active-product-ids:version'
+
+
+class ActiveProductSampler:
+    """Draws ``k`` distinct active product ids in O(k)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = array('q')
+        self._version = None
+
+    def invalidate(self):
+        """Mark every process' id array as stale"""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+
+    def _current_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+
+    def ids(self):
+        version = self._current_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._ids = array('q', Product.objects.filter(
+                        is_active=True
+                    ).order_by('id').values_list('id', flat=True))
+                    self._version = version
+        return self._ids
+
+    def sample_ids(self, k, rng=None):
+        """
+        Sparse Fisher-Yates: only the swapped positions are remembered, so
+        the cost is O(k) regardless of catalog size.
+        """
+        ids = self.ids()
+        n = len(ids)
+        k = min(k, n)
+        rng = rng or random
+        swapped = {}
+        picked = []
+        for i in range(k):
+            j = rng.randrange(i, n)
+            picked.append(swapped.get(j, ids[j]))
+            swapped[j] = swapped.get(i, ids[i])
+        return picked
+
+    def sample(self, k, rotation_seconds=None):
+        """
+        Return up to ``k`` random active products in sample order.
+
+        With ``rotation_seconds`` set, the sample is seeded by the current time
+        window so every instance shows the same products until it rotates.
+        """
+        if rotation_seconds is None:
+            rotation_seconds = getattr(settings, 'FEATURED_ROTATION_SECONDS', 0)
+        rng = None
+        if rotation_seconds:
+            rng = random.Random(int(time.time() // rotation_seconds))
+        picked = self.sample_ids(k, rng=rng)
+        products = Product.objects.filter(is_active=True).select_related('category').in_bulk(picked)
+        # Ids may have gone inactive since the array was loaded
+        return [products[pid] for pid in picked if pid in products]
+
+
+sampler = ActiveProductSampler()
@@ -0,0 +1,296 @@
+"""
+Pluggable product search.
+
+``get_backend()`` returns the backend named by ``PRODUCT_SEARCH_BACKEND``:
+
+* ``IContainsBackend`` - the original ``name/description__icontains`` filter.
+* ``InvertedIndexBackend`` - built-in inverted index (``SearchPosting``) with
+  light stemming and BM25 ranking, updated on ``Product`` save/delete.
+* ``DatabaseFullTextBackend`` - MySQL ``FULLTEXT`` / SQLite FTS5, see migration
+  0008 for the vendor-specific index objects.
+
+Every backend takes the already filtered product queryset and returns it
+restricted to the matches, ordered by relevance.
+"""
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, IntegerField, FloatField, Q, F, Sum, Count, Avg, Exists, OuterRef
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product, SearchDocument, SearchPosting
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the to with'.split()
+)
+STATS_KEY = 'store:search:stats'
+# Name matches count as much as this many description matches
+NAME_WEIGHT = 3
+
+
+def stem(token):
+    """Very light English suffix stripping (plurals and common verb endings)"""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith('ies') and len(token) > 4:
+        return token[:-3] + 'y'
+    if token.endswith(('sses', 'shes', 'ches', 'xes')):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    if token.endswith('ing') and len(token) > 5:
+        return token[:-3]
+    if token.endswith('ed') and len(token) > 4:
+        return token[:-2]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split on non-alphanumerics, drop stopwords, stem"""
+    if not text:
+        return []
+    return [
+        stem(token)[:64]
+        for token in TOKEN_RE.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def order_by_ids(queryset, ids):
+    """Restrict ``queryset`` to ``ids`` and keep their order"""
+    if not ids:
+        return queryset.none()
+    ids = [int(pk) for pk in ids]
+    meta = queryset.model._meta
+    column = f'{connection.ops.quote_name(meta.db_table)}.{connection.ops.quote_name(meta.pk.column)}'
+    # A single function call instead of a CASE with one branch per id, which
+    # gets expensive to build and to evaluate with hundreds of results
+    if connection.vendor == 'mysql':
+        ranking = RawSQL(f'FIELD({column}, {", ".join(map(str, ids))})', [], output_field=IntegerField())
+    elif connection.vendor == 'sqlite':
+        positions = ',' + ','.join(map(str, ids)) + ','
+        ranking = RawSQL(f"instr(%s, ',' || {column} || ',')", [positions], output_field=IntegerField())
+    else:
+        ranking = Case(
+            *[When(pk=pk, then=Value(rank)) for rank, pk in enumerate(ids)],
+            output_field=IntegerField(),
+        )
+    return queryset.filter(pk__in=ids).annotate(search_rank=ranking).order_by('search_rank')
+
+
+class BaseSearchBackend:
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def index_product(self, product):
+        """Called after a product is saved"""
+
+    def remove_product(self, product):
+        """Called after a product is deleted"""
+
+    def index_products(self, products):
+        """Re-index many products at once (bulk writes bypass the signals)"""
+        for product in products:
+            self.index_product(product)
+
+    def rebuild(self, batch_size=1000):
+        """Rebuild the whole index; returns the number of products indexed"""
+        return 0
+
+
+class IContainsBackend(BaseSearchBackend):
+    """Unindexed substring match, no relevance order"""
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query)
+        )
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, max_results=None):
+        self.max_results = max_results or getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 1000)
+
+    @staticmethod
+    def term_frequencies(product):
+        terms = Counter()
+        for token in tokenize(product.name):
+            terms[token] += NAME_WEIGHT
+        terms.update(tokenize(product.description))
+        return terms
+
+    def _postings(self, products):
+        documents, postings = [], []
+        for product in products:
+            terms = self.term_frequencies(product)
+            documents.append(SearchDocument(product_id=product.pk, length=sum(terms.values())))
+            postings.extend(
+                SearchPosting(term=term, product_id=product.pk, frequency=frequency)
+                for term, frequency in terms.items()
+            )
+        return documents, postings
+
+    def index_product(self, product):
+        documents, postings = self._postings([product])
+        with transaction.atomic():
+            SearchPosting.objects.filter(product_id=product.pk).delete()
+            SearchDocument.objects.update_or_create(
+                product_id=product.pk, defaults={'length': documents[0].length}
+            )
+            SearchPosting.objects.bulk_create(postings)
+
+    def index_products(self, products):
+        products = list(products)
+        ids = [product.pk for product in products]
+        with transaction.atomic():
+            SearchPosting.objects.filter(product_id__in=ids).delete()
+            SearchDocument.objects.filter(product_id__in=ids).delete()
+            self._write_batch(products, 1000)
+
+    def remove_product(self, product):
+        # Postings and the document row cascade with the product
+        pass
+
+    def rebuild(self, batch_size=1000):
+        count = 0
+        with transaction.atomic():
+            SearchPosting.objects.all().delete()
+            SearchDocument.objects.all().delete()
+            products = Product.objects.only('id', 'name', 'description').order_by('pk')
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) == batch_size:
+                    count += self._write_batch(batch, batch_size)
+                    batch = []
+            count += self._write_batch(batch, batch_size)
+        return count
+
+    def _write_batch(self, products, batch_size):
+        documents, postings = self._postings(products)
+        SearchDocument.objects.bulk_create(documents, batch_size=batch_size)
+        SearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+        return len(products)
+
+    def search(self, queryset, query):
+        terms = set(tokenize(query))
+        if not terms:
+            return queryset.none()
+
+        # Collection statistics barely move between queries; don't rescan per request
+        stats = cache.get_or_set(
+            STATS_KEY,
+            lambda: SearchDocument.objects.aggregate(total=Count('pk'), average=Avg('length')),
+            60,
+        )
+        total = stats['total'] or 0
+        average_length = stats['average'] or 1.0
+        document_frequency = dict(
+            SearchPosting.objects.filter(term__in=terms).values('term').annotate(
+                df=Count('pk')
+            ).values_list('term', 'df').order_by()
+        )
+        if not document_frequency:
+            return queryset.none()
+
+        # BM25: sum over terms of idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        idf = Case(
+            *[
+                When(term=term, then=Value(math.log(1 + (total - df + 0.5) / (df + 0.5))))
+                for term, df in document_frequency.items()
+            ],
+            output_field=FloatField(),
+        )
+        tf = F('frequency') * 1.0
+        norm = self.k1 * (1 - self.b + self.b * F('product__search_document__length') / average_length)
+        # Correlated EXISTS: a primary-key probe per posting rather than
+        # materializing the whole filtered catalog
+        ranked = SearchPosting.objects.filter(
+            Exists(queryset.filter(pk=OuterRef('product_id'))),
+            term__in=document_frequency.keys(),
+        ).values('product_id').annotate(
+            score=Sum(idf * tf * (self.k1 + 1) / (tf + norm), output_field=FloatField()),
+        ).order_by('-score', 'product_id')[:self.max_results]
+
+        return order_by_ids(queryset, [row['product_id'] for row in ranked])
+
+
+class DatabaseFullTextBackend(BaseSearchBackend):
+    """MySQL FULLTEXT (natural language mode) or SQLite FTS5 (bm25)"""
+
+    def __init__(self, max_results=None):
+        self.max_results = max_results or getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 1000)
+
+    def search(self, queryset, query):
+        if connection.vendor == 'mysql':
+            match = RawSQL(
+                'MATCH (store_product.name, store_product.description) AGAINST (%s IN NATURAL LANGUAGE MODE)',
+                [query],
+            )
+            return queryset.annotate(search_score=match).filter(search_score__gt=0).order_by('-search_score', 'pk')
+
+        if connection.vendor == 'sqlite':
+            tokens = TOKEN_RE.findall(query.lower())
+            if not tokens:
+                return queryset.none()
+            # Quote every token so user input can't inject FTS5 syntax
+            fts_query = ' OR '.join(f'"{token}"*' for token in tokens)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT rowid FROM store_product_fts WHERE store_product_fts MATCH %s '
+                    'ORDER BY bm25(store_product_fts, 3.0, 1.0) LIMIT %s',
+                    [fts_query, self.max_results],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+            return order_by_ids(queryset, ids)
+
+        return IContainsBackend().search(queryset, query)
+
+    # MySQL maintains FULLTEXT indexes itself; the SQLite FTS5 table is a
+    # standalone copy (triggers would not survive SQLite table rebuilds in
+    # later migrations), so it is kept in sync from the model signals.
+
+    def index_product(self, product):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM store_product_fts WHERE rowid = %s', [product.pk])
+                cursor.execute(
+                    'INSERT INTO store_product_fts (rowid, name, description) VALUES (%s, %s, %s)',
+                    [product.pk, product.name, product.description],
+                )
+
+    def remove_product(self, product):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM store_product_fts WHERE rowid = %s', [product.pk])
+
+    def rebuild(self, batch_size=1000):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM store_product_fts')
+                cursor.execute(
+                    'INSERT INTO store_product_fts (rowid, name, description) '
+                    'SELECT id, name, description FROM store_product'
+                )
+        return Product.objects.count()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'store.search.IContainsBackend')
+        _backend = import_string(path)()
+    return _backend
@@ -1,29 +1,64 @@
 from rest_framework import serializers
 from .models import Category, Product, CartItem, Order, OrderItem
+from .cart import BATCH_ADD, BATCH_OPS
+from . import images, instrumentation, order_ids
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedModelSerializer(serializers.ModelSerializer):
+    """Reports its representation time to the request profile (nested ones count once)"""
+    
+    def to_representation(self, instance):
+        with instrumentation.span('serializer'):
+            return super().to_representation(instance)
+
+class UserSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'email', 'first_name', 'last_name')
         read_only_fields = ('id', 'email')
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class ProductSerializer(serializers.ModelSerializer):
+class ResponsiveImageField(serializers.Field):
+    """``{src, srcset, webp_srcset}`` for a product image, with absolute URLs"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', '*')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, product):
+        if not product.image:
+            return None
+        request = self.context.get('request')
+        absolute = request.build_absolute_uri if request else (lambda url: url)
+
+        def absolute_srcset(value):
+            return ', '.join(
+                f'{absolute(url)} {width}' for url, width in (item.rsplit(' ', 1) for item in value.split(', ') if item)
+            )
+
+        return {
+            'src': absolute(images.fallback_url(product)),
+            'srcset': absolute_srcset(images.srcset(product, 'jpeg')),
+            'webp_srcset': absolute_srcset(images.srcset(product, 'webp')),
+        }
+
+class ProductSerializer(TimedModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
+    image_set = ResponsiveImageField()
     
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('image_derivatives',)
         read_only_fields = ('created_at', 'updated_at')
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -41,7 +76,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     total_price = serializers.SerializerMethodField()
     
@@ -53,25 +88,26 @@ class OrderItemSerializer(serializers.ModelSerializer):
     def get_total_price(self, obj):
         return obj.total_price()
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
-    total_amount = serializers.SerializerMethodField()
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
     class Meta:
         model = Order
         fields = ('id', 'order_id', 'user', 'user_email', 'created_at', 'is_paid', 
-                 'status', 'status_display', 'items', 'total_amount')
-        read_only_fields = ('id', 'order_id', 'created_at')
-    
-    def get_total_amount(self, obj):
-        return obj.total_amount()
+                 'status', 'status_display', 'items', 'total_amount', 'item_count')
+        # Status moves through OrderViewSet.set_status (store.orders)
+        read_only_fields = ('id', 'order_id', 'created_at', 'status', 'total_amount', 'item_count')
     
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
+        validated_data.setdefault('order_id', order_ids.generate())
         return super().create(validated_data)
 
+class OrderStatusSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
 class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1, default=1)
@@ -83,4 +119,12 @@ class AddToCartSerializer(serializers.Serializer):
                 raise serializers.ValidationError("Product is out of stock")
         except Product.DoesNotExist:
             raise serializers.ValidationError("Product not found")
-        return value
\ No newline at end of file
+        return value
+
+class CartBatchOperationSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, default=1)
+    op = serializers.ChoiceField(choices=BATCH_OPS, default=BATCH_ADD)
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartBatchOperationSerializer(many=True, allow_empty=False, max_length=100)
@@ -0,0 +1,115 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import cart, facets, images, page_cache, search, storefront
+from .models import Category, Product, Order, OrderItem
+from .sampling import sampler
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_active_product_ids(sender, **kwargs):
+    """Keep the featured-products sampler in sync with the catalog"""
+    sampler.invalidate()
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_category(sender, instance, **kwargs):
+    """A product moved to another category also leaves the old one's pages"""
+    if instance.pk:
+        instance._previous_category_id = Product.objects.filter(pk=instance.pk).values_list(
+            'category_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def purge_product_pages(sender, instance, **kwargs):
+    tags = [
+        page_cache.product_tag(instance.pk),
+        page_cache.category_tag(instance.category_id),
+        page_cache.CATALOG,
+    ]
+    previous = getattr(instance, '_previous_category_id', None)
+    if previous and previous != instance.category_id:
+        tags.append(page_cache.category_tag(previous))
+    page_cache.purge(*tags)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def purge_category_pages(sender, instance, **kwargs):
+    page_cache.purge(
+        page_cache.category_tag(instance.pk),
+        page_cache.CATEGORIES,
+        page_cache.CATALOG,
+    )
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def purge_ordered_product_pages(sender, instance, **kwargs):
+    """Sales change stock badges and the trending section"""
+    page_cache.purge(
+        page_cache.product_tag(instance.product_id),
+        page_cache.category_tag(instance.product.category_id),
+        page_cache.CATALOG,
+    )
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_order_totals(sender, instance, **kwargs):
+    """Keep Order.total_amount / item_count in step with single-line edits"""
+    Order.objects.filter(pk=instance.order_id).refresh_totals()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_facet_counts(sender, instance, **kwargs):
+    facets.schedule_refresh([instance.category_id, getattr(instance, '_previous_category_id', None)])
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    search.get_backend().index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    search.get_backend().remove_product(instance)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Carry a cart built before logging in over to the user's cart"""
+    if request is not None and hasattr(request, 'session'):
+        cart.merge_session_cart(request, user)
+
+
+@receiver(cart.cart_changed)
+def invalidate_cart_summary(sender, user_id, **kwargs):
+    storefront.invalidate_user(user_id)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_recent_orders(sender, instance, **kwargs):
+    # After commit, so a concurrent page can't cache the pre-order state again
+    user_id = instance.user_id
+    transaction.on_commit(lambda: storefront.invalidate_user(user_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_menu(sender, **kwargs):
+    storefront.invalidate_categories()
+
+
+@receiver(post_save, sender=Product)
+def build_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize a newly uploaded (or replaced) image right away"""
+    if not raw and images.needs_derivatives(instance):
+        images.build_for(instance)
@@ -0,0 +1,135 @@
+"""
+Per-request storefront context: cart summary, recent orders, category menu.
+
+``context_processors.storefront`` hands templates a ``Storefront`` object
+whose parts are computed on first access and then memoized on the request,
+so pages that never show the recent-orders dropdown never pay for it.
+
+Logged-in users' cart summary and recent orders are cached together in one
+entry keyed by a per-user version counter. Cart stores send ``cart_changed``
+and orders bump the version from ``store.signals`` (or the admin actions that
+update in bulk); bumping only moves the key, stale entries simply age out.
+Product price edits are not tracked, so ``STOREFRONT_CACHE_TIMEOUT`` bounds
+how long a cached cart total may lag behind them.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from .cart import SessionCartStore, get_user_cart_store
+from .models import Category, Order
+
+CATEGORIES_KEY = 'storefront:categories'
+RECENT_ORDERS = 5
+
+
+def _timeout():
+    return getattr(settings, 'STOREFRONT_CACHE_TIMEOUT', 300)
+
+
+def _version_key(user_id):
+    return f'storefront:user:{user_id}:version'
+
+
+def user_version(user_id):
+    """Current version of ``user_id``'s summary; changes on every invalidation"""
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Clock-seeded so a re-created counter never repeats an old version
+        cache.add(_version_key(user_id), time.time_ns() // 1000, None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def invalidate_user(user_id):
+    """Forget the cached summary of ``user_id``"""
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # Never cached: nothing to invalidate
+        user_version(user_id)
+
+
+def invalidate_categories():
+    cache.delete(CATEGORIES_KEY)
+
+
+def category_menu():
+    categories = cache.get(CATEGORIES_KEY)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(CATEGORIES_KEY, categories, _timeout())
+    return categories
+
+
+def user_summary(user):
+    """``{'cart_count', 'cart_total', 'recent_orders'}`` for a logged-in user"""
+    key = f'storefront:user:{user.pk}:v{user_version(user.pk)}'
+    summary = cache.get(key)
+    if summary is None:
+        count, total = get_user_cart_store(user).summary()
+        recent = Order.objects.filter(user=user).only(
+            'id', 'order_id', 'status', 'created_at'
+        ).order_by('-created_at')[:RECENT_ORDERS]
+        summary = {
+            'cart_count': count,
+            'cart_total': total,
+            'recent_orders': list(recent),
+        }
+        cache.set(key, summary, _timeout())
+    return summary
+
+
+class Storefront:
+    """Lazily evaluated parts of the page chrome, each computed at most once"""
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+
+    @cached_property
+    def _summary(self):
+        return user_summary(self.user)
+
+    @cached_property
+    def _session_cart(self):
+        return SessionCartStore(self.request.session)
+
+    @cached_property
+    def cart_count(self):
+        if self.user.is_authenticated:
+            return self._summary['cart_count']
+        return self._session_cart.count()
+
+    @cached_property
+    def cart_total(self):
+        if self.user.is_authenticated:
+            return self._summary['cart_total']
+        return self._session_cart.summary()[1]
+
+    @cached_property
+    def recent_orders(self):
+        if self.user.is_authenticated:
+            return self._summary['recent_orders']
+        return []
+
+    @cached_property
+    def categories(self):
+        return category_menu()
+
+    def preload(self):
+        """
+        Compute every part now, so an async view can fetch them on a worker
+        thread and the template never queries while rendering.
+        """
+        self.categories, self.cart_count, self.cart_total, self.recent_orders
+        return self
+
+
+def for_request(request):
+    """The request's ``Storefront``, created on first use"""
+    if not hasattr(request, '_storefront'):
+        request._storefront = Storefront(request)
+    return request._storefront
@@ -0,0 +1,31 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from store import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, sizes='100vw', width=640, **attrs):
+    """
+    ``<picture>`` with WebP and JPEG ``srcset`` for a product's image, e.g.
+    ``{% product_image product sizes="(min-width: 992px) 25vw, 50vw" class="card-img-top" %}``.
+    Falls back to a plain ``<img>`` of the original until derivatives exist.
+    """
+    if not product.image:
+        return ''
+    attrs.setdefault('alt', product.name)
+    attrs.setdefault('loading', 'lazy')
+    extra = format_html_join(' ', '{}="{}"', attrs.items())
+    jpeg_srcset = images.srcset(product, 'jpeg')
+    if not jpeg_srcset:
+        return format_html('<img src="{}" {}>', product.image.url, extra)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" {}>'
+        '</picture>',
+        images.srcset(product, 'webp'), sizes,
+        images.fallback_url(product, int(width)), jpeg_srcset, sizes, extra,
+    )
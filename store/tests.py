@@ -1,3 +1,1262 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.template import Context, Template
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.http import Http404, HttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import User
+from . import (
+    async_views, benchmark, checkout, conditional, export, facets, instrumentation, locks, order_ids, orders,
+    page_cache, reservations, search, storefront, throttling, trending,
+)
+from .catalog_import import import_products
+from .management.commands import audit_query_plans
+from . import cart as cart_stores
+from .cart import CacheCartStore, DatabaseCartStore, SessionCartStore
+from .models import (
+    Category, Product, CartItem, Order, OrderItem, ProductSalesDay, ProductSalesStats, SearchPosting, StockReservation,
+)
+from .sampling import ActiveProductSampler
+
+
+def make_catalog(count=3, stock=10):
+    category = Category.objects.create(name='Men', slug='men')
+    return [
+        Product.objects.create(
+            category=category, name=f'Product {i}', slug=f'product-{i}', price=10 + i, stock=stock
+        )
+        for i in range(count)
+    ]
+
+
+# -----------------------
+# Checkout
+# -----------------------
+class CheckoutServiceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@example.com', 'pw')
+        self.products = make_catalog()
+
+    def test_place_order_moves_cart_into_order(self):
+        CartItem.objects.create(user=self.user, product=self.products[0], quantity=2)
+        CartItem.objects.create(user=self.user, product=self.products[1], quantity=1)
+
+        order = checkout.place_order(self.user)
+
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(order.total_amount, 2 * 10 + 11)
+        self.assertEqual(order.item_count, 2)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 8)
+
+    def test_insufficient_stock_writes_nothing(self):
+        CartItem.objects.create(user=self.user, product=self.products[0], quantity=1)
+        CartItem.objects.create(user=self.user, product=self.products[1], quantity=11)
+
+        with self.assertRaises(checkout.InsufficientStockError):
+            checkout.place_order(self.user)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 10)
+
+    def test_empty_cart(self):
+        with self.assertRaises(checkout.EmptyCartError):
+            checkout.place_order(self.user)
+
+    def test_query_count(self):
+        cart = DatabaseCartStore(self.user)
+        for product in self.products:
+            cart.add(product)
+        # two savepoint pairs (the transaction and the order insert), cart
+        # read, products, holds, order, lines, cart and hold deletes and two
+        # counter upserts, plus a stock update and two counter bumps per product
+        with self.assertNumQueries(13 + 3 * len(self.products)):
+            checkout.place_order(self.user)
+
+
+class OrderIdTests(TestCase):
+    def test_ids_are_unique_and_increasing(self):
+        ids = [order_ids.generate() for _ in range(5000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all(len(order_id) == 15 for order_id in ids))
+
+    @override_settings(ORDER_ID_NODE=42)
+    def test_clock_going_back_keeps_ids_increasing(self):
+        generator = order_ids._Generator()
+        with mock.patch('store.order_ids.time.time', return_value=2_000_000_000.0):
+            first = generator.next()
+        with mock.patch('store.order_ids.time.time', return_value=1_999_999_999.0):
+            second = generator.next()
+        self.assertLess(first, second)
+        created, node, sequence = order_ids.decode(second)
+        self.assertEqual(created.timestamp(), 2_000_000_000.0)
+        self.assertEqual((node, sequence), (42, 1))
+
+    def test_processes_lease_distinct_nodes(self):
+        cache.clear()
+        first, second = order_ids._Generator(), order_ids._Generator()
+        self.assertNotEqual(order_ids.decode(first.next())[1], order_ids.decode(second.next())[1])
+
+    def test_leased_nodes_start_each_millisecond_at_a_random_sequence(self):
+        first, second = order_ids._Generator(), order_ids._Generator()
+        # As two workers with unshared caches leasing the same node
+        with mock.patch('store.order_ids.cache.add', return_value=True), \
+                mock.patch('store.order_ids.random.randrange', side_effect=[7, 1000, 7, 2000]), \
+                mock.patch('store.order_ids.time.time', return_value=2_000_000_000.0):
+            ids = {first.next(), second.next()}
+        self.assertEqual(len(ids), 2)
+        self.assertEqual({order_ids.decode(order_id)[1:] for order_id in ids}, {(7, 1000), (7, 2000)})
+
+    def test_checkout_draws_a_new_id_on_collision(self):
+        user = User.objects.create_user('ann@example.com', 'pw')
+        product = make_catalog(count=1)[0]
+        Order.objects.create(user=user, order_id='TAKEN')
+        DatabaseCartStore(user).add(product)
+        with mock.patch.object(checkout, 'generate_order_id', side_effect=['TAKEN', 'FRESH']):
+            order = checkout.place_order(user)
+        self.assertEqual(order.order_id, 'FRESH')
+        self.assertEqual(order.items.count(), 1)
+
+
+def make_orders(user, products, count, lines):
+    for _ in range(count):
+        order = Order.objects.create(user=user, order_id=checkout.generate_order_id())
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=2, price=product.price)
+            for product in products[:lines]
+        ])
+        order.refresh_totals()
+
+
+def count_queries(func):
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    return len(ctx.captured_queries)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    # Without row locks (SQLite) competing checkouts just fail with "database
+    # is locked", which says nothing about the oversell guard
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_checkouts_never_oversell(self):
+        product = make_catalog(count=1, stock=5)[0]
+        buyers = [User.objects.create_user(f'buyer{i}@example.com', 'pw') for i in range(8)]
+        for buyer in buyers:
+            CartItem.objects.create(user=buyer, product=product, quantity=1)
+
+        barrier = threading.Barrier(len(buyers))
+        unexpected = []
+
+        def buy(buyer):
+            try:
+                barrier.wait()
+                checkout.place_order(buyer)
+            except checkout.InsufficientStockError:
+                pass
+            except Exception as e:
+                unexpected.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(buyer,)) for buyer in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+        self.assertEqual(unexpected, [])
+        # Checkouts queue on the product's row lock: five succeed, three find it sold out
+        self.assertEqual(sold, 5)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 5)
+
+
+# -----------------------
+# Query plan audit
+# -----------------------
+class QueryPlanAuditTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest('The audit reads SQLite and MySQL plans only')
+        output = io.StringIO()
+        call_command('audit_query_plans', stdout=output)
+        self.assertNotIn('FAIL', output.getvalue())
+
+    def test_scans_and_filesorts_are_reported(self):
+        plan = (
+            'QUERY PLAN\n'
+            '|--SCAN store_order\n'
+            '|--SEARCH store_product USING INDEX product_created_active_idx (created_at<?)\n'
+            '|--SCAN store_category\n'
+            '`--USE TEMP B-TREE FOR ORDER BY'
+        )
+        self.assertEqual(audit_query_plans.sqlite_problems(plan, 0), [
+            'full scan of store_order', 'filesort (temp b-tree for ORDER BY)',
+        ])
+        self.assertEqual(audit_query_plans.sqlite_problems('SCAN store_product USING INDEX product_price_idx', 0), [])
+
+        plan = json.dumps({'query_block': {'ordering_operation': {'using_filesort': True, 'nested_loop': [
+            {'table': {'table_name': 'store_order', 'access_type': 'ALL', 'rows_examined_per_scan': 5000}},
+            {'table': {'table_name': 'store_product', 'access_type': 'ALL', 'rows_examined_per_scan': 10}},
+            {'table': {'table_name': 'store_cartitem', 'access_type': 'ref', 'rows_examined_per_scan': 5000}},
+        ]}}})
+        self.assertEqual(audit_query_plans.mysql_problems(plan, 1000), ['filesort', 'full scan of store_order (~5000 rows)'])
+
+
+# -----------------------
+# Trending
+# -----------------------
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.products = make_catalog()
+        self.now = timezone.now()
+
+    def stats(self, product):
+        return ProductSalesStats.objects.get(product=product)
+
+    def test_scores_halve_every_half_life(self):
+        week_ago = self.now - timedelta(days=7)
+        trending.record_sales([(self.products[0].id, 4)], when=week_ago)
+        trending.record_sales([(self.products[1].id, 3)], when=self.now)
+        score = self.stats(self.products[0]).trending_score
+        self.assertAlmostEqual(trending.current_score(score, self.now), 2.0)
+        self.assertAlmostEqual(trending.current_score(score, self.now + timedelta(days=7)), 1.0)
+        self.assertEqual(trending.top_products(), [self.products[1], self.products[0]])
+
+    def test_record_sales_merges_lines_and_reverts(self):
+        lines = [(self.products[0].id, 2), (self.products[0].id, 3), (self.products[1].id, 0)]
+        trending.record_sales(lines, when=self.now)
+        self.assertEqual(self.stats(self.products[0]).total_sold, 5)
+        self.assertFalse(ProductSalesStats.objects.filter(product=self.products[1]).exists())
+        self.assertEqual(trending.sold_in_window([self.products[0].id]), {self.products[0].id: 5})
+
+        trending.record_sales([(self.products[0].id, 2)], when=self.now, sign=-1)
+        stats = self.stats(self.products[0])
+        self.assertEqual(stats.total_sold, 3)
+        self.assertAlmostEqual(trending.current_score(stats.trending_score, self.now), 3.0)
+
+    def test_rebuild_matches_live_counters(self):
+        user = User.objects.create_user('ann@example.com', 'pw')
+        make_orders(user, self.products, count=2, lines=2)
+        old = Order.objects.create(user=user, order_id=checkout.generate_order_id())
+        OrderItem.objects.create(order=old, product=self.products[2], quantity=1, price=12)
+        Order.objects.filter(pk=old.pk).update(created_at=self.now - timedelta(days=60))
+        cancelled = Order.objects.create(user=user, order_id=checkout.generate_order_id(), status='cancelled')
+        OrderItem.objects.create(order=cancelled, product=self.products[0], quantity=5, price=10)
+
+        call_command('rebuild_trending', stdout=io.StringIO())
+        self.assertEqual(
+            dict(ProductSalesStats.objects.values_list('product_id', 'total_sold')),
+            {self.products[0].id: 4, self.products[1].id: 4, self.products[2].id: 1},
+        )
+        # The 60-day-old sale is outside the day-bucket window
+        self.assertEqual(
+            trending.sold_in_window([product.id for product in self.products]),
+            {self.products[0].id: 4, self.products[1].id: 4},
+        )
+        self.assertEqual(ProductSalesDay.objects.filter(product=self.products[2]).count(), 0)
+        top = trending.top_products()
+        self.assertEqual(top[-1], self.products[2])
+        self.assertEqual([(product.total_sold, product.sold_in_window) for product in top], [(4, 4), (4, 4), (1, 0)])
+
+    def test_first_sale_of_the_day_prunes_expired_buckets(self):
+        cache.clear()
+        ProductSalesDay.objects.create(
+            product=self.products[0], day=timezone.localdate() - timedelta(days=60), quantity=1
+        )
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            trending.record_sales([(self.products[0].id, 1)])
+            trending.record_sales([(self.products[1].id, 1)])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(ProductSalesDay.objects.values_list('quantity', flat=True)), [1, 1])
+        self.assertFalse(ProductSalesDay.objects.filter(day__lt=timezone.localdate()).exists())
+
+
+# -----------------------
+# Featured product sampling
+# -----------------------
+class SamplingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = make_catalog(count=10)
+        self.sampler = ActiveProductSampler()
+
+    def test_samples_are_distinct_active_ids(self):
+        ids = {product.id for product in self.products}
+        for seed in range(20):
+            picked = self.sampler.sample_ids(4, rng=random.Random(seed))
+            self.assertEqual(len(set(picked)), 4)
+            self.assertLessEqual(set(picked), ids)
+        self.assertEqual(sorted(self.sampler.sample_ids(50)), sorted(ids))
+
+    def test_product_changes_reload_the_ids(self):
+        self.sampler.ids()
+        with self.assertNumQueries(0):
+            self.sampler.ids()
+        self.products[0].is_active = False
+        self.products[0].save()
+        self.assertNotIn(self.products[0].id, self.sampler.ids())
+        self.assertEqual(len(self.sampler.ids()), 9)
+
+    def test_rotation_keeps_the_sample_within_a_window(self):
+        with mock.patch('store.sampling.time.time', return_value=999_960.0):
+            first = self.sampler.sample(3, rotation_seconds=60)
+        with mock.patch('store.sampling.time.time', return_value=1_000_019.0):
+            self.assertEqual(self.sampler.sample(3, rotation_seconds=60), first)
+
+
+# -----------------------
+# Keyset pagination
+# -----------------------
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = make_catalog(count=7)
+        # Ties on price, so the id tiebreaker matters
+        for i, product in enumerate(self.products):
+            Product.objects.filter(pk=product.pk).update(price=10 + i // 2)
+        self.client = APIClient()
+
+    def walk(self, url, link):
+        ids, pages = [], 0
+        while url:
+            data = self.client.get(url).data
+            ids.append([row['id'] for row in data['results']])
+            url, pages = data[link], pages + 1
+        return ids
+
+    def test_cursors_walk_every_row_once_in_both_directions(self):
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        pages = self.walk('/api/products/?pagination=cursor&ordering=price&page_size=2', 'next')
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        last = self.client.get('/api/products/?pagination=cursor&ordering=price&page_size=2')
+        for _ in range(3):
+            last = self.client.get(last.data['next'])
+        self.assertIsNone(last.data['next'])
+        backwards = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(sum(reversed(backwards), []), expected[:-1])
+
+    def test_descending_order_and_bad_cursors(self):
+        pages = self.walk('/api/products/?pagination=cursor&ordering=-price&page_size=3', 'next')
+        self.assertEqual(sum(pages, []), list(Product.objects.order_by('-price', '-id').values_list('id', flat=True)))
+
+        first = self.client.get('/api/products/?pagination=cursor&ordering=price&page_size=2')
+        cursor = first.data['next'].split('cursor=')[1].split('&')[0]
+        self.assertEqual(self.client.get(f'/api/products/?ordering=newest&cursor={cursor}').status_code, 404)
+        self.assertEqual(self.client.get('/api/products/?cursor=not-a-cursor').status_code, 404)
+
+
+# -----------------------
+# Order read path
+# -----------------------
+class OrderReadPathTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader@example.com', 'pw')
+        self.products = make_catalog(count=4)
+
+    def test_display_needs_no_further_queries(self):
+        make_orders(self.user, self.products, count=1, lines=3)
+        order = Order.objects.for_display().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(order.total_amount, 2 * (10 + 11 + 12))
+            [item.product.category.name for item in order.items.all()]
+
+    def test_totals_follow_line_changes(self):
+        make_orders(self.user, self.products, count=1, lines=2)
+        order = Order.objects.get()
+        OrderItem.objects.create(order=order, product=self.products[3], quantity=1, price=13)
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.item_count), (2 * (10 + 11) + 13, 3))
+
+        order.items.filter(product=self.products[0]).get().delete()
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.item_count), (2 * 11 + 13, 2))
+        self.assertFalse(Order.objects.with_stale_totals().exists())
+
+    def test_order_history_query_count_is_constant(self):
+        self.client.force_login(self.user)
+        url = reverse('store:order_history')
+        make_orders(self.user, self.products, count=1, lines=1)
+        self.client.get(url)  # warm the storefront cache
+        baseline = count_queries(lambda: self.client.get(url))
+
+        make_orders(self.user, self.products, count=5, lines=4)
+        cache.clear()
+        self.client.get(url)
+        self.assertEqual(count_queries(lambda: self.client.get(url)), baseline)
+
+    def test_order_api_query_count_is_constant(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('order-list')
+        make_orders(self.user, self.products, count=1, lines=1)
+        baseline = count_queries(lambda: client.get(url))
+
+        make_orders(self.user, self.products, count=5, lines=4)
+        response = client.get(url)
+        self.assertEqual(count_queries(lambda: client.get(url)), baseline)
+        self.assertEqual(len(response.data['results']), 6)
+
+
+# -----------------------
+# Page cache
+# -----------------------
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.renders = 0
+
+        @page_cache.cache_anonymous_page
+        def view(request):
+            self.renders += 1
+            page_cache.tag_page(request, page_cache.product_tag(1), page_cache.CATALOG)
+            return HttpResponse(f'render {self.renders}')
+
+        self.view = view
+
+    def get(self):
+        request = RequestFactory().get('/demo/')
+        request.user = AnonymousUser()
+        response = self.view(request)
+        return response['X-Page-Cache'], response.content.decode()
+
+    def test_purging_a_tag_drops_only_the_pages_that_carry_it(self):
+        self.assertEqual(self.get(), ('MISS', 'render 1'))
+        self.assertEqual(self.get(), ('HIT', 'render 1'))
+        page_cache.purge(page_cache.product_tag(2), page_cache.CATEGORIES)
+        self.assertEqual(self.get(), ('HIT', 'render 1'))
+        page_cache.purge(page_cache.product_tag(1))
+        self.assertEqual(self.get(), ('MISS', 'render 2'))
+        page_cache.purge(page_cache.CATALOG)
+        self.assertEqual(self.get(), ('MISS', 'render 3'))
+
+    def test_an_evicted_tag_counter_invalidates_its_pages(self):
+        self.get()
+        cache.delete(page_cache.TAG_PREFIX + page_cache.CATALOG)
+        self.assertEqual(self.get(), ('MISS', 'render 2'))
+
+    def test_saving_a_product_purges_its_page(self):
+        product = make_catalog(count=1)[0]
+        url = reverse('store:product_detail', args=[product.slug])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'HIT')
+        product.price = 99
+        product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, '99')
+
+
+# -----------------------
+# Storefront context
+# -----------------------
+class StorefrontContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper@example.com', 'pw')
+        self.products = make_catalog()
+
+    def test_summary_is_cached_until_the_cart_changes(self):
+        cart = DatabaseCartStore(self.user)
+        cart.add(self.products[0], 2)
+        self.assertEqual(storefront.user_summary(self.user)['cart_total'], 20)
+        with self.assertNumQueries(0):
+            storefront.user_summary(self.user)
+
+        cart.add(self.products[1])
+        summary = storefront.user_summary(self.user)
+        self.assertEqual((summary['cart_count'], summary['cart_total']), (2, 31))
+
+    def test_placing_an_order_refreshes_recent_orders(self):
+        DatabaseCartStore(self.user).add(self.products[0])
+        self.assertEqual(storefront.user_summary(self.user)['recent_orders'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = checkout.place_order(self.user)
+
+        summary = storefront.user_summary(self.user)
+        self.assertEqual([o.order_id for o in summary['recent_orders']], [order.order_id])
+        self.assertEqual(summary['cart_count'], 0)
+
+    def test_cached_page_chrome_costs_no_queries(self):
+        self.client.force_login(self.user)
+        url = reverse('store:home')
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        chrome_tables = ('FROM "store_cartitem"', 'FROM "store_order"', 'FROM "store_category"')
+        self.assertFalse([
+            query['sql'] for query in queries.captured_queries
+            if any(table in query['sql'] for table in chrome_tables)
+        ])
+
+
+
+# -----------------------
+# Async views
+# -----------------------
+@override_settings(STORE_PARALLEL_QUERIES=False)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = make_catalog()
+        self.factory = AsyncRequestFactory()
+
+    def request(self, path, **headers):
+        request = self.factory.get(path, headers=headers)
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+        return request
+
+    async def test_pages_render_and_use_the_page_cache(self):
+        response = await async_views.home(self.request('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Product 2')
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+
+        response = await async_views.category_products(self.request('/category/men/'), category_slug='men')
+        self.assertContains(response, '3 products')
+        response = await async_views.category_products(self.request('/category/men/'), category_slug='men')
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+        with self.assertRaises(Http404):
+            await async_views.product_detail(self.request('/product/nope/'), slug='nope')
+
+    async def test_product_detail_answers_revalidation_with_304(self):
+        response = await async_views.product_detail(self.request('/product/product-0/'), slug='product-0')
+        self.assertEqual(response.status_code, 200)
+        response = await async_views.product_detail(
+            self.request('/product/product-0/', if_none_match=response['ETag']), slug='product-0'
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_session_cart_endpoints(self):
+        request = self.request('/cart/add/', x_requested_with='XMLHttpRequest')
+        response = await async_views.add_to_cart(request, product_id=self.products[0].pk)
+        self.assertEqual(json.loads(response.content)['cart_count'], 1)
+
+        session = request.session
+        request = self.request('/cart/increment/')
+        request.session = session
+        await async_views.increment_cart(request, product_id=self.products[0].pk)
+        request = self.request('/cart/')
+        request.session = session
+        response = await async_views.cart_view(request)
+        self.assertContains(response, 'Product 0')
+        self.assertEqual(response.status_code, 200)
+
+
+# -----------------------
+# Conditional GET
+# -----------------------
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = make_catalog()
+        self.client = APIClient()
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_list_is_not_modified(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.revalidate(f'{url}?page_size=1', etag).status_code, 200)
+
+    def test_deactivated_or_deleted_products_change_the_etag(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        self.products[0].is_active = False
+        self.products[0].save()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+        etag = self.client.get(url)['ETag']
+        self.products[1].delete()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_validators_skip_the_list_query(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.revalidate(url, etag)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'LIMIT' in q['sql']])
+
+
+# -----------------------
+# Product search
+# -----------------------
+class InvertedIndexSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Men', slug='men')
+
+        def product(slug, name, description=''):
+            return Product.objects.create(
+                category=category, name=name, slug=slug, description=description, price=10, stock=5
+            )
+
+        self.jacket = product('jacket', 'Warm jacket', 'Wool, lined')
+        self.coat = product('coat', 'Brown coat', 'Longer than a jacket')
+        self.jackets = product('jackets', 'Jacket two-pack', 'Two jackets: one black jacket, one brown')
+        self.scarf = product('scarf', 'Scarf', 'Brown wool and cashmere')
+        self.backend = search.InvertedIndexBackend()
+
+    def search(self, query):
+        return list(self.backend.search(Product.objects.filter(is_active=True), query))
+
+    def test_name_matches_and_products_matching_every_term_rank_first(self):
+        results = self.search('jacket')
+        self.assertEqual(set(results[:2]), {self.jacket, self.jackets})
+        self.assertEqual(results[2:], [self.coat])
+        self.assertEqual(self.search('brown wool')[0], self.scarf)
+
+    def test_saved_and_deleted_products_are_reindexed(self):
+        self.scarf.name = 'Knitted scarf'
+        self.scarf.description = 'Merino'
+        self.scarf.save()
+        self.assertEqual(self.search('merino'), [self.scarf])
+        self.assertNotIn(self.scarf, self.search('wool'))
+
+        scarf_id = self.scarf.pk
+        self.scarf.delete()
+        self.assertEqual(self.search('merino'), [])
+        self.assertFalse(SearchPosting.objects.filter(product_id=scarf_id).exists())
+
+    def test_rebuild_restores_an_index_bulk_writes_left_stale(self):
+        Product.objects.filter(pk=self.coat.pk).update(name='Brown parka')
+        self.assertEqual(self.search('parka'), [])
+        self.assertEqual(self.backend.rebuild(batch_size=2), 4)
+        self.assertEqual(self.search('parka'), [self.coat])
+
+    def test_empty_and_stopword_queries_match_nothing(self):
+        for query in ('', '  ', 'the and of', '!?'):
+            self.assertEqual(self.search(query), [])
+
+    def test_matches_what_icontains_finds_for_whole_words(self):
+        icontains = search.IContainsBackend()
+        for query in ('wool', 'brown', 'scarf', 'cashmere', 'coat'):
+            expected = set(icontains.search(Product.objects.filter(is_active=True), query))
+            self.assertEqual(set(self.search(query)), expected, query)
+
+
+# -----------------------
+# Cart batch API
+# -----------------------
+class CartBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('batch@example.com', 'pw')
+        self.products = make_catalog(count=6, stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('cart-batch')
+
+    def post(self, operations):
+        return self.client.post(self.url, {'operations': operations}, format='json')
+
+    def test_applies_valid_operations_and_reports_failures(self):
+        CartItem.objects.create(user=self.user, product=self.products[0], quantity=2)
+        CartItem.objects.create(user=self.user, product=self.products[1], quantity=1)
+
+        response = self.post([
+            {'product': self.products[0].id, 'quantity': 1},
+            {'product': self.products[1].id, 'op': 'remove'},
+            {'product': self.products[2].id, 'quantity': 4, 'op': 'set'},
+            {'product': self.products[3].id, 'quantity': 6},
+            {'product': 999},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.data['results']], ['ok', 'ok', 'ok', 'error', 'error'])
+        self.assertEqual(
+            dict(CartItem.objects.filter(user=self.user).values_list('product_id', 'quantity')),
+            {self.products[0].id: 3, self.products[2].id: 4},
+        )
+        self.assertEqual(response.data['item_count'], 2)
+        self.assertEqual(response.data['total_amount'], 3 * 10 + 4 * 12)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        small = [{'product': self.products[0].id}]
+        large = [{'product': product.id, 'quantity': 2} for product in self.products]
+        CartItem.objects.create(user=self.user, product=self.products[1], quantity=1)
+
+        baseline = count_queries(lambda: self.post(small))
+        # The large batch both updates and inserts: one bulk_update more
+        self.assertEqual(count_queries(lambda: self.post(large)), baseline + 1)
+
+
+# -----------------------
+# Cart stores
+# -----------------------
+class CartStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = make_catalog(count=3, stock=5)
+        self.ann = User.objects.create_user('ann@example.com', 'pw')
+        self.bob = User.objects.create_user('bob@example.com', 'pw')
+
+    def test_lock_release_leaves_a_lock_taken_after_expiry_alone(self):
+        first = locks.cache_lock('demo', timeout=1)
+        first.__enter__()
+        # As if ``first`` overran its timeout and another holder took over
+        cache.delete('demo:lock')
+        with locks.cache_lock('demo', wait=0):
+            first.__exit__()
+            with self.assertRaises(locks.LockBusy):
+                locks.cache_lock('demo', wait=0).__enter__()
+        self.assertIsNone(cache.get('demo:lock'))
+
+    def test_dirty_users_are_marked_once_and_cleared_by_flush(self):
+        CacheCartStore(self.ann).add(self.products[0])
+        with mock.patch.object(cart_stores, '_update_dirty_shard', wraps=cart_stores._update_dirty_shard) as update:
+            CacheCartStore(self.ann).add(self.products[1])
+            CacheCartStore(self.ann).change(self.products[1].id, 1)
+        # Already marked: no shared set rewritten
+        update.assert_not_called()
+        CacheCartStore(self.bob).add(self.products[0])
+        self.assertEqual(cart_stores.dirty_user_ids(), [self.ann.pk, self.bob.pk])
+
+        self.assertEqual(cart_stores.flush_dirty_carts(user_ids=[self.ann.pk]), 1)
+        self.assertEqual(cart_stores.dirty_user_ids(), [self.bob.pk])
+        CacheCartStore(self.ann).add(self.products[2])
+        self.assertEqual(cart_stores.dirty_user_ids(), [self.ann.pk, self.bob.pk])
+        self.assertEqual(cart_stores.flush_dirty_carts(), 2)
+        self.assertEqual(cart_stores.dirty_user_ids(), [])
+        self.assertEqual(cart_stores.flush_dirty_carts(), 0)
+
+    def test_flush_writes_back_changed_lines_and_deletes_removed_ones(self):
+        CartItem.objects.create(user=self.ann, product=self.products[0], quantity=1)
+        CartItem.objects.create(user=self.ann, product=self.products[1], quantity=2)
+        cart = CacheCartStore(self.ann)
+        cart.change(self.products[0].id, 2)
+        cart.remove(self.products[1].id)
+        cart.add(self.products[2])
+        rows = lambda: dict(CartItem.objects.filter(user=self.ann).values_list('product_id', 'quantity'))
+        self.assertEqual(rows(), {self.products[0].id: 1, self.products[1].id: 2})
+
+        self.assertEqual(cart_stores.flush_dirty_carts(), 1)
+        self.assertEqual(rows(), {self.products[0].id: 3, self.products[2].id: 1})
+        self.assertFalse(cache.get(cart.key)['dirty'])
+        with self.assertNumQueries(0):
+            cart.flush()
+
+    def test_session_cart_merges_capped_at_available_stock(self):
+        DatabaseCartStore(self.bob).add(self.products[0], 3)
+        DatabaseCartStore(self.ann).add(self.products[1], 4)
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        session_cart = SessionCartStore(request.session)
+        session_cart.add(self.products[0], 4)
+        session_cart.add(self.products[1], 3)
+        session_cart.add(self.products[2], 2)
+
+        cart_stores.merge_session_cart(request, self.ann)
+        self.assertEqual(DatabaseCartStore(self.ann).items(), {
+            self.products[0].id: 2, self.products[1].id: 5, self.products[2].id: 2,
+        })
+        self.assertEqual(session_cart.items(), {})
+
+
+# -----------------------
+# Stock reservations
+# -----------------------
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.product = make_catalog(count=1, stock=5)[0]
+        self.ann = User.objects.create_user('ann@example.com', 'pw')
+        self.bob = User.objects.create_user('bob@example.com', 'pw')
+
+    def expire(self, user):
+        StockReservation.objects.filter(user=user).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_carts_cannot_hold_more_than_the_stock(self):
+        self.assertEqual(DatabaseCartStore(self.ann).add(self.product, 4), 4)
+        bob = DatabaseCartStore(self.bob)
+        self.assertIsNone(bob.add(self.product, 2))
+        self.assertEqual(bob.add(self.product, 1), 1)
+        self.assertEqual(bob.available([self.product]), {self.product.id: 1})
+        # Shrinking frees stock for others straight away
+        DatabaseCartStore(self.ann).change(self.product.id, -3)
+        self.assertEqual(bob.change(self.product.id, 3), 4)
+
+    def test_expired_holds_free_stock_and_are_swept(self):
+        DatabaseCartStore(self.ann).add(self.product, 5)
+        self.assertIsNone(DatabaseCartStore(self.bob).add(self.product))
+        self.expire(self.ann)
+        self.assertEqual(DatabaseCartStore(self.bob).add(self.product, 5), 5)
+        self.assertEqual(reservations.sweep(batch_size=1), 1)
+        self.assertEqual(list(StockReservation.objects.values_list('user_id', flat=True)), [self.bob.id])
+
+    def test_checkout_consumes_and_releases_holds(self):
+        DatabaseCartStore(self.ann).add(self.product, 2)
+        checkout.place_order(self.ann)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_of_a_lapsed_hold_rechecks_availability(self):
+        DatabaseCartStore(self.ann).add(self.product, 3)
+        self.expire(self.ann)
+        DatabaseCartStore(self.bob).add(self.product, 3)
+        with self.assertRaises(checkout.InsufficientStockError):
+            checkout.place_order(self.ann)
+        self.assertFalse(Order.objects.exists())
+
+    def test_api_refuses_stock_held_by_others(self):
+        DatabaseCartStore(self.ann).add(self.product, 4)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        response = client.post('/api/cart/', {'product': self.product.id, 'quantity': 2})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['available'], 1)
+
+        DatabaseCartStore(self.bob).add(self.product)
+        item = CartItem.objects.get(user=self.bob)
+        self.assertEqual(client.patch(f'/api/cart/{item.pk}/', {'quantity': 2}).status_code, 400)
+        self.assertEqual(client.delete(f'/api/cart/{item.pk}/').status_code, 204)
+        self.assertFalse(StockReservation.objects.filter(user=self.bob).exists())
+
+    def test_api_refuses_non_positive_quantities(self):
+        DatabaseCartStore(self.bob).add(self.product, 2)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        for quantity in (0, -1):
+            response = client.post('/api/cart/', {'product': self.product.id, 'quantity': quantity})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get(user=self.bob).quantity, 2)
+
+
+# -----------------------
+# Throttling
+# -----------------------
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storages = {
+            'cache': throttling.CacheStorage(),
+            'sqlite': throttling.SQLiteStorage(os.path.join(directory.name, 'throttle.sqlite3')),
+        }
+
+    def test_algorithms_allow_the_rate_on_every_storage(self):
+        for name, storage in self.storages.items():
+            for algorithm, run in throttling.ALGORITHMS.items():
+                with self.subTest(storage=name, algorithm=algorithm):
+                    key = f'{algorithm}:client'
+                    results = [run(storage, key, 1000.0, 3, 60) for _ in range(4)]
+                    self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+                    self.assertGreater(results[-1][1], 0)
+                    # The refusal wasn't counted against the client
+                    self.assertTrue(run(storage, key, 1000.0 + results[-1][1] + 0.01, 3, 60)[0])
+
+    def test_sliding_window_weighs_the_previous_window(self):
+        storage = self.storages['cache']
+        for _ in range(4):
+            self.assertTrue(throttling.sliding_window(storage, 'k', 59.0, 4, 60)[0])
+        # A quarter into the next window, 3 of the previous 4 still count
+        self.assertTrue(throttling.sliding_window(storage, 'k', 75.0, 4, 60)[0])
+        allowed, wait = throttling.sliding_window(storage, 'k', 75.0, 4, 60)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 15.0)
+
+    def test_search_and_checkout_have_their_own_scope(self):
+        make_catalog()
+        client = APIClient()
+        with mock.patch.dict(throttling.ScopedRateThrottle.THROTTLE_RATES, {'search': '2/min'}):
+            statuses = [client.get('/api/products/', {'search': 'product'}).status_code for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            self.assertEqual(client.get('/api/products/').status_code, 200)
+
+        client.force_authenticate(User.objects.create_user('throttled@example.com', 'pw'))
+        with mock.patch.dict(throttling.ScopedRateThrottle.THROTTLE_RATES, {'checkout': '1/min'}):
+            self.assertEqual(client.post('/api/orders/').status_code, 400)
+            self.assertEqual(client.post('/api/orders/').status_code, 429)
+            self.assertEqual(client.get('/api/orders/').status_code, 200)
+
+
+# -----------------------
+# Facets
+# -----------------------
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = make_catalog(count=3, stock=1)
+        women = Category.objects.create(name='Women', slug='women')
+        for i, (price, stock) in enumerate([(30, 1), (60, 0), (300, 2)]):
+            Product.objects.create(category=women, name=f'Dress {i}', slug=f'dress-{i}', price=price, stock=stock)
+        facets.refresh()
+        self.client = APIClient()
+
+    def get_facets(self, **params):
+        response = self.client.get('/api/products/', {'facets': '1', **params})
+        self.assertEqual(response.status_code, 200)
+        result = response.data['facets']
+        return (
+            {c['slug']: c['count'] for c in result['category']},
+            [bucket['count'] for bucket in result['price']],
+            result['in_stock'],
+        )
+
+    def test_each_facet_ignores_its_own_filter(self):
+        self.assertEqual(self.get_facets(), ({'men': 3, 'women': 3}, [3, 1, 1, 0, 1], 5))
+        self.assertEqual(self.get_facets(category='women'), ({'men': 3, 'women': 3}, [0, 1, 1, 0, 1], 2))
+        self.assertEqual(self.get_facets(in_stock='1'), ({'men': 3, 'women': 2}, [3, 1, 0, 0, 1], 5))
+        self.assertEqual(self.get_facets(min_price='25', max_price='99.99'), ({'men': 0, 'women': 2}, [3, 1, 1, 0, 1], 1))
+
+    def test_table_and_aggregate_agree(self):
+        with self.assertNumQueries(1):
+            cells = facets.cells(Product.objects.filter(is_active=True), False, Decimal('25'), Decimal('99.99'))
+        with self.assertNumQueries(1):
+            live = facets.cells(Product.objects.filter(is_active=True), True, Decimal('25'), Decimal('99.99'))
+        self.assertEqual(facets.counts(cells), facets.counts(live))
+        # A range that splits a bucket can't come from the table
+        self.assertEqual(self.get_facets(max_price='11'), ({'men': 2, 'women': 0}, [3, 1, 1, 0, 1], 2))
+
+    def test_product_changes_refresh_the_table(self):
+        product = self.products[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 70
+            product.save()
+        self.assertEqual(self.get_facets()[1], [2, 1, 2, 0, 1])
+
+        CartItem.objects.create(user=User.objects.create_user('f@example.com', 'pw'), product=product, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.place_order(product.cartitem_set.get().user)
+        self.assertEqual(self.get_facets()[2], 4)
+
+
+# -----------------------
+# Order export
+# -----------------------
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('export@example.com', 'pw')
+        self.products = make_catalog()
+        make_orders(self.user, self.products, count=5, lines=2)
+
+    def test_lines_are_read_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            text = ''.join(export.stream(export.LINES, chunk_size=3))
+        rows = text.splitlines()
+        self.assertEqual(rows[0].split(',')[:3], ['order_id', 'created_at', 'status'])
+        self.assertEqual(len(rows), 1 + 10)
+        # ceil(10 / 3) chunks plus the empty one that ends the walk
+        self.assertEqual(len(queries.captured_queries), 5)
+
+    def test_staff_endpoint_streams_filtered_jsonl(self):
+        Order.objects.filter(pk=Order.objects.first().pk).update(status='shipped')
+        staff = User.objects.create_superuser('staff@example.com', 'pw')
+        client = APIClient()
+        client.force_authenticate(staff)
+
+        response = client.get(reverse('order-export'), {'output': 'jsonl', 'status': 'shipped'})
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('"user_email":"export@example.com"', lines[0])
+
+
+# -----------------------
+# Catalog import
+# -----------------------
+class CatalogImportTests(TestCase):
+    HEADER = 'category,name,slug,description,price,image,stock,is_active\n'
+
+    def setUp(self):
+        self.products = make_catalog(count=2)
+
+    def run_import(self, body, **kwargs):
+        return import_products(io.StringIO(self.HEADER + body), reindex=False, **kwargs)
+
+    def test_upserts_by_slug(self):
+        report = self.run_import(
+            'men,Product 0,product-0,,10.00,,10,True\n'
+            '1,Renamed,product-1,,11.00,,3,False\n'
+            'men,New,new-product,Fresh,5.50,,7,1\n'
+            'nope,Broken,broken,,1,,1,True\n',
+            batch_size=2,
+        )
+        self.assertEqual((report.created, report.updated, report.unchanged, report.error_count), (1, 1, 1, 1))
+        renamed = Product.objects.get(slug='product-1')
+        self.assertEqual((renamed.name, renamed.stock, renamed.is_active), ('Renamed', 3, False))
+        self.assertEqual(Product.objects.get(slug='new-product').price, 5.5)
+
+    def test_rejects_prices_the_column_cannot_hold(self):
+        report = self.run_import(
+            'men,A,nan,,NaN,,1,True\n'
+            'men,B,infinite,,-Infinity,,1,True\n'
+            'men,C,negative,,-0.01,,1,True\n'
+            'men,D,huge,,1e20,,1,True\n'
+            'men,E,rounds-up,,99999999.995,,1,True\n'
+            'men,F,fits,,99999999.99,,1,True\n'
+        )
+        self.assertEqual((report.created, report.error_count), (1, 5))
+        self.assertEqual([line for line, _ in report.errors], [2, 3, 4, 5, 6])
+        self.assertEqual(Product.objects.get(slug='fits').price, Decimal('99999999.99'))
+
+    def test_image_derivatives_share_one_pool_per_import(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from PIL import Image
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        os.makedirs(os.path.join(media.name, 'products'))
+        Image.new('RGB', (400, 200), 'navy').save(os.path.join(media.name, 'products', 'shirt.jpg'))
+        body = ''.join(f'men,Shirt {i},shirt-{i},,10,products/shirt.jpg,1,True\n' for i in range(3))
+        with override_settings(MEDIA_ROOT=media.name, PRODUCT_IMAGE_WIDTHS=[160]), \
+                mock.patch('store.catalog_import.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool, \
+                mock.patch('store.images.ProcessPoolExecutor') as own_pool:
+            report = self.run_import(body, batch_size=1, image_workers=1)
+        self.assertEqual((report.created, pool.call_count, own_pool.call_count), (3, 1, 0))
+        self.assertTrue(all(
+            derivatives['sizes'] for derivatives in Product.objects.filter(
+                slug__startswith='shirt-'
+            ).values_list('image_derivatives', flat=True)
+        ))
+
+    def test_dry_run_only_reports(self):
+        report = self.run_import('men,Other,product-0,,10.00,,10,True\n', dry_run=True)
+        self.assertEqual(report.updated, 1)
+        self.assertEqual(report.diff, ["~ product-0: name: 'Product 0' -> 'Other'"])
+        self.assertEqual(Product.objects.get(slug='product-0').name, 'Product 0')
+
+
+# -----------------------
+# Image derivatives
+# -----------------------
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        os.makedirs(os.path.join(self.media.name, 'products'))
+        Image.new('RGB', (800, 400), 'navy').save(os.path.join(self.media.name, 'products', 'shirt.jpg'))
+
+    def test_saving_an_image_builds_hashed_derivatives(self):
+        with override_settings(MEDIA_ROOT=self.media.name, PRODUCT_IMAGE_WIDTHS=[320, 1024]):
+            product = make_catalog(count=1)[0]
+            product.image = 'products/shirt.jpg'
+            product.save()
+            product.refresh_from_db()
+
+            sizes = product.image_derivatives['sizes']
+            self.assertEqual([size['width'] for size in sizes], [320, 800])
+            for size in sizes:
+                self.assertRegex(size['webp'], r'^products/derived/shirt-[0-9a-f]{12}-\d+w\.webp$')
+                self.assertTrue(os.path.exists(os.path.join(self.media.name, size['jpeg'])))
+
+            html = Template('{% load store_images %}{% product_image product class="x" %}').render(
+                Context({'product': product})
+            )
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('-320w.jpg 320w', html)
+        self.assertIn('class="x"', html)
+
+    def test_failed_images_are_retried_on_one_pool_per_run(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        broken = os.path.join(self.media.name, 'products', 'broken.jpg')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        with override_settings(MEDIA_ROOT=self.media.name, PRODUCT_IMAGE_WIDTHS=[320]):
+            products = make_catalog(count=2)
+            for product, name in zip(products, ('products/broken.jpg', 'products/shirt.jpg')):
+                product.image = name
+                product.save()
+            products[0].refresh_from_db()
+            self.assertEqual(products[0].image_derivatives, {'source': 'products/broken.jpg', 'sizes': [], 'failed': True})
+            # A later save doesn't retry; the next bulk run does
+            with mock.patch('store.images.render_derivatives') as render:
+                products[0].save()
+            render.assert_not_called()
+
+            os.replace(os.path.join(self.media.name, 'products', 'shirt.jpg'), broken)
+            command_pool = 'store.management.commands.build_image_derivatives.ProcessPoolExecutor'
+            with mock.patch(command_pool, wraps=ProcessPoolExecutor) as pool, \
+                    mock.patch('store.images.ProcessPoolExecutor') as own_pool:
+                call_command('build_image_derivatives', workers=1, batch_size=1, stdout=io.StringIO())
+            self.assertEqual((pool.call_count, own_pool.call_count), (1, 0))
+            products[0].refresh_from_db()
+            self.assertNotIn('failed', products[0].image_derivatives)
+            self.assertEqual([size['width'] for size in products[0].image_derivatives['sizes']], [320])
+
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@example.com', 'pw')
+        self.products = make_catalog()
+        for product in self.products[:2]:
+            CartItem.objects.create(user=self.user, product=product, quantity=2)
+        self.order = checkout.place_order(self.user)
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def test_cancelling_twice_restores_stock_once(self):
+        self.assertEqual(self.stock(), [8, 8, 10])
+        self.assertEqual(orders.transition(Order.objects.all(), 'cancelled'), (1, 0))
+        self.assertEqual(orders.transition(Order.objects.all(), 'cancelled'), (0, 1))
+        self.assertEqual(self.stock(), [10, 10, 10])
+        self.assertEqual(ProductSalesStats.objects.get(product=self.products[0]).total_sold, 0)
+
+    def test_invalid_transitions_are_skipped(self):
+        orders.transition(Order.objects.all(), 'confirmed')
+        orders.transition(Order.objects.all(), 'shipped')
+        self.assertEqual(orders.transition(Order.objects.all(), 'cancelled'), (0, 1))
+        self.assertEqual(self.stock(), [8, 8, 10])
+        with self.assertRaises(orders.TransitionError):
+            orders.transition_order(Order.objects.get(), 'pending')
+
+    def test_cancel_queries_are_per_product_not_per_line(self):
+        for _ in range(3):
+            for product in self.products:
+                CartItem.objects.create(user=self.user, product=product, quantity=1)
+            checkout.place_order(self.user)
+        # savepoint pair, lock, count, update, grouped lines, trending rows and
+        # categories, plus a stock update and a counter bump per product and
+        # one per touched day bucket
+        with self.assertNumQueries(8 + 3 * len(self.products)):
+            orders.transition(Order.objects.all(), 'cancelled')
+        self.assertEqual(self.stock(), [10, 10, 10])
+
+    def test_api_customers_may_only_cancel(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/orders/{self.order.pk}/status/'
+
+        self.assertEqual(client.post(url, {'status': 'confirmed'}).status_code, 403)
+        response = client.post(url, {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'cancelled')
+        self.assertEqual(client.post(url, {'status': 'cancelled'}).status_code, 409)
+        self.assertEqual(self.stock(), [10, 10, 10])
+
+
+# -----------------------
+# Request timing
+# -----------------------
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        instrumentation.reset()
+        self.products = make_catalog(count=6)
+        self.staff = User.objects.create_superuser('staff@example.com', 'pw')
+
+    def test_histogram_percentiles_stay_close(self):
+        histogram = instrumentation.Histogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        for fraction in (0.5, 0.95, 0.99):
+            self.assertAlmostEqual(histogram.percentile(fraction), 10000 * fraction, delta=10000 * fraction * 0.035)
+        self.assertLess(len(histogram.counts), 200)
+
+    def test_server_timing_and_report(self):
+        response = self.client.get(reverse('store:category_products', args=['men']))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", ser;dur=[\d.]+, tpl;dur=[\d.]+, total;dur=')
+
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        client.get('/api/products/')
+        data = client.get('/api/request-timings/').data
+        self.assertEqual(data['views']['store:category_products']['requests'], 1)
+        self.assertGreater(data['views']['product-list']['serializer_ms']['max'], 0)
+        self.assertIn('not_modified', data['conditional_get'])
+
+    @override_settings(REQUEST_TIMING_N_PLUS_ONE=3)
+    def test_repeated_query_shapes_are_flagged(self):
+        profile = instrumentation.RequestProfile()
+        for product in self.products:
+            profile.add_query('SELECT * FROM "store_product" WHERE "id" = %s', 0.001)
+        profile.add_query('SELECT * FROM "store_product" WHERE "id" IN (%s, %s)', 0.001)
+        instrumentation.registry.observe('demo', profile, 0.01)
+
+        flagged = instrumentation.report()['demo']['n_plus_one']
+        self.assertEqual(flagged, [{'sql': 'SELECT * FROM "store_product" WHERE "id" = %s', 'count': 6}])
+
+    def test_connection_opened_inside_timed_queries_keeps_wrappers_balanced(self):
+        # As if CONN_MAX_AGE = 0 closed the connection before a conditional GET
+        if instrumentation._record_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(instrumentation._record_query)
+        with conditional.timed_queries() as timer:
+            connection_created.send(sender=type(connection), connection=connection)
+            Product.objects.count()
+        self.assertEqual(connection.execute_wrappers, [instrumentation._record_query])
+        self.assertGreater(timer.seconds, 0)
+
+        response = self.client.get(reverse('store:category_products', args=['men']))
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+        self.assertEqual(connection.execute_wrappers, [instrumentation._record_query])
+
+
+# -----------------------
+# Benchmark suite
+# -----------------------
+class BenchmarkSuiteTests(TestCase):
+    def test_slices_cover_the_range(self):
+        self.assertEqual(benchmark._slices(10, 3), [(0, 4), (4, 7), (7, 10)])
+        self.assertEqual(benchmark._slices(2, 4), [(0, 1), (1, 2)])
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        def result(rps, p99, queries):
+            return {'results': {'home@1': {'throughput_rps': rps, 'p99_ms': p99, 'queries_per_request': queries}}}
+
+        baseline = result(100, 20, 8)
+        self.assertEqual(benchmark.compare(result(95, 21, 8), baseline, tolerance=0.1), [])
+        self.assertEqual(
+            [metric for _, metric, _, _ in benchmark.compare(result(80, 30, 12), baseline, tolerance=0.1)],
+            ['throughput_rps', 'p99_ms', 'queries_per_request'],
+        )
+
+
+class BenchmarkScenarioTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Bench 0', slug=f'{benchmark.PREFIX}-c-0')
+        for i in range(3):
+            Product.objects.create(
+                category=category, name=f'Warm jacket {i}', slug=f'{benchmark.PREFIX}-p-{i}', price=20, stock=100
+            )
+        User.objects.create_user(f'{benchmark.PREFIX}-0@example.com', 'pw')
+
+    def test_scenarios_run_unthrottled(self):
+        fixtures = benchmark.Fixtures()
+        rates = {'search': '1/min', 'checkout': '1/min'}
+        with mock.patch.dict(throttling.ScopedRateThrottle.THROTTLE_RATES, rates):
+            for scenario in ('api_search', 'api_order_create'):
+                stats = benchmark.run_scenario(scenario, fixtures, requests=4)
+                self.assertEqual((stats['requests'], stats['errors']), (4, 0))
@@ -0,0 +1,229 @@
+"""
+API throttles that keep O(1) state per client.
+
+DRF's ``SimpleRateThrottle`` stores every request timestamp of the last
+period per key, so a ``1000/day`` client costs a 1000-entry list that is
+read and rewritten on each request. These throttles take the same rates
+(``DEFAULT_THROTTLE_RATES``) and keys but keep constant state:
+
+* ``sliding-window`` (``THROTTLE_ALGORITHM``, the default): one counter
+  for the current fixed window and one for the previous window. The
+  request count is estimated as ``previous * (1 - elapsed share) +
+  current``. Counters only need an atomic increment, which every storage
+  backend has.
+* ``gcra``: the generic cell rate algorithm. It keeps one "theoretical
+  arrival time" per key and allows bursts of up to the whole rate. Each
+  request reads and writes it under the storage's lock.
+
+State lives in ``THROTTLE_STORAGE``:
+
+* ``CacheStorage`` uses the default cache. It is only shared between
+  workers when that cache is (the default local-memory cache gives each
+  process its own limits).
+* ``SQLiteStorage`` is one small SQLite file (``THROTTLE_SQLITE_PATH``).
+  SQLite's file lock serializes every process on the host, as a
+  shared-memory store would.
+
+``ScopedRateThrottle`` covers viewsets with a ``throttle_scope``; search
+(``ProductViewSet`` with ``?search=``) and checkout (``OrderViewSet.create``)
+have their own rates.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework import throttling
+
+from .locks import LockBusy, cache_lock
+
+KEY_PREFIX = 'throttle:'
+
+
+# -----------------------
+# Storage
+# -----------------------
+class CacheStorage:
+    """Counters and locked updates on the default cache"""
+
+    def incr(self, key, ttl, delta=1):
+        key = KEY_PREFIX + key
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            if cache.add(key, delta, math.ceil(ttl)):
+                return delta
+            return cache.incr(key, delta)
+
+    def get(self, key):
+        return cache.get(KEY_PREFIX + key)
+
+    def update(self, key, func):
+        """Replace the value with ``func(value)``'s first item; returns the second"""
+        key = KEY_PREFIX + key
+        with cache_lock(key, timeout=1, wait=0.2):
+            value, ttl, result = func(cache.get(key))
+            cache.set(key, value, math.ceil(ttl))
+        return result
+
+
+class SQLiteStorage:
+    """
+    Counters and locked updates in an SQLite file. Every operation is one
+    ``BEGIN IMMEDIATE`` transaction, which takes the database's write lock.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path=None):
+        self.path = str(path or getattr(settings, 'THROTTLE_SQLITE_PATH', 'throttle.sqlite3'))
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS throttle '
+                '(key TEXT PRIMARY KEY, value REAL NOT NULL, expires REAL NOT NULL)'
+            )
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _transaction(self, key, func):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM throttle WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+            value, ttl, result = func(row[0] if row else None)
+            connection.execute(
+                'INSERT INTO throttle (key, value, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires',
+                (key, value, now + ttl),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                connection.execute('DELETE FROM throttle WHERE expires <= ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return result
+
+    def incr(self, key, ttl, delta=1):
+        def add(value):
+            value = (value or 0) + delta
+            return value, ttl, int(value)
+        return self._transaction(key, add)
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM throttle WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def update(self, key, func):
+        return self._transaction(key, func)
+
+
+_storages = {}
+
+
+def get_storage():
+    path = getattr(settings, 'THROTTLE_STORAGE', 'store.throttling.CacheStorage')
+    if path not in _storages:
+        _storages[path] = import_string(path)()
+    return _storages[path]
+
+
+# -----------------------
+# Algorithms: (storage, key, now, limit, duration) -> (allowed, wait)
+# -----------------------
+def sliding_window(storage, key, now, limit, duration):
+    window = int(now // duration)
+    elapsed = now / duration - window
+    previous = storage.get(f'{key}:{window - 1}') or 0
+    current = storage.incr(f'{key}:{window}', 2 * duration)
+    if previous * (1 - elapsed) + current <= limit:
+        return True, None
+    # Refused requests don't count
+    storage.incr(f'{key}:{window}', 2 * duration, -1)
+    current -= 1
+    if current >= limit:
+        # Into the next window, until this one's share has decayed enough
+        return False, (1 - elapsed + 1 - (limit - 1) / current) * duration
+    # When the previous window's share has decayed enough for one more
+    return False, max((1 - (limit - current - 1) / previous - elapsed) * duration, 0.0)
+
+
+def gcra(storage, key, now, limit, duration):
+    interval = duration / limit
+
+    def arrive(tat):
+        tat = max(tat or now, now)
+        allow_at = tat + interval - duration
+        if now < allow_at:
+            return tat, tat - now, (False, allow_at - now)
+        return tat + interval, tat + interval - now, (True, None)
+
+    return storage.update(key, arrive)
+
+
+ALGORITHMS = {
+    'sliding-window': sliding_window,
+    'gcra': gcra,
+}
+
+
+# -----------------------
+# Throttles
+# -----------------------
+class ConstantStateThrottleMixin:
+    """Replaces ``SimpleRateThrottle``'s timestamp list with ``THROTTLE_ALGORITHM``"""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        algorithm = ALGORITHMS[getattr(settings, 'THROTTLE_ALGORITHM', 'sliding-window')]
+        try:
+            allowed, self._wait = algorithm(get_storage(), self.key, self.timer(), self.num_requests, self.duration)
+        except (LockBusy, sqlite3.OperationalError):
+            # A storage that can't answer in time doesn't take the API down
+            return True
+        return allowed
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class AnonRateThrottle(ConstantStateThrottleMixin, throttling.AnonRateThrottle):
+    pass
+
+
+class UserRateThrottle(ConstantStateThrottleMixin, throttling.UserRateThrottle):
+    pass
+
+
+class ScopedRateThrottle(ConstantStateThrottleMixin, throttling.ScopedRateThrottle):
+    """Applies to views that name a ``throttle_scope`` (which may depend on the request)"""
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
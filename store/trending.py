@@ -0,0 +1,169 @@
+"""
+Trending counters for the home page.
+
+Scores use forward exponential decay: a sale of ``q`` units at time ``t`` adds
+``q * 2 ** ((t - landmark) / half_life)`` to the product's score. Because every
+sale is weighted against the same fixed landmark, the relative order of scores
+equals the order of the classic decayed score at any read time, so scores can
+be bumped with a single ``F()`` update and read straight off an index.
+
+Sales are also counted per product per day (``ProductSalesDay``). The home
+page reads the buckets of the last ``TRENDING_WINDOW_DAYS`` to show how many
+units each trending product sold recently. Buckets that fall out of the
+window are pruned after the first recorded sale of each day (and by
+``manage.py rebuild_trending --prune-only``), so the table stays about
+window-days times products-sold rows.
+
+Moving ``TRENDING_LANDMARK`` (e.g. after many years, to keep the weights well
+inside float range) requires running ``manage.py rebuild_trending``.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, ProductSalesStats, ProductSalesDay
+
+DEFAULT_LANDMARK = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+PRUNED_KEY = 'trending:pruned:{}'
+
+
+def half_life_seconds():
+    return getattr(settings, 'TRENDING_HALF_LIFE_DAYS', 7) * 86400
+
+
+def window_days():
+    return getattr(settings, 'TRENDING_WINDOW_DAYS', 30)
+
+
+def landmark():
+    return getattr(settings, 'TRENDING_LANDMARK', DEFAULT_LANDMARK)
+
+
+def decay_weight(when):
+    """Weight of a sale made at ``when`` relative to the landmark"""
+    elapsed = (when - landmark()).total_seconds()
+    return 2.0 ** (elapsed / half_life_seconds())
+
+
+def current_score(stored_score, now=None):
+    """Convert a stored forward-decayed score into units as of ``now``"""
+    now = now or timezone.now()
+    return stored_score / decay_weight(now)
+
+
+def record_sales(lines, when=None, sign=1):
+    """
+    Apply sold quantities to the counters.
+
+    ``lines`` is an iterable of ``(product_id, quantity)`` pairs; quantities for
+    the same product are merged first so every product costs one UPDATE.
+    Pass ``sign=-1`` to take back a sale (e.g. a cancelled order), in which
+    case ``when`` must be the original order time.
+    """
+    when = when or timezone.now()
+    quantities = defaultdict(int)
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity or 0
+    quantities = {pid: qty for pid, qty in quantities.items() if qty}
+    if not quantities:
+        return
+
+    weight = decay_weight(when)
+    day = timezone.localdate(when)
+
+    # Make sure every counter row exists, then bump them in place
+    ProductSalesStats.objects.bulk_create(
+        [ProductSalesStats(product_id=pid) for pid in quantities],
+        ignore_conflicts=True,
+    )
+    ProductSalesDay.objects.bulk_create(
+        [ProductSalesDay(product_id=pid, day=day) for pid in quantities],
+        ignore_conflicts=True,
+    )
+    for product_id, quantity in quantities.items():
+        delta = sign * quantity
+        stats_update = {
+            'total_sold': F('total_sold') + delta,
+            'trending_score': F('trending_score') + delta * weight,
+        }
+        if sign > 0:
+            stats_update['last_sold_at'] = when
+        ProductSalesStats.objects.filter(product_id=product_id).update(**stats_update)
+        ProductSalesDay.objects.filter(product_id=product_id, day=day).update(
+            quantity=F('quantity') + delta
+        )
+    if cache.add(PRUNED_KEY.format(day), 1, 86400 * 2):
+        transaction.on_commit(prune_buckets)
+
+
+def revert_sales(rows):
+    """
+    Take back sales made at different times, e.g. a batch of cancelled orders.
+
+    ``rows`` is an iterable of ``(product_id, quantity, sold_at)``; each
+    product's stats cost one UPDATE and each touched day bucket one more,
+    however many orders the rows came from.
+    """
+    quantities = defaultdict(int)
+    scores = defaultdict(float)
+    days = defaultdict(int)
+    for product_id, quantity, when in rows:
+        if not quantity:
+            continue
+        quantities[product_id] += quantity
+        scores[product_id] += quantity * decay_weight(when)
+        days[product_id, timezone.localdate(when)] += quantity
+    for product_id, quantity in quantities.items():
+        ProductSalesStats.objects.filter(product_id=product_id).update(
+            total_sold=F('total_sold') - quantity,
+            trending_score=F('trending_score') - scores[product_id],
+        )
+    for (product_id, day), quantity in days.items():
+        ProductSalesDay.objects.filter(product_id=product_id, day=day).update(
+            quantity=F('quantity') - quantity
+        )
+
+
+def _window_start(days=None):
+    return timezone.localdate() - timedelta(days=(days or window_days()) - 1)
+
+
+def top_products_queryset(limit=10):
+    recent = ProductSalesDay.objects.filter(
+        product=OuterRef('pk'), day__gte=_window_start(),
+    ).values('product').annotate(quantity=Sum('quantity')).values('quantity')
+    return Product.objects.filter(
+        is_active=True,
+        sales_stats__trending_score__gt=0,
+    ).select_related('category').annotate(
+        total_sold=F('sales_stats__total_sold'),
+        sold_in_window=Coalesce(Subquery(recent), 0),
+    ).order_by('-sales_stats__trending_score')[:limit]
+
+
+def top_products(limit=10):
+    """Active products ordered by trending score, read from the score index"""
+    return list(top_products_queryset(limit))
+
+
+def sold_in_window(product_ids, days=None):
+    """Units sold per product over the last ``days`` day buckets"""
+    sold = defaultdict(int)
+    rows = ProductSalesDay.objects.filter(
+        day__gte=_window_start(days), product_id__in=product_ids
+    ).values_list('product_id', 'quantity')
+    for product_id, quantity in rows:
+        sold[product_id] += quantity
+    return dict(sold)
+
+
+def prune_buckets(days=None):
+    """Drop day buckets that fell out of the rolling window"""
+    deleted, _ = ProductSalesDay.objects.filter(day__lt=_window_start(days)).delete()
+    return deleted
@@ -1,20 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if getattr(settings, 'STORE_ASYNC_VIEWS', False):
+    from . import async_views as page_views
+else:
+    page_views = views
+
 app_name = 'store'
 
 urlpatterns = [
     # Frontend URLs
-    path('', views.home, name='home'),
-    path('category/<slug:category_slug>/', views.category_products, name='category_products'),
-    path('product/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('', page_views.home, name='home'),
+    path('category/<slug:category_slug>/', page_views.category_products, name='category_products'),
+    path('product/<slug:slug>/', page_views.product_detail, name='product_detail'),
     
     # Cart URLs
-    path('cart/', views.cart_view, name='cart_view'),
-    path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
-    path('cart/increment/<int:product_id>/', views.increment_cart, name='increment_cart'),
-    path('cart/decrement/<int:product_id>/', views.decrement_cart, name='decrement_cart'),
+    path('cart/', page_views.cart_view, name='cart_view'),
+    path('cart/add/<int:product_id>/', page_views.add_to_cart, name='add_to_cart'),
+    path('cart/remove/<int:product_id>/', page_views.remove_from_cart, name='remove_from_cart'),
+    path('cart/increment/<int:product_id>/', page_views.increment_cart, name='increment_cart'),
+    path('cart/decrement/<int:product_id>/', page_views.decrement_cart, name='decrement_cart'),
     
     # Checkout URLs
     path('checkout/', views.checkout, name='checkout'),
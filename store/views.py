@@ -1,128 +1,118 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.contrib.auth.decorators import login_required
-from .models import Category, Product, CartItem, Order, OrderItem
-from django.db.models import Q, Sum, Count
-from decimal import Decimal
-import random
-import string
+from django.contrib import messages
+from .models import Category, Product, Order
+from . import trending
+from . import checkout as checkout_service
+from .sampling import sampler
+from .cart import get_cart_store
+from .page_cache import cache_anonymous_page, tag_page, product_tag, category_tag, CATALOG, CATEGORIES
+from .conditional import conditional_get, tag_versions
+from . import storefront
 
+def fill_trending(trending_products, latest_products, limit=10):
+    """If not enough products sold, supplement with the newest arrivals"""
+    if len(trending_products) < limit:
+        trending_ids = {p.id for p in trending_products}
+        trending_products += [
+            p for p in latest_products if p.id not in trending_ids
+        ][:limit - len(trending_products)]
+    return trending_products
+
+@cache_anonymous_page
 def home(request):
     """Home page view"""
-    categories = Category.objects.all()
-    
-    # Get trending products (top 10 most sold products)
-    trending_products = Product.objects.filter(
-        is_active=True,
-        orderitem__isnull=False
-    ).annotate(
-        total_sold=Sum('orderitem__quantity')
-    ).order_by('-total_sold')[:10]
-    
-    # If not enough sold products, supplement with featured products
-    if trending_products.count() < 10:
-        featured_products = Product.objects.filter(
-            is_active=True
-        ).exclude(
-            id__in=[p.id for p in trending_products]
-        ).order_by('-created_at')[:10-trending_products.count()]
-        trending_products = list(trending_products) + list(featured_products)
+    tag_page(request, CATALOG, CATEGORIES)
     
     # Get latest products (newest arrivals)
-    latest_products = Product.objects.filter(is_active=True).order_by('-created_at')[:12]
+    latest_products = list(Product.objects.filter(is_active=True).select_related('category').order_by('-created_at')[:12])
     
-    # Get featured products for other sections if needed
-    featured_products = Product.objects.filter(is_active=True).order_by('?')[:8]  # Random 8 products
+    # Get trending products (top 10 by decayed sales score, read from the stats index)
+    trending_products = fill_trending(trending.top_products(limit=10), latest_products)
     
-    # Get cart count for authenticated users
-    cart_count = 0
-    if request.user.is_authenticated:
-        cart_count = CartItem.objects.filter(user=request.user).count()
+    # Get featured products for other sections if needed
+    featured_products = sampler.sample(8)  # Random 8 products, O(k) instead of ORDER BY RAND()
     
+    # Categories and cart count come from the storefront context processor
     context = {
-        'categories': categories,
         'trending_products': trending_products,  # For trendy section
+        'trending_window_days': trending.window_days(),
         'latest_products': latest_products,      # For latest products section
         'featured_products': featured_products,  # For featured section if needed
-        'cart_count': cart_count,
     }
     return render(request, 'store/home.html', context)
 
+def category_products_queryset(category_id):
+    """A category page's products, newest first (off ``product_cat_created_active_idx``)"""
+    return Product.objects.filter(
+        category_id=category_id, is_active=True
+    ).select_related('category').order_by('-created_at')
+
+@cache_anonymous_page
 def category_products(request, category_slug):
     """View to display products by category"""
     category = get_object_or_404(Category, slug=category_slug)
-    products = Product.objects.filter(category=category, is_active=True)
-    
-    # Get cart count for authenticated users
-    cart_count = 0
-    if request.user.is_authenticated:
-        cart_count = CartItem.objects.filter(user=request.user).count()
+    tag_page(request, category_tag(category.id), CATEGORIES)
+    products = category_products_queryset(category.id)
     
     context = {
         'category': category,
         'products': products,
-        'categories': Category.objects.all(),
-        'cart_count': cart_count,
     }
     return render(request, 'store/category_products.html', context)
 
+def product_detail_validators(request, slug):
+    row = Product.objects.filter(slug=slug, is_active=True).values_list(
+        'id', 'category_id', 'updated_at'
+    ).first()
+    if row is None:
+        return None, None
+    product_id, category_id, updated_at = row
+    parts = ['product', product_id, updated_at, *tag_versions(product_tag(product_id), category_tag(category_id), CATEGORIES)]
+    if request.user.is_authenticated:
+        # The page chrome shows this user's cart and orders
+        return parts + [request.user.pk, storefront.user_version(request.user.pk)], None
+    return parts, updated_at
+
+@conditional_get(product_detail_validators)
+@cache_anonymous_page
 def product_detail(request, slug):
     """Product detail view"""
     product = get_object_or_404(Product, slug=slug, is_active=True)
+    tag_page(request, product_tag(product.id), category_tag(product.category_id))
     
     context = {
         'product': product,
     }
     return render(request, 'store/product_detail.html', context)
 
-@login_required
 def add_to_cart(request, product_id):
-    """Add product to cart"""
+    """Add product to cart (session cart for anonymous visitors)"""
     product = get_object_or_404(Product, id=product_id)
+    cart = get_cart_store(request)
+    added = cart.add(product)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         # AJAX request
-        cart_item, created = CartItem.objects.get_or_create(
-            user=request.user,
-            product=product,
-            defaults={'quantity': 1}
-        )
-        
-        if not created:
-            if cart_item.quantity < product.stock:
-                cart_item.quantity += 1
-                cart_item.save()
-            else:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Product is out of stock!',
-                })
-        
-        cart_count = CartItem.objects.filter(user=request.user).count()
+        if added is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Product is out of stock!',
+            })
         
         return JsonResponse({
             'status': 'success',
             'message': 'Product added to cart!',
-            'cart_count': cart_count
+            'cart_count': cart.count()
         })
     
     # Non-AJAX request (fallback)
-    cart_item, created = CartItem.objects.get_or_create(
-        user=request.user,
-        product=product,
-        defaults={'quantity': 1}
-    )
-    
-    if not created and cart_item.quantity < product.stock:
-        cart_item.quantity += 1
-        cart_item.save()
-    
     return redirect('store:cart_view')
 
-@login_required
 def cart_view(request):
     """Display cart items"""
-    cart_items = CartItem.objects.filter(user=request.user)
+    cart_items = get_cart_store(request).lines()
     total = sum(item.total_price() for item in cart_items)
     
     context = {
@@ -131,37 +121,31 @@ def cart_view(request):
     }
     return render(request, 'store/cart.html', context)
 
-@login_required
 def remove_from_cart(request, product_id):
     """Remove item from cart"""
-    cart_item = get_object_or_404(CartItem, user=request.user, product_id=product_id)
-    cart_item.delete()
+    cart = get_cart_store(request)
+    if cart.quantity(product_id) is None:
+        raise Http404('Product is not in the cart')
+    cart.remove(product_id)
     return redirect('store:cart_view')
 
-@login_required
 def increment_cart(request, product_id):
     """Increase item quantity in cart"""
-    cart_item = get_object_or_404(CartItem, user=request.user, product_id=product_id)
-    if cart_item.quantity < cart_item.product.stock:
-        cart_item.quantity += 1
-        cart_item.save()
+    product = get_object_or_404(Product, id=product_id)
+    if get_cart_store(request).change(product_id, 1, max_quantity=product.stock) is None:
+        raise Http404('Product is not in the cart')
     return redirect('store:cart_view')
 
-@login_required
 def decrement_cart(request, product_id):
-    """Decrease item quantity in cart"""
-    cart_item = get_object_or_404(CartItem, user=request.user, product_id=product_id)
-    if cart_item.quantity > 1:
-        cart_item.quantity -= 1
-        cart_item.save()
-    else:
-        cart_item.delete()
+    """Decrease item quantity in cart (removes the line at zero)"""
+    if get_cart_store(request).change(product_id, -1) is None:
+        raise Http404('Product is not in the cart')
     return redirect('store:cart_view')
 
 @login_required
 def checkout(request):
     """Checkout page"""
-    cart_items = CartItem.objects.filter(user=request.user)
+    cart_items = get_cart_store(request).lines()
     total = sum(item.total_price() for item in cart_items)
     
     context = {
@@ -174,36 +158,16 @@ def checkout(request):
 def place_order(request):
     """Place order and create order record"""
     if request.method == 'POST':
-        cart_items = CartItem.objects.filter(user=request.user)
-        
-        if not cart_items.exists():
-            return redirect('store:cart_view')
-        
-        # Generate unique order ID
-        order_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-        
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            order_id=order_id,
-            is_paid=True  # Assuming payment is successful for demo
-        )
-        
-        # Create order items and update stock
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
+        try:
+            checkout_service.place_order(
+                request.user,
+                is_paid=True  # Assuming payment is successful for demo
             )
-            
-            # Update product stock
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.save()
-        
-        # Clear cart
-        cart_items.delete()
+        except checkout_service.EmptyCartError:
+            return redirect('store:cart_view')
+        except checkout_service.InsufficientStockError as e:
+            messages.error(request, str(e))
+            return redirect('store:cart_view')
         
         return redirect('store:order_history')
     
@@ -212,7 +176,7 @@ def place_order(request):
 @login_required
 def order_history(request):
     """Display user's order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).for_display().order_by('-created_at')
     
     context = {
         'orders': orders,
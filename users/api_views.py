@@ -27,7 +27,7 @@ def user_dashboard(request):
     from store.serializers import OrderSerializer
     
     cart_count = CartItem.objects.filter(user=user).count()
-    recent_orders = Order.objects.filter(user=user).order_by('-created_at')[:5]
+    recent_orders = Order.objects.filter(user=user).for_display().order_by('-created_at')[:5]
     
     return Response({
         'user': UserProfileSerializer(user).data,
@@ -0,0 +1,249 @@
+"""
+Cached user lookups for authentication.
+
+Every authenticated request resolves its user from an id (the session's, or
+a JWT's ``user_id`` claim), which is a ``users.User`` query each time.
+``get_user`` answers from two short-lived caches instead:
+
+* this process' own dict, for ``AUTH_CACHE_LOCAL_SECONDS``, with no round
+  trip at all;
+* the shared cache, for ``AUTH_CACHE_SECONDS``, keyed by a per-user token
+  version.
+
+The version is bumped, and this process' entry dropped, whenever the user is
+saved (a password change, deactivation, ``is_staff`` and so on; only
+``last_login``-only saves are left alone), deleted, or their groups or
+permissions change. With a shared cache (Redis, Memcached) other processes
+see the new version at once and keep their local copy for at most
+``AUTH_CACHE_LOCAL_SECONDS`` after that, which bounds how long a
+deactivated user or a changed password can still authenticate there. The
+default local-memory cache isn't shared: the bump never reaches other
+processes, which go on serving their own cached copy for up to
+``AUTH_CACHE_SECONDS``. Bulk ``update()`` bypasses the signals, so call
+``invalidate()`` after one.
+
+The local dict keeps at most ``AUTH_CACHE_LOCAL_MAX_ENTRIES`` users, least
+recently used first out; an expired entry is dropped when it is next read.
+
+``CachedModelBackend`` plugs this into session authentication (Django's and
+DRF's ``SessionAuthentication``, which asks Django) and
+``CachedJWTAuthentication`` into ``SIMPLE_JWT``. Sessions themselves are
+read through the cache by the ``cached_db`` session engine.
+
+Hits and misses are counted per process and added to shared counters every
+``METRICS_PUBLISH_SECONDS``; ``metrics()`` and ``manage.py auth_cache_stats``
+report them.
+"""
+import copy
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+METRICS_PREFIX = 'auth-cache:metrics:'
+COUNTERS = ('local_hits', 'shared_hits', 'misses')
+METRICS_PUBLISH_SECONDS = 10
+# Per-instance caches that must not be shared between requests
+UNSHARED_ATTRIBUTES = ('_perm_cache', '_user_perm_cache', '_group_perm_cache')
+
+_local = OrderedDict()
+_lock = threading.Lock()
+_counts = Counter()
+_published = time.monotonic()
+
+
+def _shared_timeout():
+    return getattr(settings, 'AUTH_CACHE_SECONDS', 60)
+
+
+def _local_timeout():
+    return getattr(settings, 'AUTH_CACHE_LOCAL_SECONDS', 5)
+
+
+def _local_max_entries():
+    return getattr(settings, 'AUTH_CACHE_LOCAL_MAX_ENTRIES', 10000)
+
+
+def _version_key(user_id):
+    return f'auth-cache:user:{user_id}:version'
+
+
+def token_version(user_id):
+    """Current version of ``user_id``'s cached principal; changes on every invalidation"""
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Clock-seeded so a re-created counter never repeats an old version
+        cache.add(_version_key(user_id), time.time_ns() // 1000, None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def invalidate(user_id):
+    """Make every process look ``user_id`` up again"""
+    with _lock:
+        _local.pop(user_id, None)
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # Never cached: nothing to invalidate
+        token_version(user_id)
+
+
+def _count(name):
+    global _published
+    with _lock:
+        _counts[name] += 1
+        if time.monotonic() - _published < METRICS_PUBLISH_SECONDS:
+            return
+        counts = dict(_counts)
+        _counts.clear()
+        _published = time.monotonic()
+    for counter, amount in counts.items():
+        key = METRICS_PREFIX + counter
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            if not cache.add(key, amount, None):
+                cache.incr(key, amount)
+
+
+def get_user(user_id):
+    """The user with primary key ``user_id``, or ``None``"""
+    # JWT claims carry the id as a string
+    user_id = get_user_model()._meta.pk.to_python(user_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(user_id)
+        if entry is not None and entry[0] <= now:
+            del _local[user_id]
+            entry = None
+        elif entry is not None:
+            _local.move_to_end(user_id)
+    if entry is not None:
+        _count('local_hits')
+        return copy.copy(entry[1])
+
+    key = f'auth-cache:user:{user_id}:v{token_version(user_id)}'
+    user = cache.get(key)
+    if user is not None:
+        _count('shared_hits')
+    else:
+        _count('misses')
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is None:
+            return None
+        for attribute in UNSHARED_ATTRIBUTES:
+            user.__dict__.pop(attribute, None)
+        cache.set(key, user, _shared_timeout())
+    with _lock:
+        _local[user_id] = (now + _local_timeout(), user)
+        _local.move_to_end(user_id)
+        while len(_local) > _local_max_entries():
+            _local.popitem(last=False)
+    return copy.copy(user)
+
+
+def metrics():
+    """Hit and miss counts of every process, plus this one's not yet published"""
+    values = cache.get_many([METRICS_PREFIX + name for name in COUNTERS])
+    with _lock:
+        stats = {name: values.get(METRICS_PREFIX + name, 0) + _counts[name] for name in COUNTERS}
+    lookups = sum(stats.values())
+    stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+    return stats
+
+
+def reset_metrics():
+    with _lock:
+        _counts.clear()
+    cache.delete_many([METRICS_PREFIX + name for name in COUNTERS])
+
+
+def clear_local():
+    with _lock:
+        _local.clear()
+
+
+# -----------------------
+# Authentication
+# -----------------------
+class CachedModelBackend(ModelBackend):
+    """``ModelBackend`` whose per-request ``get_user`` is served from the cache"""
+
+    def get_user(self, user_id):
+        user = get_user(user_id)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` resolving the token's user from the cache"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        if jwt_settings.USER_ID_FIELD == 'id':
+            user = get_user(user_id)
+        else:
+            user = self.user_model.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if jwt_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
+
+
+# -----------------------
+# Invalidation (connected in UsersConfig.ready)
+# -----------------------
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate(instance.pk)
+
+
+def user_deleted(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+def memberships_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate(instance.pk)
+        return
+    # A group's or permission's side: pk_set holds users, except on clear
+    if action == 'pre_clear':
+        pk_set = sender.objects.filter(**{instance._meta.model_name: instance.pk}).values_list('user_id', flat=True)
+    for user_id in pk_set:
+        invalidate(user_id)
+
+
+def connect_signals():
+    User = get_user_model()
+    post_save.connect(user_saved, sender=User, dispatch_uid='users.auth_cache.saved')
+    post_delete.connect(user_deleted, sender=User, dispatch_uid='users.auth_cache.deleted')
+    for through in (User.groups.through, User.user_permissions.through):
+        m2m_changed.connect(memberships_changed, sender=through, dispatch_uid=f'users.auth_cache.{through.__name__}')
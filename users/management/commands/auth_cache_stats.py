@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users import auth_cache
+
+
+class Command(BaseCommand):
+    help = 'Show how often authentication found the user in the per-process or shared cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters afterwards')
+
+    def handle(self, *args, **options):
+        stats = auth_cache.metrics()
+        self.stdout.write(f"Per-process hits: {stats['local_hits']}")
+        self.stdout.write(f"Shared cache hits: {stats['shared_hits']}")
+        self.stdout.write(f"Misses (database): {stats['misses']}")
+        self.stdout.write(f"Hit rate: {stats['hit_rate']:.1%}")
+        if options['reset']:
+            auth_cache.reset_metrics()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
@@ -1,3 +1,119 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store.models import Category, Product, Order, OrderItem
+from . import auth_cache
+from .models import User
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dash@example.com', 'pw')
+        category = Category.objects.create(name='Men', slug='men')
+        self.products = [
+            Product.objects.create(category=category, name=f'P{i}', slug=f'p-{i}', price=5, stock=10)
+            for i in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_orders(self, count, lines):
+        for i in range(count):
+            order = Order.objects.create(user=self.user, order_id=f'{Order.objects.count():010d}')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=product.price)
+                for product in self.products[:lines]
+            ])
+
+    def dashboard_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('users:api_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_recent_orders_query_count_is_constant(self):
+        self.add_orders(count=1, lines=1)
+        baseline = self.dashboard_queries()
+
+        self.add_orders(count=4, lines=4)
+        self.assertEqual(self.dashboard_queries(), baseline)
+
+
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        auth_cache.clear_local()
+        auth_cache.reset_metrics()
+        self.user = User.objects.create_user('auth@example.com', 'pw')
+        self.url = reverse('users:api_profile')
+
+    def jwt_client(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        return client
+
+    def lookups(self, client):
+        """Status code and the queries that resolved the principal"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(self.url)
+        tables = ('"users_user"', '"django_session"')
+        auth = [q['sql'] for q in ctx.captured_queries if 'WHERE' in q['sql'] and any(
+            q['sql'].split('WHERE')[0].rstrip().endswith(f'FROM {table}') for table in tables
+        )]
+        return response.status_code, len(auth)
+
+    def test_jwt_user_is_looked_up_once(self):
+        client = self.jwt_client()
+        self.assertEqual(self.lookups(client), (200, 1))
+        self.assertEqual(self.lookups(client), (200, 0))
+        # Another process: only the shared cache
+        auth_cache.clear_local()
+        self.assertEqual(self.lookups(client), (200, 0))
+        stats = auth_cache.metrics()
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (1, 1, 1))
+
+    def test_deactivation_and_staff_changes_take_effect_at_once(self):
+        client = self.jwt_client()
+        self.lookups(client)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertTrue(auth_cache.get_user(self.user.pk).is_staff)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.lookups(client)[0], 401)
+
+    def test_session_is_resolved_from_the_cache(self):
+        client = Client()
+        client.force_login(self.user)
+        self.assertEqual(self.lookups(client)[0], 200)
+        self.assertEqual(self.lookups(client), (200, 0))
+        # The password change bumps the version, so the old session hash stops matching
+        self.user.set_password('new')
+        self.user.save()
+        self.assertIn(self.lookups(client)[0], (401, 403))
+
+    def test_last_login_saves_keep_the_entry(self):
+        auth_cache.get_user(self.user.pk)
+        version = auth_cache.token_version(self.user.pk)
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(auth_cache.token_version(self.user.pk), version)
+
+    @override_settings(AUTH_CACHE_LOCAL_MAX_ENTRIES=2)
+    def test_local_entries_expire_and_stay_bounded(self):
+        others = [User.objects.create_user(f'other{i}@example.com', 'pw') for i in range(2)]
+        with mock.patch('users.auth_cache.time.monotonic', return_value=1000.0):
+            auth_cache.get_user(self.user.pk)
+        # Expired: dropped on read, then cached afresh
+        with mock.patch('users.auth_cache.time.monotonic', return_value=2000.0):
+            auth_cache.get_user(self.user.pk)
+            self.assertEqual(list(auth_cache._local), [self.user.pk])
+            for other in others:
+                auth_cache.get_user(other.pk)
+        self.assertEqual(list(auth_cache._local), [other.pk for other in others])